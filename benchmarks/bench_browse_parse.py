@@ -0,0 +1,45 @@
+"""Microbenchmark of browse page parsing
+
+Compares extract_ranked_game_ids against the BeautifulSoup implementation it
+replaced, over the saved browse page fixtures.
+
+Usage:
+    python -m benchmarks.bench_browse_parse [--repeat N]
+"""
+
+import argparse
+import re
+from pathlib import Path
+from timeit import repeat
+from bs4 import BeautifulSoup
+from dags.py_modules.extract_game_ids import extract_ranked_game_ids
+
+FIXTURES = sorted(Path('tests/assets').glob('*browse_page*.html'))
+
+
+def soup_ranked_game_ids(text: str) -> list:
+    """BeautifulSoup implementation of extract_ranked_game_ids, as a baseline"""
+    id_list = []
+    for row in BeautifulSoup(text, features='html.parser').find_all(id="row_"):
+        rank = row.find(class_='collection_rank')
+        if rank is not None and rank.a:
+            href = row.find(class_='primary').attrs['href']
+            id_list.append(re.search(r'/boardgame/(\d+)/', href).group(1))
+    return id_list
+
+
+def main(repeat_count: int = 5, number: int = 10) -> None:
+    """Time both parsers on each fixture, printing the best time per page"""
+    for fixture in FIXTURES:
+        text = fixture.read_text(encoding='utf-8')
+        assert extract_ranked_game_ids(text) == soup_ranked_game_ids(text), f'{fixture.name}: ids differ'
+        print(fixture.name)
+        for name, parser in [('beautifulsoup', soup_ranked_game_ids), ('lxml', extract_ranked_game_ids)]:
+            best = min(repeat(lambda: parser(text), repeat=repeat_count, number=number)) / number
+            print(f'  {name:<14} {best * 1000:8.2f} ms/page')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--repeat', type=int, default=5, help='number of timing repeats')
+    main(parser.parse_args().repeat)
@@ -0,0 +1,93 @@
+"""Benchmark of DAG file parsing
+
+Times how long the DAG processor takes to parse bgg_pipeline_dag.py, the cost
+paid by the scheduler on every parse of the dags folder. Each run is a fresh
+interpreter, so module imports are not cached between runs. Airflow itself is
+imported before timing starts; the parse is timed with DagBag, as the DAG
+processor does, and reports the wall and CPU time, the number of Variable.get
+calls and which heavy modules the DAG file imported.
+
+Variables are read from AIRFLOW_VAR_* environment variables set from
+configs/airflow_variables.json, so no metadata database is needed. Requires
+Airflow and the providers the DAG uses to be installed.
+
+Usage:
+    python -m benchmarks.bench_dag_parse [--runs 10] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+DAG_FILE = Path('dags/bgg_pipeline_dag.py')
+VARIABLES_FILE = Path('configs/airflow_variables.json')
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'lxml', 'bs4', 'psycopg2', 'requests', 'scipy']
+
+# Run in a fresh interpreter, printing the measurements as JSON
+CHILD = '''
+import json, sys, time
+from airflow.models import DagBag, Variable
+
+calls = []
+get = Variable.get.__func__
+Variable.get = classmethod(lambda cls, key, *args, **kwargs: calls.append(key) or get(cls, key, *args, **kwargs))
+before = set(sys.modules)
+wall, cpu = time.perf_counter(), time.process_time()
+bag = DagBag(dag_folder=sys.argv[1], include_examples=False)
+wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+loaded = {name.split('.')[0] for name in set(sys.modules) - before}
+print(json.dumps({'wall': wall, 'cpu': cpu, 'dags': len(bag.dags), 'errors': list(bag.import_errors.values()),
+                  'variable_gets': len(calls), 'heavy_modules': sorted(loaded & set(sys.argv[2:]))}))
+'''
+
+
+def parse_once(env: Dict[str, str]) -> dict:
+    """Parse the DAG file in a new interpreter and return its measurements"""
+    result = subprocess.run([sys.executable, '-c', CHILD, str(DAG_FILE), *HEAVY_MODULES],
+                            env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def variable_env() -> Dict[str, str]:
+    """Environment with the Airflow Variables of the config file set as AIRFLOW_VAR_*"""
+    env = dict(os.environ)
+    for key, value in json.loads(VARIABLES_FILE.read_text()).items():
+        env[f'AIRFLOW_VAR_{key.upper()}'] = value if isinstance(value, str) else json.dumps(value)
+    return env
+
+
+def main(runs: int = 10) -> dict:
+    """Parse the DAG file runs times, printing and returning the median timings"""
+    env = variable_env()
+    samples: List[dict] = [parse_once(env) for _ in range(runs)]
+    errors = samples[0]['errors']
+    if errors:
+        raise RuntimeError(f'{DAG_FILE} failed to parse: {errors}')
+
+    result = {
+        'runs': runs,
+        'wall_ms': statistics.median(sample['wall'] for sample in samples) * 1000,
+        'cpu_ms': statistics.median(sample['cpu'] for sample in samples) * 1000,
+        'variable_gets': samples[0]['variable_gets'],
+        'heavy_modules': samples[0]['heavy_modules']
+    }
+    print(f"{DAG_FILE}: {result['wall_ms']:.1f} ms wall, {result['cpu_ms']:.1f} ms CPU (median of {runs}), "
+          f"{result['variable_gets']} Variable.get calls, heavy modules: {result['heavy_modules'] or 'none'}")
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--runs', type=int, default=10, help='number of parses, each in a new interpreter')
+    parser.add_argument('--output', type=Path, help='JSON file to save results to')
+    args = parser.parse_args()
+
+    results = main(args.runs)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(results, indent=2))
@@ -0,0 +1,253 @@
+"""End-to-end pipeline benchmark on synthetic data
+
+Runs each pipeline stage on synthetic games of the given sizes: scraping browse
+pages and fetching thing batches from a local stub server, parsing, building
+the output tables, writing CSV files, computing game similarities and bulk
+loading the tables. Loading uses an in-process SQLite database unless a
+Postgres DSN is given, in which case the tables are created from dags/sql and
+loaded with COPY.
+
+Results are written as JSON, one entry per size with the wall time, CPU time
+and peak RSS of each stage, so runs on different commits can be compared with
+--compare.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--games 1000 25000 150000] [--output results.json]
+    python -m benchmarks.bench_pipeline --games 25000 --compare baseline.json
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from contextlib import closing
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional
+from requests import Session
+from benchmarks import synthetic
+from benchmarks.stub_server import StubServer
+from dags.py_modules import extract_game_ids, extract_xml, finalize, load, metrics, similarity, transform_xml
+from dags.py_modules.tables import DEPENDENT_TABLES, PARENT_TABLES, PRIMARY_KEYS, SCHEMA
+
+SQL_DIR = Path('dags/sql')
+
+SQLITE_TYPES = {'int': 'INTEGER', 'real': 'REAL', 'bool': 'BOOLEAN', 'text': 'TEXT'}
+
+# A stage is reported as a regression when it is this much slower than the baseline,
+# and by more than the noise floor in seconds
+REGRESSION_THRESHOLD = 0.1
+NOISE_FLOOR = 0.05
+
+
+def git_commit() -> str:
+    """Current commit hash, or 'unknown' outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def stub_responder(ids: List[str], xml_dir: Path, batch_size: int):
+    """Serve browse pages of ids and thing batches from pre-generated batch files"""
+    def respond(path: str, query: Dict[str, str]):
+        if path.startswith('/browse/boardgame/page/'):
+            page_num = int(path.rsplit('/', 1)[1])
+            return 200, synthetic.browse_page(page_num, ids).encode(), {}
+        if path == '/xmlapi2/thing':
+            num = (int(query['id'].split(',', 1)[0]) - synthetic.FIRST_GAME_ID) // batch_size
+            with gzip.open(xml_dir / f'bgg_games_batch_{num}.xml.gz') as file:
+                return 200, file.read(), {'Content-Type': 'text/xml'}
+        return 404, b'', {}
+    return respond
+
+
+def load_sqlite(csv_dir: Path) -> None:
+    """Load the CSV files into a fresh SQLite database, a stand-in for Postgres"""
+    with closing(sqlite3.connect(':memory:')) as conn:
+        for name, columns in SCHEMA.items():
+            column_defs = ', '.join(f'{column} {SQLITE_TYPES[sql_type]}' for column, sql_type in columns.items())
+            conn.execute(f'CREATE TABLE {name} ({column_defs}, PRIMARY KEY ({", ".join(PRIMARY_KEYS[name])}))')
+        for name in load_order():
+            with (csv_dir / f'{name}.csv').open(encoding='utf-8', newline='') as file:
+                reader = csv.reader(file)
+                columns = next(reader)
+                conn.executemany(f'INSERT INTO {name} ({", ".join(columns)}) '
+                                 f'VALUES ({", ".join("?" * len(columns))})', reader)
+        conn.commit()
+
+
+def load_postgres(csv_dir: Path, dsn: str) -> None:
+    """Recreate the tables in a Postgres database, COPY the CSV files into them and finalize them"""
+    import psycopg2
+
+    with closing(psycopg2.connect(dsn)) as conn:
+        with conn.cursor() as cursor:
+            for script in ['drop_tables.sql', 'create_tables.sql']:
+                cursor.execute((SQL_DIR / script).read_text())
+        conn.commit()
+        for name in load_order():
+            load.copy_table(csv_dir / f'{name}.csv', conn)
+    finalize.main(partial(psycopg2.connect, dsn))
+
+
+def load_order() -> List[str]:
+    """Table names, with tables referenced by foreign keys first"""
+    return PARENT_TABLES + DEPENDENT_TABLES
+
+
+def run(num_games: int,
+        batch_size: int = 1200,
+        workers: int = 3,
+        seed: int = 0,
+        postgres_dsn: Optional[str] = None) -> dict:
+    """Run every stage on num_games synthetic games
+
+    Returns:
+        dict: Stage timings and row counts
+    """
+    with tempfile.TemporaryDirectory() as tmp, metrics.recording() as report:
+        tmp_dir = Path(tmp)
+        source_dir, xml_dir, csv_dir = tmp_dir / 'source', tmp_dir / 'xml', tmp_dir / 'csv'
+        for directory in [source_dir, xml_dir, csv_dir]:
+            directory.mkdir()
+
+        with report.stage('generate'):
+            synthetic.write_batches(source_dir, num_games, batch_size, seed)
+            ids = synthetic.game_ids(num_games)
+
+        with StubServer(stub_responder(ids, source_dir, batch_size)) as server:
+            with report.stage('fetch_ids'):
+                max_pages = num_games // 100 + 2
+                with Session() as session:
+                    scraped = [game_id for page in extract_game_ids.scrape_browse_pages(
+                        max_pages, wait_time=0, workers=workers, session=session, base_url=server.url)
+                        for game_id in page]
+            assert scraped == ids, 'scraped game ids differ from the generated ones'
+
+            with report.stage('fetch_xml'):
+                extract_xml.download_game_pages(ids, batch_size, xml_dir, workers, base_url=f'{server.url}/xmlapi2')
+
+        with report.stage('parse'):
+            tables = transform_xml.merge_tables(transform_xml.transform_files(transform_xml.batch_files(xml_dir)))
+
+        with report.stage('transform'):
+            dataframes = {name: table.to_dataframe() for name, table in tables.items()}
+        del tables
+
+        with report.stage('write_csv'):
+            for name, dataframe in dataframes.items():
+                report.count(f'rows.{name}', len(dataframe))
+                transform_xml.save_df(dataframe, csv_dir / f'{name}.csv')
+
+        with report.stage('similarity'):
+            pairs = {name: (dataframes[f'game_{name}']['game_id'].to_numpy(),
+                            dataframes[f'game_{name}'][f'{name}_id'].to_numpy())
+                     for name in similarity.SIMILARITY_CLASSES}
+            for name in similarity.COOCCURRENCE_CLASSES:
+                similarity.cooccurrence(pairs[name])
+            _, matrix = similarity.feature_matrix(pairs)
+            report.count('rows.game_similarity', sum(len(rows) for rows, *_ in similarity.top_k_similar(matrix)))
+        del dataframes
+
+        with report.stage('load'):
+            if postgres_dsn:
+                load_postgres(csv_dir, postgres_dsn)
+            else:
+                load_sqlite(csv_dir)
+
+    result = report.to_dict()
+    for stage in result['stages'].values():
+        stage['games_per_s'] = round(num_games / stage['wall_time']) if stage['wall_time'] else None
+    return {
+        'games': num_games,
+        'stages': result['stages'],
+        'rows': {name.split('.', 1)[1]: value for name, value in result['counters'].items()
+                 if name.startswith('rows.')},
+        'api': {name: value for name, value in result['counters'].items() if not name.startswith('rows.')}
+    }
+
+
+def compare(results: dict, baseline: dict) -> List[str]:
+    """Describe the change in wall time of each stage against a baseline run
+
+    Returns:
+        list: Stages that regressed by more than REGRESSION_THRESHOLD and NOISE_FLOOR
+    """
+    base_runs = {base_run['games']: base_run for base_run in baseline['runs']}
+    regressions = []
+    print(f'\nCompared with {baseline["commit"]}:')
+    for run_result in results['runs']:
+        base_run = base_runs.get(run_result['games'])
+        if base_run is None:
+            continue
+        for stage, timing in run_result['stages'].items():
+            base_time = base_run['stages'].get(stage, {}).get('wall_time')
+            if not base_time or stage == 'generate':
+                continue
+            change = timing['wall_time'] / base_time - 1
+            flag = ''
+            if change > REGRESSION_THRESHOLD and timing['wall_time'] - base_time > NOISE_FLOOR:
+                flag = '  REGRESSION'
+                regressions.append(f'{run_result["games"]}:{stage}')
+            print(f'  {run_result["games"]:>7} {stage:<10} {base_time:8.3f}s -> {timing["wall_time"]:8.3f}s '
+                  f'{change:+7.1%}{flag}')
+    return regressions
+
+
+def main(sizes: List[int],
+         output: Optional[Path] = None,
+         baseline: Optional[Path] = None,
+         batch_size: int = 1200,
+         workers: int = 3,
+         seed: int = 0,
+         postgres_dsn: Optional[str] = None) -> int:
+    """Benchmark every size, save the results and compare them with a baseline
+
+    Returns:
+        int: Exit status, 1 if any stage regressed against the baseline
+    """
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'batch_size': batch_size,
+        'workers': workers,
+        'loader': 'postgres' if postgres_dsn else 'sqlite',
+        'runs': []
+    }
+    for num_games in sizes:
+        run_result = run(num_games, batch_size, workers, seed, postgres_dsn)
+        results['runs'].append(run_result)
+        print(f'\n{num_games} games')
+        for stage, timing in run_result['stages'].items():
+            print(f'  {stage:<10} {timing["wall_time"]:8.3f}s wall {timing["cpu_time"]:8.3f}s cpu '
+                  f'{timing["peak_rss_mb"]:8.1f} MiB')
+
+    if output is not None:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+    if baseline is not None:
+        return 1 if compare(results, json.loads(baseline.read_text())) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--games', type=int, nargs='+', default=[1000], help='numbers of games to benchmark')
+    parser.add_argument('--output', type=Path, help='JSON file to save results to')
+    parser.add_argument('--compare', type=Path, help='JSON results of a baseline run to compare with')
+    parser.add_argument('--batch-size', type=int, default=1200, help='games per thing request')
+    parser.add_argument('--workers', type=int, default=3, help='concurrent requests')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--postgres-dsn', help='load into this Postgres database instead of SQLite')
+    args = parser.parse_args()
+    sys.exit(main(args.games, args.output, args.compare, args.batch_size, args.workers, args.seed,
+                  args.postgres_dsn))
@@ -0,0 +1,53 @@
+"""Local HTTP server standing in for BGG.com in benchmarks and tests"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Callable, Dict, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# (path, query params) -> (status code, body, headers). A Content-Length header
+# longer than the body makes the server close the connection mid-body.
+Responder = Callable[[str, Dict[str, str]], Tuple[int, bytes, Dict[str, str]]]
+
+
+class StubServer:
+    """Serve responses from a responder function on a local port
+
+    Use as a context manager; `url` is the root URL of the running server and
+    `requests` records the path and query of every request received.
+    """
+
+    def __init__(self, responder: Responder):
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                parts = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+                stub.requests.append((parts.path, query))
+                status, body, headers = responder(parts.path, query)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                if 'Content-Length' not in headers:
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+
+    def __enter__(self) -> 'StubServer':
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,144 @@
+"""Synthetic BGG data for benchmarks
+
+Generates BGGXMLAPI2 `thing` XML and browse page HTML shaped like the real
+responses, deterministically from a seed, so benchmark runs at any size are
+reproducible without network access.
+"""
+
+import gzip
+import random
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+from xml.sax.saxutils import quoteattr
+from dags.py_modules.transform_xml import KICKSTARTER_FAMILY_ID
+
+# Game ids start here, to look like real BGG ids
+FIRST_GAME_ID = 1000
+
+# Class type -> (number of distinct classes per 1000 games, links per game)
+CLASS_SHAPES = {
+    'mechanic': (40, (1, 8)),
+    'category': (20, (1, 5)),
+    'designer': (300, (1, 2)),
+    'artist': (300, (0, 3)),
+    'publisher': (400, (1, 10))
+}
+
+WORDS = ('game players cards tiles board dice worker placement engine building resources victory points '
+         'round turn action market trade explore combat cooperative campaign scenario deck hand draw').split()
+
+# Real descriptions are double-escaped, with entities such as &amp;#10; for newlines
+PARAGRAPH_BREAK = '&amp;#10;&amp;#10;'
+
+BROWSE_ROW = """<tr id='row_'>
+\t\t\t<td class='collection_rank' align='center' >
+\t\t\t<a name="{rank}"></a>\t\t\t{rank}
+\t\t\t\t\t</td>
+\t\t\t<td class='collection_thumbnail'>
+\t\t\t<a href="/boardgame/{id}/{slug}" ><img alt="Board Game: {title}" src="thumb.jpg"></a>
+\t\t</td>
+\t\t\t<td id='CEcell_objectname{rank}' class="collection_objectname browse">
+\t<div id='results_objectname{rank}' style='z-index:1000;' onclick=''>
+\t\t\t\t\t<a href="/boardgame/{id}/{slug}" class='primary' >{title}</a>
+\t\t\t\t\t\t\t<span class='smallerfont dull'>({year})</span>
+\t</div>
+\t\t</td>
+\t\t\t<td class='collection_bggrating' align='center'>{rating}</td>
+</tr>
+"""
+
+
+def game_ids(num_games: int) -> List[str]:
+    """Ids of num_games synthetic games, in rank order"""
+    return [str(game_id) for game_id in range(FIRST_GAME_ID, FIRST_GAME_ID + num_games)]
+
+
+def class_pools(num_games: int) -> Dict[str, List[Tuple[int, str]]]:
+    """(id, name) of the classes of each type that games link to"""
+    pools = {}
+    for offset, (name, (per_thousand, _)) in enumerate(CLASS_SHAPES.items()):
+        size = max(10, per_thousand * num_games // 1000)
+        pools[name] = [(offset * 10 ** 6 + num, f'{name.title()} {num}') for num in range(1, size + 1)]
+    return pools
+
+
+def _title(rng: random.Random) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+
+
+def _description(rng: random.Random) -> str:
+    paragraphs = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 120))).capitalize() + '.'
+                  for _ in range(rng.randint(1, 6))]
+    return PARAGRAPH_BREAK.join(paragraphs).replace(' cards ', ' &amp;quot;cards&amp;quot; ')
+
+
+def game_item(game_id: int, pools: Dict[str, List[Tuple[int, str]]], seed: int = 0) -> str:
+    """XML of one game item, as returned in a thing response with stats=1"""
+    rng = random.Random(seed * 10 ** 9 + game_id)
+    min_players = rng.randint(1, 4)
+    min_playtime = rng.choice([15, 30, 45, 60, 90])
+    lines = [f'<item type="boardgame" id="{game_id}">',
+             f'<name type="primary" sortindex="1" value={quoteattr(_title(rng))} />']
+    lines.extend(f'<name type="alternate" sortindex="1" value={quoteattr(_title(rng))} />'
+                 for _ in range(rng.randint(0, 3)))
+    lines.append(f'<description>{_description(rng)}</description>')
+    for tag, value in [('yearpublished', rng.randint(1950, 2023)),
+                       ('minplayers', min_players),
+                       ('maxplayers', min_players + rng.randint(0, 4)),
+                       ('playingtime', min_playtime * 2),
+                       ('minplaytime', min_playtime),
+                       ('maxplaytime', min_playtime * 2),
+                       ('minage', rng.choice([8, 10, 12, 14]))]:
+        lines.append(f'<{tag} value="{value}" />')
+    for name, (_, (low, high)) in CLASS_SHAPES.items():
+        for class_id, class_name in rng.sample(pools[name], rng.randint(low, high)):
+            lines.append(f'<link type="boardgame{name}" id="{class_id}" value={quoteattr(class_name)} />')
+    if rng.random() < 0.1:
+        lines.append(f'<link type="boardgamefamily" id="{KICKSTARTER_FAMILY_ID}" value="Crowdfunding: Kickstarter" />')
+    ratings = rng.randint(30, 100000)
+    lines.extend([
+        '<statistics page="1"><ratings>',
+        f'<usersrated value="{ratings}" />',
+        f'<average value="{rng.uniform(5, 9):.5f}" />',
+        f'<bayesaverage value="{rng.uniform(5, 8.5):.5f}" />',
+        f'<stddev value="{rng.uniform(0.8, 2):.5f}" />',
+        f'<owned value="{ratings * rng.randint(1, 3)}" />',
+        f'<wishing value="{ratings // rng.randint(2, 10)}" />',
+        f'<averageweight value="{rng.uniform(1, 5):.4f}" />',
+        '</ratings></statistics>',
+        '</item>'
+    ])
+    return '\n'.join(lines)
+
+
+def thing_xml(ids: Iterable[str], pools: Dict[str, List[Tuple[int, str]]], seed: int = 0) -> str:
+    """Thing response for the given game ids"""
+    items = ''.join(game_item(int(game_id), pools, seed) for game_id in ids)
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            f'<items termsofuse="https://boardgamegeek.com/xmlapi/termsofuse">{items}</items>')
+
+
+def browse_page(page_num: int, ranked_ids: List[str], page_size: int = 100) -> str:
+    """Browse page HTML listing one page of ranked_ids, empty past the last page"""
+    rng = random.Random(page_num)
+    first = (page_num - 1) * page_size
+    rows = []
+    for rank, game_id in enumerate(ranked_ids[first:first + page_size], start=first + 1):
+        title = _title(rng)
+        rows.append(BROWSE_ROW.format(rank=rank, id=game_id, slug=title.lower().replace(' ', '-'), title=title,
+                                      year=rng.randint(1950, 2023), rating=f'{rng.uniform(5, 9):.3f}'))
+    return ("<html><body><table class='collection_table' id='collectionitems'>\n"
+            f"{''.join(rows)}</table></body></html>")
+
+
+def write_batches(destination_dir: Path, num_games: int, batch_size: int = 1200, seed: int = 0) -> List[Path]:
+    """Write num_games synthetic games as gzipped batch files, like extract_xml does"""
+    pools = class_pools(num_games)
+    ids = game_ids(num_games)
+    paths = []
+    for num, start in enumerate(range(0, num_games, batch_size)):
+        path = destination_dir / f'bgg_games_batch_{num}.xml.gz'
+        with gzip.open(path, 'wt', encoding='utf-8') as file:
+            file.write(thing_xml(ids[start:start + batch_size], pools, seed))
+        paths.append(path)
+    return paths
@@ -1,16 +1,23 @@
 """Boardgame ETL DAG"""
 
+import json
+from contextlib import closing
+from functools import wraps
 from pathlib import Path
 from datetime import datetime, timedelta
+from typing import List, Optional
 from airflow import DAG
+from airflow.decorators import task
 from airflow.models import Variable
 from airflow.models.baseoperator import chain
-from airflow.operators.python import PythonOperator
-from airflow.operators.sql import SQLValueCheckOperator
+from airflow.operators.python import PythonOperator, get_current_context
 from airflow.providers.http.sensors.http import HttpSensor
 from airflow.providers.postgres.operators.postgres import PostgresOperator
 from airflow.providers.postgres.hooks.postgres import PostgresHook
-from py_modules import extract_game_ids, extract_xml, transform_xml, load
+
+# Pipeline modules import pandas, numpy and lxml, so they are imported inside
+# the task callables, when a task runs, and not each time the scheduler parses
+# this file. Postgres connections are likewise only opened by running tasks.
 
 current_date = datetime.today().strftime('%Y-%m-%d')
 
@@ -23,21 +30,263 @@ default_args = {
     "description": "Automated ETL pipeline for extracting BGG.com data using the BGGXMLAPI2 REST API."
 }
 
-DB_CONN_ID = Variable.get('db_conn_id')
-BATCH_SIZE = int(Variable.get('batch_size'))
-XML_DIR = Path(Variable.get('xml_dir'))
-CSV_DIR = Path(Variable.get('csv_dir'))
-GAME_IDS_FILE = Path(Variable.get('game_ids_file'))
+# All settings are read from one JSON Variable, in a single metadata DB query per parse
+CONFIG = Variable.get('bgg_pipeline', deserialize_json=True)
+
+DB_CONN_ID = CONFIG['db_conn_id']
+BROWSE_WORKERS = int(CONFIG.get('browse_workers', 3))
+# Min seconds between browse page requests, across all browse workers
+BROWSE_WAIT_TIME = float(CONFIG.get('browse_wait_time', 5))
+BATCH_SIZE = int(CONFIG['batch_size'])
+FETCH_WORKERS = int(CONFIG.get('fetch_workers', 1))
+FETCH_RATE = float(CONFIG.get('fetch_rate', 0.5))
+# Adaptive batching is enabled by setting max_batch_size; batches start at batch_size
+MIN_BATCH_SIZE = int(CONFIG.get('min_batch_size', 20))
+MAX_BATCH_SIZE = int(CONFIG.get('max_batch_size', 0))
+TARGET_LATENCY = float(CONFIG.get('target_latency', 30))
+TRANSFORM_WORKERS = int(CONFIG.get('transform_workers', 1))
+XML_DIR = Path(CONFIG['xml_dir'])
+CSV_DIR = Path(CONFIG['csv_dir'])
+GAME_IDS_FILE = Path(CONFIG['game_ids_file'])
+# 'csv' transforms to CSV files and loads them, 'stream' copies transform output
+# straight into freshly created tables, without intermediate files
+PIPELINE_MODE = CONFIG.get('pipeline_mode', 'csv')
+STREAM_CHUNK_GAMES = int(CONFIG.get('stream_chunk_games', 1000))
+# Format of the files passed from transform to load in csv mode: 'csv' or 'parquet'
+INTERMEDIATE_FORMAT = CONFIG.get('intermediate_format', 'csv')
+# In csv mode, extract and transform run as one mapped task per shard of the game ids
+SHARDS = int(CONFIG.get('shards', 1))
+SHARDS_DIR = Path(CONFIG.get('shards_dir', 'data/shards'))
+# 'replace' drops and reloads all tables, 'merge' upserts into the existing tables
+LOAD_MODE = 'replace' if PIPELINE_MODE == 'stream' else CONFIG.get('load_mode', 'replace')
+# Bytes per COPY chunk, the default of load.copy_table if unset
+COPY_CHUNK_SIZE = CONFIG.get('copy_chunk_size')
+# Incremental extraction is enabled by setting game_cache_file. Only changed
+# games are then transformed, so they must be merged into the existing tables.
+GAME_CACHE_FILE = CONFIG.get('game_cache_file', '')
+CACHE_POLICY = CONFIG.get('cache_policy')
+if GAME_CACHE_FILE and LOAD_MODE != 'merge':
+    raise ValueError("game_cache_file requires pipeline_mode 'csv' and load_mode 'merge', "
+                     f"got pipeline_mode {PIPELINE_MODE!r} and load_mode {LOAD_MODE!r}")
+# Connections used at once to build keys and validate foreign keys after loading
+FINALIZE_WORKERS = int(CONFIG.get('finalize_workers', 4))
+MAINTENANCE_WORK_MEM = CONFIG.get('maintenance_work_mem') or None
+# Similar games precomputed per game, and games compared with all games at once
+SIMILAR_GAMES = int(CONFIG.get('similar_games', 20))
+SIMILARITY_CHUNK_ROWS = int(CONFIG.get('similarity_chunk_rows', 16))
+# Run reports are written per DAG run under report_dir, and pushed to StatsD if statsd_address is set
+REPORT_DIR = Path(CONFIG.get('report_dir', 'data/reports'))
+STATSD_ADDRESS = CONFIG.get('statsd_address', '')
+
+
+def _with_report(func):
+    """Wrap a task callable to record a run report, saved to REPORT_DIR and pushed to XCom"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        from py_modules import metrics
+
+        context = get_current_context()
+        ti = context['ti']
+        # Instances of a mapped task are told apart by their map index
+        report_name = ti.task_id if ti.map_index < 0 else f'{ti.task_id}.{ti.map_index}'
+        report_path = REPORT_DIR / context['run_id'] / f'{report_name}.json'
+        with metrics.recording(report_path, STATSD_ADDRESS or None) as report:
+            result = func(*args, **kwargs)
+        ti.xcom_push(key='run_report', value=report.to_dict())
+        return result
+    return wrapper
+
+
+def _write_run_report(run_id: str) -> None:
+    """Combine the reports of the tasks of a DAG run into run_report.json"""
+    run_dir = REPORT_DIR / run_id
+    reports = {path.stem: json.loads(path.read_text()) for path in sorted(run_dir.glob('*.json'))
+               if path.name != 'run_report.json'}
+    (run_dir / 'run_report.json').write_text(json.dumps(reports, indent=2))
+
+
+def _connect():
+    """Open a psycopg2 connection to the pipeline database"""
+    return PostgresHook(postgres_conn_id=DB_CONN_ID).get_conn()
+
+
+def _chunk_size() -> dict:
+    """COPY chunk size keyword argument, if one is configured"""
+    return {'chunk_size': int(COPY_CHUNK_SIZE)} if COPY_CHUNK_SIZE else {}
+
+
+def _copy_table(csv_path: Path) -> int:
+    """Bulk load CSV or Parquet file into its table over a connection from the Postgres hook"""
+    from py_modules import load
+
+    with closing(_connect()) as conn:
+        return load.copy_table(csv_path, conn, **_chunk_size())
+
+
+def _merge_table(csv_path: Path) -> dict:
+    """Merge CSV or Parquet file into its table, returning inserted, updated and deleted counts"""
+    from py_modules import load
+    from py_modules.tables import RELATIONSHIP_TABLES
+
+    scope_ids = None
+    if csv_path.stem in RELATIONSHIP_TABLES:
+        scope_ids = load.read_scope_ids(csv_path.with_name(f'game{csv_path.suffix}'))
+    with closing(_connect()) as conn:
+        return load.merge_table(csv_path, conn, scope_ids, **_chunk_size())
+
+
+def _batcher():
+    """Adaptive batch sizer for one task, if enabled by MAX_BATCH_SIZE"""
+    from py_modules.batching import AdaptiveBatcher
+
+    if not MAX_BATCH_SIZE:
+        return None
+    return AdaptiveBatcher(BATCH_SIZE, MIN_BATCH_SIZE, MAX_BATCH_SIZE, TARGET_LATENCY)
+
+
+def _cache_policy() -> list:
+    """Configured freshness tiers of cached games, or the default ones"""
+    from py_modules.cache import DEFAULT_POLICY
+
+    return CACHE_POLICY or DEFAULT_POLICY
+
+
+def _extract_game_ids(destination_path: Path, workers: int, wait_time: float, run_id: str) -> None:
+    """Scrape the ranked game ids from the browse pages, resuming a checkpoint of the same DAG run"""
+    from py_modules import extract_game_ids
+
+    extract_game_ids.main(destination_path=destination_path, workers=workers, wait_time=wait_time, run_id=run_id)
+
+
+def _extract_game_data(game_ids_file: Path, destination_dir: Path) -> None:
+    """Fetch game XML, with batches sized adaptively if enabled"""
+    from py_modules import extract_xml
+
+    extract_xml.main(game_ids_file, destination_dir, BATCH_SIZE, FETCH_WORKERS, FETCH_RATE,
+                     Path(GAME_CACHE_FILE) if GAME_CACHE_FILE else None, _cache_policy(), batcher=_batcher())
+
+
+def _commit_game_cache() -> int:
+    """Commit the games fetched by this run to the game XML cache, once they are loaded"""
+    from py_modules import cache, shards
+
+    cache_path = Path(GAME_CACHE_FILE)
+    if SHARDS > 1:
+        return cache.commit_pending(shards.shard_cache_path(cache_path, shard) for shard in range(SHARDS))
+    return cache.commit_pending([cache_path])
+
+
+def _transform_data(xml_dir: Path, csv_dir: Path) -> List[dict]:
+    """Transform XML batch files to table files, returning their manifest"""
+    from py_modules import transform_xml
+
+    return transform_xml.main(xml_dir, csv_dir, TRANSFORM_WORKERS, INTERMEDIATE_FORMAT)
+
+
+def _shard_ids(game_ids_file: Path, num_shards: int, shards_dir: Path) -> List[dict]:
+    """Partition the ranked game ids into shards"""
+    from py_modules import shards
+
+    return shards.shard_ids(game_ids_file, num_shards, shards_dir)
+
+
+def _run_shard(shard: dict) -> dict:
+    """Extract and transform one shard, sharing the API rate limit evenly between shards"""
+    from py_modules import shards
+
+    return shards.run_shard(shard, BATCH_SIZE, FETCH_WORKERS, FETCH_RATE / SHARDS,
+                            Path(GAME_CACHE_FILE) if GAME_CACHE_FILE else None, _cache_policy(),
+                            TRANSFORM_WORKERS, INTERMEDIATE_FORMAT, batcher=_batcher())
+
+
+def _merge_shards(shard_results: List[dict], csv_dir: Path) -> List[dict]:
+    """Merge the tables of all shards, returning the manifest of the merged files"""
+    from py_modules import shards
+
+    return shards.merge_shards(shard_results, csv_dir, INTERMEDIATE_FORMAT)
+
+
+def _stream_tables() -> dict:
+    """Transform XML batch files and bulk load the rows, returning row counts per table"""
+    from py_modules import load, transform_xml
 
+    chunks = transform_xml.stream_tables(transform_xml.batch_files(XML_DIR), STREAM_CHUNK_GAMES)
+    with closing(_connect()) as conn:
+        return load.stream_tables(chunks, conn)
 
-def _count_rows(file: Path) -> int:
-    """Get line count of file
-    Returns total count - 1, to not include csv header
+
+def _create_keys() -> dict:
+    """Build missing primary keys and indexes, which merge loads upsert on"""
+    from py_modules import finalize
+
+    return finalize.create_keys(_connect, FINALIZE_WORKERS, MAINTENANCE_WORK_MEM)
+
+
+def _finalize_tables() -> dict:
+    """Build keys and indexes, then add and validate foreign keys, returning the time taken by each step"""
+    from py_modules import finalize
+
+    return finalize.main(_connect, FINALIZE_WORKERS, MAINTENANCE_WORK_MEM)
+
+
+def _refresh_views(parent_results: Optional[List[dict]] = None, dependent_results: Optional[List[dict]] = None) -> dict:
+    """Create missing aggregate views and refresh those built from tables changed by the load tasks
+
+    Every view is refreshed when no load results are given, as in stream mode.
     """
-    count = -1  # initialize to -1
-    for count, _ in enumerate(file.open()):
-        pass
-    return count
+    from py_modules import views
+
+    changes = None
+    if parent_results is not None:
+        changes = views.load_changes([*parent_results, *(dependent_results or [])])
+    return views.main(_connect, changes, FINALIZE_WORKERS)
+
+
+def _update_search() -> dict:
+    """Rebuild the search vectors of games whose title or description changed"""
+    from py_modules import search
+
+    with closing(_connect()) as conn:
+        return search.update_search(conn)
+
+
+def _compute_similarity() -> dict:
+    """Recompute the most similar games of each game, and mechanic and category co-occurrence"""
+    from py_modules import similarity
+
+    return similarity.main(_connect, SIMILAR_GAMES, SIMILARITY_CHUNK_ROWS)
+
+
+def _select_tables(manifest: List[dict], dependent: bool) -> List[dict]:
+    """Entries of the transform manifest for tables with foreign keys, or for the tables they reference"""
+    from py_modules.tables import DEPENDENT_TABLES
+
+    return [entry for entry in manifest if (entry['table'] in DEPENDENT_TABLES) == dependent]
+
+
+def _load_table(entry: dict) -> dict:
+    """Load one file of the transform manifest into its table, copying or merging as set by LOAD_MODE"""
+    path = Path(entry['path'])
+    if LOAD_MODE == 'merge':
+        return {'table': entry['table'], **_merge_table(path)}
+    return {'table': entry['table'], 'loaded': _copy_table(path)}
+
+
+@task
+def validate_table(entry: dict) -> None:
+    """Check the row count of a loaded table against the count in the transform manifest"""
+    loaded = PostgresHook(postgres_conn_id=DB_CONN_ID).get_first(f'SELECT COUNT(*) FROM {entry["table"]}')[0]
+    if loaded != entry['rows']:
+        raise ValueError(f'{entry["table"]} has {loaded} rows, expected {entry["rows"]}')
+
+
+def _validate_row_counts(ti) -> None:
+    """Check table row counts against those tallied by the transform_and_load_data task"""
+    pg_hook = PostgresHook(postgres_conn_id=DB_CONN_ID)
+    for table_name, row_count in ti.xcom_pull(task_ids='transform_and_load_data').items():
+        loaded = pg_hook.get_first(f'SELECT COUNT(*) FROM {table_name}')[0]
+        if loaded != row_count:
+            raise ValueError(f'{table_name} has {loaded} rows, expected {row_count}')
 
 
 with DAG(dag_id='bgg_pipeline',
@@ -45,10 +294,6 @@ with DAG(dag_id='bgg_pipeline',
          schedule_interval='00 4 * * *',
          catchup=False
          ) as dag:
-    # Setup
-    pg_hook = PostgresHook(postgres_conn_id=DB_CONN_ID)
-    pg_engine = pg_hook.get_sqlalchemy_engine()
-
     # Check if the API is available
     is_api_available = HttpSensor(
         task_id='is_api_available',
@@ -63,81 +308,145 @@ with DAG(dag_id='bgg_pipeline',
     # Extract game IDs
     extract_game_ids = PythonOperator(
         task_id='extract_game_ids',
-        python_callable=extract_game_ids.main,
+        python_callable=_with_report(_extract_game_ids),
         op_kwargs={
-            'dest': GAME_IDS_FILE
+            'destination_path': GAME_IDS_FILE,
+            'workers': BROWSE_WORKERS,
+            'wait_time': BROWSE_WAIT_TIME,
+            'run_id': '{{ run_id }}'
         }
     )
 
-    # Extract
-    extract_data = PythonOperator(
-        task_id='extract_game_data',
-        python_callable=extract_xml.main,
-        op_kwargs={
-            'game_ids_file': GAME_IDS_FILE,
-            'dest_dir': XML_DIR,
-            'batch_size': BATCH_SIZE
-        }
-    )
+    # Extract and transform
+    if PIPELINE_MODE == 'csv' and SHARDS > 1:
+        # One mapped task instance per shard, each retried on its own, then a
+        # merge of the shards' tables, returning the manifest of the merged files
+        shard_entries = task(task_id='shard_game_ids')(_shard_ids)(GAME_IDS_FILE, SHARDS, SHARDS_DIR)
+        shard_results = task(task_id='extract_transform_shard')(_with_report(_run_shard)).expand(shard=shard_entries)
+        transform_data = task(task_id='transform_data')(_with_report(_merge_shards))(shard_results, CSV_DIR)
+        extract_and_transform = [shard_entries, shard_results, transform_data]
+        manifest = transform_data
+    else:
+        extract_data = PythonOperator(
+            task_id='extract_game_data',
+            python_callable=_with_report(_extract_game_data),
+            op_kwargs={
+                'game_ids_file': GAME_IDS_FILE,
+                'destination_dir': XML_DIR
+            }
+        )
 
-    # Transform
-    transform_data = PythonOperator(
-        task_id='transform_data',
-        python_callable=transform_xml.main,
-        op_kwargs={
-            'xml_dir': XML_DIR,
-            'csv_dir': CSV_DIR
-        }
-    )
+        if PIPELINE_MODE == 'stream':
+            transform_data = PythonOperator(
+                task_id='transform_and_load_data',
+                python_callable=_with_report(_stream_tables)
+            )
+        else:
+            transform_data = PythonOperator(
+                task_id='transform_data',
+                python_callable=_with_report(_transform_data),
+                op_kwargs={
+                    'xml_dir': XML_DIR,
+                    'csv_dir': CSV_DIR
+                }
+            )
+            manifest = transform_data.output
+        extract_and_transform = [extract_data, transform_data]
 
-    # Create fresh staging tables
+    # Create tables, dropping existing ones first unless merging into them
     create_staging_tables = PostgresOperator(
         task_id='create_staging_tables',
         postgres_conn_id=DB_CONN_ID,
-        sql='sql/create_tables.sql'
+        sql=['sql/create_tables.sql'] if LOAD_MODE == 'merge' else ['sql/drop_tables.sql', 'sql/create_tables.sql']
     )
 
-    load_tables = []
-    validate_tables = []
-    for path in CSV_DIR.iterdir():
-        path = Path(path)
-        table_name = path.stem
-        row_count = _count_rows(path)
-
-        # Load table data
-        load_tables.append(PythonOperator(
-            task_id=f'load_table_{table_name}',
-            python_callable=load.load_table,
-            op_kwargs={
-                'csv_path': path,
-                'engine': pg_engine
-            }
-        ))
-
-        # Validate table data
-        validate_tables.append(SQLValueCheckOperator(
-            task_id=f'validate_table_{table_name}',
-            conn_id=DB_CONN_ID,
-            sql=f"SELECT COUNT(*) FROM {table_name}",
-            pass_value=row_count
-        ))
-
-    # Disable FK Constraints for faster loading
-    enable_fk_constraint = PostgresOperator(
-        task_id='enable_fk_constraint',
-        postgres_conn_id=DB_CONN_ID,
-        sql='sql/enable_fk_constraints.sql'
+    # Build keys and indexes after loading, then add and validate FK constraints
+    finalize_tables = PythonOperator(
+        task_id='finalize_tables',
+        python_callable=_with_report(_finalize_tables)
     )
 
-    # Dependencies
-    chain(
-        is_api_available,
-        extract_game_ids,
-        extract_data,
-        transform_data,
-        create_staging_tables,
-        load_tables,
-        enable_fk_constraint,
-        validate_tables
+    # Search vectors of new and changed games, once their rows are loaded
+    update_search = PythonOperator(
+        task_id='update_search',
+        python_callable=_with_report(_update_search)
+    )
+
+    # Similar games and co-occurrence counts, from the loaded relationship tables
+    compute_similarity = PythonOperator(
+        task_id='compute_similarity',
+        python_callable=_with_report(_compute_similarity)
     )
-    create_staging_tables >> enable_fk_constraint
+
+    # Combine task reports, whether or not the tasks succeeded
+    write_run_report = PythonOperator(
+        task_id='write_run_report',
+        python_callable=_write_run_report,
+        op_kwargs={
+            'run_id': '{{ run_id }}'
+        },
+        trigger_rule='all_done'
+    )
+
+    # Dependencies
+    if PIPELINE_MODE == 'stream':
+        refresh_views = PythonOperator(
+            task_id='refresh_views',
+            python_callable=_with_report(_refresh_views)
+        )
+        validate_row_counts = PythonOperator(
+            task_id='validate_row_counts',
+            python_callable=_validate_row_counts
+        )
+        chain(
+            is_api_available,
+            extract_game_ids,
+            extract_data,
+            create_staging_tables,
+            transform_data,
+            finalize_tables,
+            refresh_views,
+            update_search,
+            compute_similarity,
+            validate_row_counts,
+            write_run_report
+        )
+    else:
+        # Load and validate one mapped task instance per file in the manifest
+        # returned by the transform task, tables referenced by FKs first
+        parent_tables = task(task_id='select_parent_tables')(_select_tables)(manifest, dependent=False)
+        dependent_tables = task(task_id='select_dependent_tables')(_select_tables)(manifest, dependent=True)
+        load_parents = task(task_id='load_parent_table')(_with_report(_load_table)).expand(entry=parent_tables)
+        load_dependents = task(task_id='load_dependent_table')(_with_report(_load_table)).expand(entry=dependent_tables)
+        if LOAD_MODE == 'merge':
+            # Merges upsert on the primary keys, so they are built before loading
+            create_keys = PythonOperator(
+                task_id='create_keys',
+                python_callable=_with_report(_create_keys)
+            )
+            create_staging_tables >> create_keys >> load_parents
+        chain(
+            is_api_available,
+            extract_game_ids,
+            *extract_and_transform,
+            create_staging_tables,
+            load_parents,
+            load_dependents,
+            finalize_tables
+        )
+        refresh_views = task(task_id='refresh_views')(_with_report(_refresh_views))(load_parents, load_dependents)
+        # Only views built from tables the load changed are refreshed
+        post_load = [refresh_views, update_search, compute_similarity]
+        finalize_tables >> post_load
+        if GAME_CACHE_FILE:
+            # Games fetched by this run are only treated as fresh once they are loaded
+            commit_game_cache = PythonOperator(
+                task_id='commit_game_cache',
+                python_callable=_commit_game_cache
+            )
+            finalize_tables >> commit_game_cache >> write_run_report
+        if LOAD_MODE == 'merge':
+            post_load >> write_run_report
+        else:
+            validate_tables = validate_table.expand(entry=manifest)
+            post_load >> validate_tables >> write_run_report
@@ -0,0 +1,106 @@
+"""Adaptive sizing of API request batches
+
+The number of game ids per thing request is tuned while fetching: it grows by
+a fixed step while requests come back quickly, and is halved when a request is
+slow, oversized or fails. Slow requests include those BGG queued (202) or
+throttled (429), as request_game waits out the backoff before returning.
+"""
+
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Iterator, List, Optional, TypeVar
+from . import metrics
+
+T = TypeVar('T')
+
+
+class AdaptiveBatcher:
+    """Additive-increase, multiplicative-decrease batch size, shared by all workers
+
+    Args:
+        initial (int): Batch size to start with
+        min_size (int): Smallest batch size
+        max_size (int): Largest batch size
+        target_latency (float): Seconds a request may take before batches shrink
+        max_bytes (int): Response size above which batches shrink, unbounded if None;
+            only applies to responses measured by the size_of argument of fetch
+        step (int): Ids added after a fast request, a tenth of initial if None
+        backoff (float): Factor the batch size is multiplied by after a slow request
+    """
+
+    def __init__(self,
+                 initial: int,
+                 min_size: int = 20,
+                 max_size: int = 1200,
+                 target_latency: float = 30.0,
+                 max_bytes: Optional[int] = None,
+                 step: Optional[int] = None,
+                 backoff: float = 0.5):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = min(max(initial, min_size), max_size)
+        self.target_latency = target_latency
+        self.max_bytes = max_bytes
+        self.step = step or max(1, initial // 10)
+        self.backoff = backoff
+        self._lock = Lock()
+
+    def record(self, size: int, seconds: float, num_bytes: int = 0, failed: bool = False) -> int:
+        """Adjust the batch size after a request, returning the new size
+
+        Args:
+            size (int): Number of ids in the request
+            seconds (float): Time taken by the request, including retries
+            num_bytes (int): Size of the response body
+            failed (bool): Whether the request failed
+
+        Returns:
+            int: Batch size for the next request
+        """
+        metrics.sample('api.batch_size', size)
+        slow = seconds > self.target_latency or (self.max_bytes is not None and num_bytes > self.max_bytes)
+        with self._lock:
+            if failed or slow:
+                new_size = max(self.min_size, int(min(size, self.size) * self.backoff))
+            elif size >= self.size:
+                # Only requests at the current size show that it can grow
+                new_size = min(self.max_size, self.size + self.step)
+            else:
+                new_size = self.size
+            if new_size != self.size:
+                metrics.count('api.batch_shrinks' if new_size < self.size else 'api.batch_grows')
+            self.size = new_size
+        return new_size
+
+    def batches(self, game_ids: List[str]) -> Iterator[str]:
+        """Cut game ids into comma-separated batches, each at the size current when it is cut"""
+        begin = 0
+        while begin < len(game_ids):
+            size = self.size
+            yield ','.join(game_ids[begin:begin + size])
+            begin += size
+
+    def fetch(self,
+              func: Callable[..., T],
+              id_batch: str,
+              *args,
+              size_of: Optional[Callable[[T], int]] = None) -> T:
+        """Call func on a batch of ids, recording its time and outcome to adjust the batch size
+
+        Args:
+            func (callable): Fetches a batch, given id_batch and args
+            id_batch (str): Comma-separated game ids
+            size_of (callable): Size in bytes of the result of func, not measured if None
+
+        Returns:
+            Result of func, whose exceptions are re-raised after being recorded
+        """
+        size = id_batch.count(',') + 1
+        start = perf_counter()
+        try:
+            result = func(id_batch, *args)
+        except Exception:
+            self.record(size, perf_counter() - start, failed=True)
+            raise
+        self.record(size, perf_counter() - start, size_of(result) if size_of else 0)
+        return result
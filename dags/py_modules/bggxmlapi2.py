@@ -1,34 +1,137 @@
 """Helper functions for using the BGGXMLAPI2"""
 
-from requests import get
+from time import perf_counter, sleep
+from typing import Optional, Tuple
+from requests import HTTPError, Response, Session, exceptions, get
+from requests.adapters import HTTPAdapter
+from . import metrics
+from .ratelimit import TokenBucket
 
+BASE_URL = 'https://boardgamegeek.com/xmlapi2'
 
-def build_query(query_type: str, params: dict) -> str:
+# 202: request queued by BGG, 429: throttled, 5xx: server errors
+RETRY_STATUS = {202, 429, 500, 502, 503, 504}
+
+# Failed connections, and responses that stalled or were cut short, retried like RETRY_STATUS
+RETRY_ERRORS = (exceptions.ConnectionError, exceptions.Timeout, exceptions.ChunkedEncodingError)
+
+# Seconds to wait to connect, and between bytes of a response
+TIMEOUT = (10, 120)
+
+
+def build_query(query_type: str, params: dict, base_url: str = BASE_URL) -> str:
     """Build XML query for board game
 
     Args:
         query_type (str): type of query: thing, user, search...
         params (dict): dict of params using str for both keys and values
+        base_url (str): root URL of the API
 
     Returns:
         str: Query URL for given parameters
     """
-    url = f'https://boardgamegeek.com/xmlapi2/{query_type}?'
+    url = f'{base_url}/{query_type}?'
     return url + '&'.join([f'{key}={str(value)}' for key, value in params.items()])
 
 
-def fetch_game(game_id: str) -> str:
-    """Fetch game data from BGG
+def create_session(pool_size: int = 1) -> Session:
+    """Create a Requests session that reuses up to pool_size pooled connections"""
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def retry_delay(res: Response, attempt: int, backoff: float) -> float:
+    """Seconds to wait before retrying, honouring a numeric Retry-After header"""
+    delay = backoff * 2 ** attempt
+    retry_after = res.headers.get('Retry-After', '')
+    if retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+    return delay
+
+
+def request_game(game_id: str,
+                 session: Optional[Session] = None,
+                 limiter: Optional[TokenBucket] = None,
+                 retries: int = 5,
+                 backoff: float = 2.0,
+                 base_url: str = BASE_URL,
+                 stream: bool = False,
+                 timeout: Tuple[float, float] = TIMEOUT) -> Response:
+    """Request game data from BGG, returning the successful Response
+
+    Queued (202), throttled (429) and server error responses, connection
+    errors and timeouts are retried with exponential backoff.
 
     Args:
-        game_id (str): numerical id of game on BGG
+        game_id (str): numerical id of game on BGG, or comma-separated ids
+        session (Session): session to send the request with, if any
+        limiter (TokenBucket): rate limiter to acquire a token from before each request
+        retries (int): max number of retries
+        backoff (float): seconds to wait before the first retry, doubled on each retry
+        base_url (str): root URL of the API
+        stream (bool): leave the body unread, to be consumed with iter_content
+        timeout (tuple): seconds to wait to connect, and between bytes of the response
 
     Returns:
-        str: Game data encoded with XML
+        Response: response to the request
     """
     params = {
         'stats': '1',
         'id': game_id
     }
-    request_url = build_query('thing', params)
-    return get(url=request_url).content.decode()
+    request_url = build_query('thing', params, base_url)
+    send = session.get if session is not None else get
+
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        start = perf_counter()
+        try:
+            res = send(url=request_url, stream=stream, timeout=timeout)
+        except RETRY_ERRORS:
+            metrics.count('api.connection_errors')
+            if attempt == retries:
+                raise
+            sleep(backoff * 2 ** attempt)
+            continue
+        metrics.observe('api.latency', perf_counter() - start)
+        metrics.count('api.requests')
+        if res.status_code not in RETRY_STATUS:
+            res.raise_for_status()
+            return res
+        res.close()
+        metrics.count(f'api.status_{res.status_code}')
+        if attempt < retries:
+            sleep(retry_delay(res, attempt, backoff))
+
+    raise HTTPError(f'Request failed after {retries + 1} attempts with status {res.status_code}: {request_url}',
+                    response=res)
+
+
+def fetch_game(game_id: str,
+               session: Optional[Session] = None,
+               limiter: Optional[TokenBucket] = None,
+               retries: int = 5,
+               backoff: float = 2.0,
+               base_url: str = BASE_URL,
+               timeout: Tuple[float, float] = TIMEOUT) -> str:
+    """Fetch game data from BGG
+
+    Args:
+        game_id (str): numerical id of game on BGG, or comma-separated ids
+        session (Session): session to send the request with, if any
+        limiter (TokenBucket): rate limiter to acquire a token from before each request
+        retries (int): max number of retries
+        backoff (float): seconds to wait before the first retry, doubled on each retry
+        base_url (str): root URL of the API
+        timeout (tuple): seconds to wait to connect, and between bytes of the response
+
+    Returns:
+        str: Game data encoded with XML
+    """
+    content = request_game(game_id, session, limiter, retries, backoff, base_url, timeout=timeout).content
+    metrics.count('api.bytes', len(content))
+    return content.decode()
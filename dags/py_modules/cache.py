@@ -0,0 +1,175 @@
+"""On-disk cache of game XML for incremental extraction
+
+Stores the last <item> fragment fetched for each game, with a content hash and
+fetch timestamp, so that a run only refetches games whose cached copy is stale
+and only passes games whose content changed on to the transform stage.
+
+Games fetched by a run are kept pending until its load succeeds, and only then
+committed to the cache. If a later task fails, the next run still sees the
+games as stale and changed, and fetches and loads them again.
+"""
+
+import sqlite3
+import zlib
+from hashlib import sha256
+from io import BytesIO
+from pathlib import Path
+from time import time
+from typing import Iterable, List, Optional, Sequence, Tuple
+from lxml import etree
+from .transform_xml import iter_items
+
+DAY = 86400
+
+# (max rank, max age in days) tiers, checked in order. A max rank of None
+# matches every remaining game.
+DEFAULT_POLICY = ((1000, 1), (None, 7))
+
+# Allowance for jitter in run start times, so that a game on a daily tier is
+# refetched by every nightly run rather than every other one
+FRESHNESS_SLACK = 2 * 3600
+
+XML_HEADER = b'<?xml version="1.0" encoding="utf-8"?>'
+
+
+def max_age(rank: int, policy: Sequence[Tuple[Optional[int], float]] = DEFAULT_POLICY) -> float:
+    """Max age in seconds of a cached game at the given rank before it is refetched
+
+    Games matching no tier of the policy are always refetched.
+    """
+    for max_rank, days in policy:
+        if max_rank is None or rank <= max_rank:
+            return days * DAY
+    return 0
+
+
+def split_items(xml: str) -> List[Tuple[int, bytes]]:
+    """Split an API response into (game id, serialized <item> fragment) pairs"""
+    return [(int(item.get('id')), etree.tostring(item, encoding='utf-8', with_tail=False))
+            for item in iter_items(BytesIO(xml.encode('utf-8')))]
+
+
+def join_items(fragments: List[bytes]) -> str:
+    """Join <item> fragments into a batch document in the API's response format"""
+    return (XML_HEADER + b'<items>' + b''.join(fragments) + b'</items>').decode('utf-8')
+
+
+class GameCache:
+    """SQLite-backed cache of game XML fragments keyed by game id
+
+    Fetched games are stored in game_xml_pending, and moved to game_xml by
+    commit_pending once they are loaded. Use as a context manager to commit and
+    close the database on exit.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path))
+        for table_name in ['game_xml', 'game_xml_pending']:
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table_name} (
+                    game_id     INTEGER PRIMARY KEY,
+                    hash        TEXT NOT NULL,
+                    fetched_at  REAL NOT NULL,
+                    xml         BLOB NOT NULL
+                )""")
+
+    def __enter__(self) -> 'GameCache':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+    def stale_ids(self,
+                  game_ids: Sequence[str],
+                  policy: Sequence[Tuple[Optional[int], float]] = DEFAULT_POLICY,
+                  now: Optional[float] = None,
+                  ranks: Optional[Sequence[int]] = None) -> List[str]:
+        """Select the game ids that are missing from the cache or due for refetching
+
+        Args:
+            game_ids (list): game ids ordered by rank, best first
+            policy (list): freshness tiers of (max rank, max age in days)
+            now (float): current time as a Unix timestamp, defaults to time()
+            ranks (list): rank of each game among all ranked games, for a subset
+                such as a shard; defaults to the position in game_ids
+
+        Returns:
+            list: stale game ids, in rank order
+        """
+        now = time() if now is None else now
+        fetched = dict(self.conn.execute('SELECT game_id, fetched_at FROM game_xml'))
+        ranks = range(1, len(game_ids) + 1) if ranks is None else ranks
+        return [game_id for rank, game_id in zip(ranks, game_ids)
+                if now - fetched.get(int(game_id), float('-inf')) + FRESHNESS_SLACK > max_age(rank, policy)]
+
+    def get(self, game_id: int) -> Optional[bytes]:
+        """Get the committed <item> fragment of a game, or None if not cached"""
+        row = self.conn.execute('SELECT xml FROM game_xml WHERE game_id = ?', (game_id,)).fetchone()
+        return zlib.decompress(row[0]) if row else None
+
+    def update(self, xml: str, now: Optional[float] = None) -> List[bytes]:
+        """Store every game of an API response as pending, and return those that changed
+
+        Games are compared with their committed copy, so a game fetched again
+        after a failed run is reported as changed again.
+
+        Args:
+            xml (str): API response containing one or more <item> elements
+            now (float): fetch time as a Unix timestamp, defaults to time()
+
+        Returns:
+            list: <item> fragments of new games and games whose content changed
+        """
+        now = time() if now is None else now
+        changed = []
+        rows = []
+        for game_id, fragment in split_items(xml):
+            digest = sha256(fragment).hexdigest()
+            cached = self.conn.execute('SELECT hash FROM game_xml WHERE game_id = ?', (game_id,)).fetchone()
+            if cached is None or cached[0] != digest:
+                changed.append(fragment)
+            rows.append((game_id, digest, now, zlib.compress(fragment)))
+        self.conn.executemany('INSERT OR REPLACE INTO game_xml_pending VALUES (?, ?, ?, ?)', rows)
+        self.conn.commit()
+        return changed
+
+    def discard_pending(self) -> int:
+        """Drop the games left pending by a run whose load did not succeed
+
+        Returns:
+            int: Number of games discarded
+        """
+        discarded = self.conn.execute('DELETE FROM game_xml_pending').rowcount
+        self.conn.commit()
+        return discarded
+
+    def commit_pending(self) -> int:
+        """Move the pending games into the cache, once they are loaded
+
+        Returns:
+            int: Number of games committed
+        """
+        self.conn.execute('INSERT OR REPLACE INTO game_xml SELECT * FROM game_xml_pending')
+        committed = self.conn.execute('DELETE FROM game_xml_pending').rowcount
+        self.conn.commit()
+        return committed
+
+
+def commit_pending(cache_paths: Iterable[Path]) -> int:
+    """Commit the pending games of each existing cache file, after a successful load
+
+    Args:
+        cache_paths (iterable): Filepaths of game XML cache databases
+
+    Returns:
+        int: Number of games committed
+    """
+    committed = 0
+    for path in cache_paths:
+        if path.exists():
+            with GameCache(path) as cache:
+                committed += cache.commit_pending()
+    print(f'Committed {committed} cached games')
+    return committed
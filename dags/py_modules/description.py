@@ -0,0 +1,40 @@
+"""Normalisation of game descriptions
+
+BGG descriptions arrive with a second level of HTML escaping: once lxml has
+decoded the XML, the text still holds entities such as &#10; for line breaks,
+&quot; and &rsquo;. Entities are decoded by one precompiled pattern, whose
+literal '&' prefix lets the regex engine skip plain text, then runs of
+whitespace, including decoded line breaks, are collapsed to single spaces.
+"""
+
+import re
+from functools import lru_cache
+from html import unescape
+from html.entities import html5
+from typing import Match
+
+_ENTITY = re.compile(r'&(?:#[0-9]{1,7}|#[xX][0-9a-fA-F]{1,6}|[A-Za-z][A-Za-z0-9]{1,31});')
+
+
+@lru_cache(maxsize=4096)
+def decode_entity(entity: str) -> str:
+    """Decode one numeric or named HTML entity, leaving unknown names as they are"""
+    if entity[1] == '#':
+        return unescape(entity)
+    return html5.get(entity[1:], entity)
+
+
+def _replace(match: Match) -> str:
+    return decode_entity(match.group(0))
+
+
+def clean_description(desc: str) -> str:
+    """Decode HTML entities and collapse whitespace in a game description
+
+    Args:
+        desc (str): Description text, as decoded from the XML
+
+    Returns:
+        str: Description on a single line, without leading or trailing spaces
+    """
+    return ' '.join(_ENTITY.sub(_replace, desc).split())
@@ -1,19 +1,34 @@
 """Extract game IDs for all ranked games on BoardGameGeek.com"""
 
 import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from os import getenv
-from time import sleep
 from pathlib import Path
-from typing import Generator, List
+from time import perf_counter
+from typing import Dict, Generator, List, Optional
 from requests import Session
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+from lxml import etree, html
+from . import metrics
+from .bggxmlapi2 import TIMEOUT
+from .ratelimit import TokenBucket
 
+BGG_URL = 'https://boardgamegeek.com'
 
-def authenticate() -> Session:
+# Precompiled queries for the rows of a browse page, and for the first rank
+# cell and first primary link within a row
+_BROWSE_ROWS = etree.XPath("//*[@id='row_']")
+_RANK_ANCHOR = etree.XPath("(.//*[contains(concat(' ', normalize-space(@class), ' '), ' collection_rank ')])[1]//a")
+_PRIMARY_HREF = etree.XPath("(.//*[contains(concat(' ', normalize-space(@class), ' '), ' primary ')])[1]/@href")
+_GAME_HREF = re.compile(r'/boardgame/(\d+)/')
+
+
+def authenticate(base_url: str = BGG_URL) -> Session:
     """Create authenticated Requests session with BGG.com"""
     load_dotenv()
-    login_url = 'https://boardgamegeek.com/login/api/v1'
+    login_url = f'{base_url}/login/api/v1'
     creds = {
         "credentials": {
             "username": getenv('BGG_USERNAME'),
@@ -22,7 +37,7 @@ def authenticate() -> Session:
     }
 
     session = Session()
-    res = session.post(login_url, json=creds)
+    res = session.post(login_url, json=creds, timeout=TIMEOUT)
     if res.status_code == 204:
         return session
     raise Exception(f'Authentication unsuccessful. Status code {res.status_code} returned.')
@@ -41,56 +56,163 @@ def extract_ranked_game_ids(text: str) -> list:
     Returns:
         list of game id's
     """
-    soup = BeautifulSoup(text, features='html.parser')
     id_list = []
 
-    for row in soup.find_all(id="row_"):
-        # if rank := row.find(class_='collection_rank'):
-        rank = row.find(class_='collection_rank')
-        if rank is not None:
-            if rank.a:
-                text = row.find(class_='primary').attrs['href']
-                id_list.append(re.search(r'/boardgame/(\d+)/', text).group(1))
+    for row in _BROWSE_ROWS(html.document_fromstring(text)):
+        # Ranked games link their rank cell to an anchor, unranked games show 'N/A'
+        if _RANK_ANCHOR(row):
+            href = _PRIMARY_HREF(row)
+            if href:
+                id_list.append(_GAME_HREF.search(href[0]).group(1))
 
     return id_list
 
 
-def scrape_browse_pages(max_pages: int, wait_time: int = 5) -> Generator[List[str], None, None]:
+def load_checkpoint(checkpoint_path: Optional[Path]) -> Dict[int, List[str]]:
+    """Load game ids of the browse pages already scraped by an earlier, interrupted run
+
+    The checkpoint file holds one JSON object per line, with the page number and
+    the game ids extracted from that page.
+    """
+    pages = {}
+    if checkpoint_path is not None and checkpoint_path.exists():
+        with checkpoint_path.open(encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    pages[entry['page']] = entry['ids']
+    return pages
+
+
+def fetch_browse_page(session: Session,
+                      page_num: int,
+                      limiter: Optional[TokenBucket] = None,
+                      base_url: str = BGG_URL) -> Optional[List[str]]:
+    """Fetch a browse page sorted by rank, and extract its ranked game ids
+
+    Returns None for a page that fails with a non-200 status, which ends the
+    scrape as the first page past the ranked games does.
+    """
+    if limiter is not None:
+        limiter.acquire()
+    start = perf_counter()
+    res = session.get(f'{base_url}/browse/boardgame/page/{page_num}?sort=rank&sortdir=asc', timeout=TIMEOUT)
+    metrics.observe('browse.latency', perf_counter() - start)
+    metrics.count('browse.requests')
+    metrics.count('browse.bytes', len(res.content))
+    if res.status_code != 200:
+        metrics.count(f'browse.status_{res.status_code}')
+        return None
+    return extract_ranked_game_ids(res.content.decode())
+
+
+def scrape_browse_pages(max_pages: int,
+                        wait_time: float = 5,
+                        workers: int = 1,
+                        checkpoint_path: Optional[Path] = None,
+                        session: Optional[Session] = None,
+                        base_url: str = BGG_URL) -> Generator[List[str], None, None]:
     """Extract game ids of all ranked games on BGG
 
+    Pages are fetched by a pool of workers sharing one rate limiter, in windows
+    of `workers` pages. Each page is recorded in the checkpoint file once
+    fetched, and pages found there are not fetched again, so an interrupted run
+    resumes where it stopped. Scraping stops at the first page without ranked
+    games, or that could not be fetched.
+
+    Args:
+        max_pages (int): Pages 1 up to, but not including, max_pages are scraped
+        wait_time (float): Min seconds between requests, across all workers
+        workers (int): Number of pages fetched concurrently
+        checkpoint_path (Path): File recording the pages already scraped
+        session (Session): Authenticated session, a new one is created if None
+        base_url (str): Root URL of BGG.com
+
     Returns:
-        list: list of game ids as integers
+        Yields lists of game ids for each page, in rank order
     """
+    pages = load_checkpoint(checkpoint_path)
+    limiter = TokenBucket(1 / wait_time) if wait_time else None
 
-    print('Authenticating...')
-    session = authenticate()
-    print('Authentication Successful.')
+    if session is None:
+        print('Authenticating...')
+        session = authenticate()
+        print('Authentication Successful.')
 
     print('Beginning scrape...')
-    for page_num in range(1, max_pages):
-        url = f'https://boardgamegeek.com/browse/boardgame/page/{page_num}?sort=rank&sortdir=asc'
+    checkpoint = checkpoint_path.open('a', encoding='utf-8') if checkpoint_path is not None else None
+    fetch = partial(fetch_browse_page, session, limiter=limiter, base_url=base_url)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in range(1, max_pages, workers):
+                window = range(start, min(start + workers, max_pages))
+                missing = [page_num for page_num in window if page_num not in pages]
+                for page_num, new_ids in zip(missing, executor.map(fetch, missing)):
+                    pages[page_num] = new_ids
+                    # Failed pages are not recorded, so they are fetched again on resume
+                    if checkpoint is not None and new_ids is not None:
+                        checkpoint.write(json.dumps({'page': page_num, 'ids': new_ids}) + '\n')
+                        checkpoint.flush()
+
+                for page_num in window:
+                    if not pages[page_num]:
+                        print(f'\nFinished on page {page_num}.')
+                        return
+                    print(page_num, end=' ')
+                    yield pages[page_num]
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+def checkpoint_path(destination_path: Path, run_id: str = '') -> Path:
+    """Checkpoint file of the run run_id writing to destination_path
 
-        res = session.get(url)
-        if res.status_code == 200:
-            # if new_ids := extract_ranked_game_ids(res.content.decode()):
-            new_ids = extract_ranked_game_ids(res.content.decode())
-            if new_ids is not None:
-                print(page_num, end='')
-                yield new_ids
-                sleep(wait_time)
-                continue
+    Args:
+        destination_path (Path): file the run writes its output to
+        run_id (str): Identifier of the run, such as the Airflow DAG run id
 
-        print(f'\nFinished on page {page_num}.')
-        break
+    Returns:
+        Path: Checkpoint file next to destination_path, named after the run
+    """
+    run_name = re.sub(r'[^\w.-]', '_', run_id)
+    suffix = f'.{run_name}.checkpoint' if run_name else '.checkpoint'
+    return destination_path.with_name(destination_path.name + suffix)
 
 
-def main(destination_path: Path, max_pages: int = 250) -> None:
+def main(destination_path: Path,
+         max_pages: int = 250,
+         workers: int = 3,
+         wait_time: float = 5,
+         base_url: str = BGG_URL,
+         run_id: str = '') -> None:
     """Run scraper and save output to csv
 
+    Progress is checkpointed to a file next to destination_path, which is
+    removed once the output is complete. The checkpoint is named after run_id,
+    so a retry of the same run resumes from it, while checkpoints left behind
+    by other runs are removed rather than resumed.
+
     Args:
         destination_path (Path): file to write output to
         max_pages (int): Max number of pages to parse
+        workers (int): Number of pages fetched concurrently
+        wait_time (float): Min seconds between requests
+        base_url (str): Root URL of BGG.com
+        run_id (str): Identifier of the run, such as the Airflow DAG run id
     """
-    with open(destination_path, 'w', encoding='utf-8') as file:
-        for id_list in scrape_browse_pages(max_pages=max_pages):
-            file.writelines([str(line) + "\n" for line in id_list])
+    run_checkpoint = checkpoint_path(destination_path, run_id)
+    for stale_checkpoint in destination_path.parent.glob(f'{destination_path.name}.*checkpoint'):
+        if stale_checkpoint != run_checkpoint:
+            stale_checkpoint.unlink()
+
+    with metrics.stage('extract_game_ids'):
+        session = authenticate(base_url)
+        with open(destination_path, 'w', encoding='utf-8') as file:
+            for id_list in scrape_browse_pages(max_pages, wait_time, workers, run_checkpoint, session, base_url):
+                metrics.count('extract_game_ids.ids', len(id_list))
+                file.writelines([str(line) + "\n" for line in id_list])
+    try:
+        run_checkpoint.unlink()
+    except FileNotFoundError:
+        pass
@@ -3,49 +3,250 @@
 Takes bgg game ids and generates batched xml files
 """
 
+import gzip
+import os
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from math import ceil
-from typing import Generator
-from .bggxmlapi2 import fetch_game
+from time import sleep
+from typing import Callable, Generator, Iterable, Iterator, List, Optional, Sequence, Tuple
+from requests import Session
+from . import metrics
+from .batching import AdaptiveBatcher
+from .bggxmlapi2 import BASE_URL, RETRY_ERRORS, create_session, fetch_game, request_game
+from .cache import DEFAULT_POLICY, GameCache, join_items
+from .ratelimit import TokenBucket
 
+# Bytes read from a response body per chunk written to disk
+STREAM_CHUNK_SIZE = 1 << 16
 
-def save_file(path: Path, content: str) -> bool:
-    """Save page to file"""
+
+def save_stream(path: Path, chunks: Iterable[bytes]) -> bool:
+    """Save chunks of bytes to file, gzip-compressed if the path ends with .gz
+
+    Chunks are written to a temporary file that is renamed to path once
+    complete, so an interrupted write never leaves a partial file at path.
+    """
     path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, 'w', encoding='utf-8') as file:
-        file.write(content)
+    tmp_path = path.with_name(path.name + '.tmp')
+    try:
+        with (gzip.open(tmp_path, 'wb') if path.suffix == '.gz' else open(tmp_path, 'wb')) as file:
+            for chunk in chunks:
+                file.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        try:
+            tmp_path.unlink()
+        except FileNotFoundError:
+            pass
     return path.exists()
 
 
-def scrape_game_pages(game_ids_list: list, batch_size: int) -> Generator[str, None, None]:
+def save_file(path: Path, content: str) -> bool:
+    """Save page to file"""
+    return save_stream(path, [content.encode('utf-8')])
+
+
+def batch_path(destination_dir: Path, num: int, compress: bool = True) -> Path:
+    """Path of the numbered batch file in destination_dir"""
+    return destination_dir / f'bgg_games_batch_{str(num).zfill(2)}.xml{".gz" if compress else ""}'
+
+
+def _count_bytes(chunks: Iterable[bytes]) -> Iterable[bytes]:
+    """Pass chunks through, counting their size as bytes fetched"""
+    for chunk in chunks:
+        metrics.count('api.bytes', len(chunk))
+        yield chunk
+
+
+def download_batch(id_batch: str,
+                   destination_path: Path,
+                   session: Session,
+                   limiter: Optional[TokenBucket] = None,
+                   base_url: str = BASE_URL,
+                   retries: int = 5,
+                   backoff: float = 2.0) -> Path:
+    """Fetch a batch of games and stream the response body straight to file
+
+    The body is read after request_game returns, so a connection that stalls
+    or drops mid-body is retried here, by downloading the batch again with the
+    same retry budget and backoff as the request.
+    """
+    for attempt in range(retries + 1):
+        with request_game(id_batch, session, limiter, retries, backoff, base_url, stream=True) as res:
+            try:
+                save_stream(destination_path, _count_bytes(res.iter_content(STREAM_CHUNK_SIZE)))
+                return destination_path
+            except RETRY_ERRORS:
+                metrics.count('api.connection_errors')
+                if attempt == retries:
+                    raise
+        sleep(backoff * 2 ** attempt)
+
+
+def batch_ids(game_ids_list: list, batch_size: int) -> List[str]:
+    """Split game ids into comma-separated batches of at most batch_size ids"""
+    return [','.join(game_ids_list[begin:begin + batch_size])
+            for begin in range(0, len(game_ids_list), batch_size)]
+
+
+def map_ordered(executor: Executor, func: Callable, args: Iterable[tuple], window: int) -> Iterator:
+    """Like executor.map, but only takes the next arguments once fewer than window calls are pending
+
+    Arguments are drawn lazily, so a generator of batches is cut with what the
+    previous responses showed, not all upfront. Results are yielded in
+    submission order.
+    """
+    pending = deque()
+    for call_args in args:
+        pending.append(executor.submit(func, *call_args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _id_batches(game_ids_list: list, batch_size: int, batcher: Optional[AdaptiveBatcher]) -> Iterable[str]:
+    return batcher.batches(game_ids_list) if batcher else batch_ids(game_ids_list, batch_size)
+
+
+def scrape_game_pages(game_ids_list: list,
+                      batch_size: int,
+                      workers: int = 1,
+                      rate: Optional[float] = None,
+                      base_url: str = BASE_URL,
+                      batcher: Optional[AdaptiveBatcher] = None) -> Generator[str, None, None]:
     """Fetch, save, and extract data from game pages
 
+    Up to `workers` requests are in flight at once over a single pooled session,
+    and all of them share one token bucket when a rate is given. Batches are
+    yielded in request order, whatever order the responses arrive in.
+
     Args:
         game_ids_list (list): list of game ids to scrape
         batch_size (int): number of ids to bundle into each request
+        workers (int): max number of concurrent requests
+        rate (float): max requests per second across all workers, unlimited if None
+        base_url (str): root URL of the API
+        batcher (AdaptiveBatcher): sizes batches from observed responses instead
+            of batch_size, if given
 
     Returns:
-        Yields batches of games as Response objects
+        Yields batches of games as XML strings
     """
-    total_batches = ceil(len(game_ids_list) // batch_size) + 1
-    for batch_num in range(total_batches):
-        begin = batch_num * batch_size
-        end = min(begin + batch_size, len(game_ids_list))
-        id_batch = ','.join(game_ids_list[begin:end])
-        yield fetch_game(id_batch)
+    limiter = TokenBucket(rate) if rate else None
+    with create_session(pool_size=workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        fetch = partial(fetch_game, session=session, limiter=limiter, base_url=base_url)
+        if batcher:
+            fetch = partial(batcher.fetch, fetch, size_of=len)
+        id_batches = ((id_batch,) for id_batch in _id_batches(game_ids_list, batch_size, batcher))
+        yield from map_ordered(executor, fetch, id_batches, workers)
+
+
+def download_game_pages(game_ids_list: list,
+                        batch_size: int,
+                        destination_dir: Path,
+                        workers: int = 1,
+                        rate: Optional[float] = None,
+                        compress: bool = True,
+                        base_url: str = BASE_URL,
+                        batcher: Optional[AdaptiveBatcher] = None) -> List[Path]:
+    """Fetch batches of games and stream each response to its numbered batch file
+
+    Like scrape_game_pages, but response bodies are written to disk as they
+    arrive instead of being held in memory.
 
+    Args:
+        game_ids_list (list): list of game ids to scrape
+        batch_size (int): number of ids to bundle into each request
+        destination_dir (Path): directory to save batch files to
+        workers (int): max number of concurrent requests
+        rate (float): max requests per second across all workers, unlimited if None
+        compress (bool): gzip-compress batch files
+        base_url (str): root URL of the API
+        batcher (AdaptiveBatcher): sizes batches from observed responses instead
+            of batch_size, if given; response sizes are not measured
+
+    Returns:
+        list: paths of the batch files, in request order
+    """
+    limiter = TokenBucket(rate) if rate else None
+    with create_session(pool_size=workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        download = partial(download_batch, session=session, limiter=limiter, base_url=base_url)
+        if batcher:
+            download = partial(batcher.fetch, download)
+        id_batches = ((id_batch, batch_path(destination_dir, num, compress))
+                      for num, id_batch in enumerate(_id_batches(game_ids_list, batch_size, batcher)))
+        return list(map_ordered(executor, download, id_batches, workers))
 
-def main(game_ids_file: Path, destination_dir: Path, batch_size: int) -> None:
+
+def read_ranked_game_ids(game_ids_file: Path) -> List[Tuple[str, int]]:
+    """Read (game id, rank) pairs from file, skipping blank lines
+
+    Lines hold a game id, optionally followed by a comma and its rank, as in
+    shard files. Ranks default to the line's position among the game ids.
+    """
+    with game_ids_file.open() as file:
+        lines = [line.strip().split(',') for line in file if line.strip()]
+    return [(fields[0], int(fields[1]) if len(fields) > 1 else rank) for rank, fields in enumerate(lines, start=1)]
+
+
+def read_game_ids(game_ids_file: Path) -> List[str]:
+    """Read game ids from file, one per line, skipping blank lines"""
+    return [game_id for game_id, _ in read_ranked_game_ids(game_ids_file)]
+
+
+def main(game_ids_file: Path,
+         destination_dir: Path,
+         batch_size: int,
+         workers: int = 1,
+         rate: Optional[float] = None,
+         cache_path: Optional[Path] = None,
+         policy: Sequence[Tuple[Optional[int], float]] = DEFAULT_POLICY,
+         compress: bool = True,
+         base_url: str = BASE_URL,
+         batcher: Optional[AdaptiveBatcher] = None) -> None:
     """Run scraper
 
+    Batch files left by a previous run are removed first. Without a cache,
+    responses are streamed straight to the batch files. When a cache is given,
+    only games that are stale under the freshness policy are fetched, and only
+    games whose XML changed since it was cached are written to batch files.
+    Fetched games stay pending in the cache until cache.commit_pending is
+    called after they are loaded.
+
     Args:
-        game_ids_file (Path): Filepath of csv file containing game id's
+        game_ids_file (Path): Filepath of csv file containing game id's, see read_ranked_game_ids
         destination_dir (Path): Filepath of directory to save xml files
         batch_size (int): Number of games to include per API query
+        workers (int): Max number of concurrent API requests
+        rate (float): Max API requests per second, unlimited if None
+        cache_path (Path): Filepath of game XML cache database, disables caching if None
+        policy (list): Freshness tiers of (max rank, max age in days) for cached games
+        compress (bool): Gzip-compress batch files
+        base_url (str): Root URL of the API
+        batcher (AdaptiveBatcher): Sizes batches from observed responses, starting
+            from its own initial size instead of batch_size, if given
     """
-    with game_ids_file.open() as file:
-        game_ids = file.read().split('\n')
+    with metrics.stage('extract_xml'):
+        ranked_ids = read_ranked_game_ids(game_ids_file)
+        game_ids = [game_id for game_id, _ in ranked_ids]
+        for old_file in destination_dir.glob('bgg_games_batch_*.xml*'):
+            old_file.unlink()
+
+        if cache_path is None:
+            metrics.count('extract_xml.games_requested', len(game_ids))
+            download_game_pages(game_ids, batch_size, destination_dir, workers, rate, compress, base_url, batcher)
+            return
 
-    for num, xml in enumerate(scrape_game_pages(game_ids, batch_size)):
-        destination_path = destination_dir / f'bgg_games_batch_{str(num).zfill(2)}.xml'
-        save_file(destination_path, xml)
+        with GameCache(cache_path) as cache:
+            cache.discard_pending()
+            stale_ids = cache.stale_ids(game_ids, policy, ranks=[rank for _, rank in ranked_ids])
+            metrics.count('extract_xml.games_requested', len(stale_ids))
+            pages = scrape_game_pages(stale_ids, batch_size, workers, rate, base_url, batcher)
+            for num, xml in enumerate(pages):
+                changed = cache.update(xml)
+                metrics.count('extract_xml.games_changed', len(changed))
+                if changed:
+                    save_file(batch_path(destination_dir, num, compress), join_items(changed))
@@ -0,0 +1,219 @@
+"""Post-load finalisation of the loaded tables
+
+Tables are created without keys or indexes and bulk loaded, then finalised in
+three steps:
+
+1. Primary keys and secondary indexes are built, each from one sorted scan of
+   the loaded table, instead of being maintained row by row during COPY.
+2. Foreign keys are added NOT VALID, which only takes brief locks.
+3. Foreign keys are validated, scanning the referencing table under a lock
+   that still allows reads and writes.
+
+Steps 1 and 3 run one table per connection across a thread pool, so each takes
+about as long as its largest table rather than the sum of all tables. Keys,
+indexes and constraints that already exist, for instance after a previous
+merge load, are left as they are.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from . import metrics
+from .tables import CLASS_TYPES, FOREIGN_KEYS, PRIMARY_KEYS, SCHEMA
+
+# Index name -> (table, indexed columns) of secondary indexes. Relationship
+# tables get the reverse of their primary key, to find the games of a class.
+INDEXES = {
+    'game_popularity_idx': ('game', 'popularity DESC'),
+    **{f'game_{name}_{name}_id_idx': (f'game_{name}', f'{name}_id, game_id') for name in CLASS_TYPES}
+}
+
+# Named steps of SQL statements, run in order on one connection
+Steps = List[Tuple[str, str]]
+
+
+def primary_key_name(table_name: str) -> str:
+    """Name Postgres gives the primary key of a table declared inline"""
+    return f'{table_name}_pkey'
+
+
+def foreign_key_name(table_name: str, column: str) -> str:
+    """Name Postgres gives a foreign key on a single column declared inline"""
+    return f'{table_name}_{column}_fkey'
+
+
+def existing_constraints(cursor) -> Dict[str, Tuple[str, str, bool]]:
+    """Primary and foreign keys on the tables of SCHEMA
+
+    Returns:
+        dict: Constraint name -> (table name, 'p' or 'f', whether it is validated)
+    """
+    cursor.execute("SELECT conname, conrelid::regclass::text, contype, convalidated FROM pg_constraint "
+                   "WHERE contype IN ('p', 'f') AND conrelid::regclass::text = ANY(%s)", (list(SCHEMA),))
+    return {name: (table_name, kind, validated) for name, table_name, kind, validated in cursor.fetchall()}
+
+
+def existing_indexes(cursor) -> Set[str]:
+    """Names of the secondary indexes of INDEXES that exist"""
+    cursor.execute('SELECT indexname FROM pg_indexes WHERE indexname = ANY(%s)', (list(INDEXES),))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def key_steps(existing: Dict[str, Tuple[str, str, bool]], indexes: Set[str] = frozenset()) -> Dict[str, Steps]:
+    """Statements building missing primary keys and secondary indexes, grouped by table
+
+    Args:
+        existing (dict): Existing constraints, see existing_constraints
+        indexes (set): Existing secondary indexes, see existing_indexes
+
+    Returns:
+        dict: Steps keyed by table name
+    """
+    steps = {table_name: [] for table_name in SCHEMA}
+    for table_name, keys in PRIMARY_KEYS.items():
+        name = primary_key_name(table_name)
+        if name not in existing:
+            steps[table_name].append((f'pkey.{table_name}', f'ALTER TABLE {table_name} '
+                                                            f'ADD CONSTRAINT {name} PRIMARY KEY ({", ".join(keys)})'))
+    for name, (table_name, columns) in INDEXES.items():
+        if name not in indexes:
+            steps[table_name].append((f'index.{name}', f'CREATE INDEX {name} ON {table_name} ({columns})'))
+    return {table_name: table_steps for table_name, table_steps in steps.items() if table_steps}
+
+
+def foreign_key_steps(existing: Dict[str, Tuple[str, str, bool]]) -> Steps:
+    """Statements dropping foreign keys not in FOREIGN_KEYS and adding missing ones NOT VALID"""
+    wanted = {foreign_key_name(table_name, column): (table_name, column, parent)
+              for table_name, references in FOREIGN_KEYS.items() for column, parent in references}
+    steps = []
+    for name, (table_name, kind, _) in sorted(existing.items()):
+        if kind == 'f' and name not in wanted:
+            steps.append((f'drop_fk.{name}', f'ALTER TABLE {table_name} DROP CONSTRAINT {name}'))
+    for name, (table_name, column, parent) in wanted.items():
+        if name not in existing:
+            steps.append((f'fk.{name}', f'ALTER TABLE {table_name} ADD CONSTRAINT {name} '
+                                        f'FOREIGN KEY ({column}) REFERENCES {parent} (id) NOT VALID'))
+    return steps
+
+
+def validate_steps(existing: Dict[str, Tuple[str, str, bool]]) -> Dict[str, Steps]:
+    """Statements validating foreign keys that are not validated yet, grouped by table
+
+    Two validations of the same table would wait on each other's lock, so they
+    are run one after the other on the same connection.
+    """
+    steps = {}
+    for name, (table_name, kind, validated) in sorted(existing.items()):
+        if kind == 'f' and not validated:
+            steps.setdefault(table_name, []).append(
+                (f'validate.{name}', f'ALTER TABLE {table_name} VALIDATE CONSTRAINT {name}'))
+    return steps
+
+
+def run_steps(conn, steps: Steps, maintenance_work_mem: Optional[str] = None,
+              prefix: str = 'finalize') -> Dict[str, float]:
+    """Run steps on a connection in autocommit mode, recording each as a <prefix>.<step> stage
+
+    Returns:
+        dict: Step name -> wall time in seconds
+    """
+    timings = {}
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        if maintenance_work_mem:
+            cursor.execute('SET maintenance_work_mem = %s', (maintenance_work_mem,))
+        for step, sql in steps:
+            start = perf_counter()
+            with metrics.stage(f'{prefix}.{step}'):
+                cursor.execute(sql)
+            timings[step] = round(perf_counter() - start, 3)
+    return timings
+
+
+def run_parallel(connect: Callable, groups: Dict[str, Steps], workers: int,
+                 maintenance_work_mem: Optional[str] = None, prefix: str = 'finalize') -> Dict[str, float]:
+    """Run each group of steps on its own connection, up to `workers` groups at once
+
+    Args:
+        connect (callable): Opens a new psycopg2 connection
+        groups (dict): Steps keyed by table name, see key_steps
+        workers (int): Max number of concurrent connections
+        maintenance_work_mem (str): Memory for index builds per connection, such
+            as '256MB', the server default if None
+        prefix (str): Prefix of the stage names steps are recorded under
+
+    Returns:
+        dict: Step name -> wall time in seconds
+    """
+    def run_group(steps: Steps) -> Dict[str, float]:
+        with closing(connect()) as conn:
+            return run_steps(conn, steps, maintenance_work_mem, prefix)
+
+    timings = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for group_timings in executor.map(run_group, groups.values()):
+            timings.update(group_timings)
+    return timings
+
+
+def _existing_constraints(connect: Callable) -> Dict[str, Tuple[str, str, bool]]:
+    with closing(connect()) as conn:
+        with conn.cursor() as cursor:
+            existing = existing_constraints(cursor)
+        conn.rollback()
+    return existing
+
+
+def create_keys(connect: Callable, workers: int = 4, maintenance_work_mem: Optional[str] = None) -> Dict[str, float]:
+    """Build missing primary keys and secondary indexes, one table per connection
+
+    Merge loads upsert on the primary keys, so this step alone is run before them.
+
+    Args:
+        connect (callable): Opens a new psycopg2 connection
+        workers (int): Max number of concurrent connections
+        maintenance_work_mem (str): Memory for index builds per connection, such
+            as '256MB', the server default if None
+
+    Returns:
+        dict: Step name -> wall time in seconds
+    """
+    with closing(connect()) as conn:
+        with conn.cursor() as cursor:
+            steps = key_steps(existing_constraints(cursor), existing_indexes(cursor))
+        conn.rollback()
+    return run_parallel(connect, steps, workers, maintenance_work_mem)
+
+
+def main(connect: Callable, workers: int = 4, maintenance_work_mem: Optional[str] = None) -> Dict[str, float]:
+    """Build primary keys and indexes, then add and validate foreign keys
+
+    Args:
+        connect (callable): Opens a new psycopg2 connection
+        workers (int): Max number of concurrent connections
+        maintenance_work_mem (str): Memory for index builds per connection, such
+            as '256MB', the server default if None
+
+    Returns:
+        dict: Wall time in seconds of every step run, and of the keys, foreign_keys
+            and validate phases
+    """
+    timings = {}
+    with metrics.stage('finalize'):
+        start = perf_counter()
+        timings.update(create_keys(connect, workers, maintenance_work_mem))
+        timings['keys'] = round(perf_counter() - start, 3)
+
+        start = perf_counter()
+        with closing(connect()) as conn:
+            timings.update(run_steps(conn, foreign_key_steps(_existing_constraints(connect))))
+        timings['foreign_keys'] = round(perf_counter() - start, 3)
+
+        start = perf_counter()
+        timings.update(run_parallel(connect, validate_steps(_existing_constraints(connect)), workers))
+        timings['validate'] = round(perf_counter() - start, 3)
+
+    for step, seconds in timings.items():
+        print(f'{step}: {seconds}s')
+    return timings
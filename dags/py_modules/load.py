@@ -1,7 +1,15 @@
 """Load functions for ETL pipeline"""
 
+import csv
+from io import BytesIO, StringIO
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
 import pandas as pd
+from . import metrics, parquet
+from .tables import PRIMARY_KEYS, RELATIONSHIP_TABLES, SCHEMA, TableBuffer
+
+# Bytes read from the CSV file per chunk sent to Postgres by COPY
+COPY_CHUNK_SIZE = 1 << 20
 
 
 def load_table(csv_path: Path, engine) -> None:
@@ -14,3 +22,191 @@ def load_table(csv_path: Path, engine) -> None:
     table_name = csv_path.stem
     table_df = pd.read_csv(csv_path, header=0)
     table_df.to_sql(table_name, engine, if_exists='append', index=None)
+
+
+def _copy_csv(cursor, csv_path: Path, table_name: str, chunk_size: int) -> int:
+    """Stream a CSV file into a table with COPY FROM STDIN, returning the row count"""
+    with csv_path.open(encoding='utf-8', newline='') as file:
+        columns = next(csv.reader([file.readline()]))
+        sql = f'COPY {table_name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)'
+        cursor.copy_expert(sql, file, size=chunk_size)
+    return cursor.rowcount
+
+
+def _copy_parquet(cursor, parquet_path: Path, table_name: str) -> int:
+    """Stream a Parquet file into a table with COPY FROM STDIN, one record batch at a time"""
+    sql = f'COPY {table_name} ({", ".join(SCHEMA[parquet_path.stem])}) FROM STDIN WITH (FORMAT csv)'
+    row_count = 0
+    for chunk in parquet.iter_csv_chunks(parquet_path):
+        cursor.copy_expert(sql, BytesIO(chunk))
+        row_count += cursor.rowcount
+    return row_count
+
+
+def _copy_file(cursor, path: Path, table_name: str, chunk_size: int) -> int:
+    """Stream a CSV or Parquet file into a table, returning the row count"""
+    if path.suffix == '.parquet':
+        return _copy_parquet(cursor, path, table_name)
+    return _copy_csv(cursor, path, table_name, chunk_size)
+
+
+def copy_table(csv_path: Path, conn, chunk_size: int = COPY_CHUNK_SIZE) -> int:
+    """Bulk load contents of CSV or Parquet file into Postgres table with COPY FROM STDIN
+
+    The file is streamed to the server in chunks of chunk_size bytes, or one
+    record batch at a time for Parquet files, so memory use does not depend on
+    the size of the table.
+
+    Args:
+        csv_path (Path): Path of CSV or Parquet file to load into table, named after the table
+        conn: psycopg2 connection
+        chunk_size (int): Number of bytes to send per chunk
+
+    Returns:
+        int: Number of rows loaded
+    """
+    with metrics.stage(f'load.{csv_path.stem}'):
+        with conn.cursor() as cursor:
+            row_count = _copy_file(cursor, csv_path, csv_path.stem, chunk_size)
+        conn.commit()
+    metrics.count(f'rows.{csv_path.stem}', row_count)
+    return row_count
+
+
+def copy_buffer(cursor, table: TableBuffer) -> int:
+    """Bulk load the rows of a table buffer into its table through an in-memory CSV
+
+    Args:
+        cursor: psycopg2 cursor
+        table (TableBuffer): Rows to load, into the table of the same name
+
+    Returns:
+        int: Number of rows loaded
+    """
+    data = StringIO()
+    csv.writer(data).writerows(table.sql_rows())
+    data.seek(0)
+    cursor.copy_expert(f'COPY {table.name} ({", ".join(table.columns)}) FROM STDIN WITH (FORMAT csv)', data)
+    return len(table)
+
+
+def stream_tables(chunks: Iterable[Dict[str, TableBuffer]], conn) -> Dict[str, int]:
+    """Bulk load chunks of transform output straight into Postgres
+
+    Each chunk is copied and released before the next one is transformed, so
+    memory use is bounded by the chunk size, and no intermediate files are
+    written. All chunks are loaded in one transaction.
+
+    Args:
+        chunks (iterable): Table buffers keyed by table name, as yielded by
+            transform_xml.stream_tables
+        conn: psycopg2 connection
+
+    Returns:
+        dict: Number of rows loaded into each table
+    """
+    row_counts = {name: 0 for name in SCHEMA}
+    with metrics.stage('load.stream'), conn.cursor() as cursor:
+        for chunk in chunks:
+            for name, table in chunk.items():
+                if len(table):
+                    row_counts[name] += copy_buffer(cursor, table)
+        conn.commit()
+    for name, row_count in row_counts.items():
+        metrics.count(f'rows.{name}', row_count)
+    return row_counts
+
+
+def read_scope_ids(csv_path: Path) -> List[int]:
+    """Read the game ids in the first column of a CSV or Parquet file, such as game.csv"""
+    if csv_path.suffix == '.parquet':
+        column = next(iter(SCHEMA[csv_path.stem]))
+        return parquet.read_table(csv_path, [column]).column(0).to_pylist()
+    with csv_path.open(encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        next(reader)
+        return [int(row[0]) for row in reader]
+
+
+def merge_statements(table_name: str) -> Dict[str, Optional[str]]:
+    """Build the SQL used to merge a staged copy of a table into the table
+
+    Args:
+        table_name (str): Name of table, as a key of tables.SCHEMA
+
+    Returns:
+        dict: 'stage', 'upsert' and 'delete' statements. 'delete' is None for
+            tables other than relationship tables, and expects the game ids it
+            is limited to as its only parameter.
+    """
+    if table_name not in SCHEMA:
+        raise ValueError(f'Unknown table {table_name}')
+
+    stage = f'stage_{table_name}'
+    columns = ', '.join(SCHEMA[table_name])
+    keys = PRIMARY_KEYS[table_name]
+    values = [column for column in SCHEMA[table_name] if column not in keys]
+
+    if values:
+        conflict = (f'DO UPDATE SET {", ".join(f"{column} = EXCLUDED.{column}" for column in values)} '
+                    f'WHERE ({", ".join(f"{table_name}.{column}" for column in values)}) '
+                    f'IS DISTINCT FROM ({", ".join(f"EXCLUDED.{column}" for column in values)})')
+    else:
+        conflict = 'DO NOTHING'
+
+    delete = None
+    if table_name in RELATIONSHIP_TABLES:
+        delete = (f'DELETE FROM {table_name} AS target WHERE target.game_id = ANY(%s) '
+                  f'AND NOT EXISTS (SELECT 1 FROM {stage} AS staged WHERE '
+                  f'{" AND ".join(f"staged.{key} = target.{key}" for key in keys)})')
+
+    return {
+        'stage': f'CREATE TEMP TABLE {stage} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP',
+        'upsert': (f'WITH merged AS (INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {stage} '
+                   f'ON CONFLICT ({", ".join(keys)}) {conflict} RETURNING xmax = 0 AS inserted) '
+                   'SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM merged'),
+        'delete': delete
+    }
+
+
+def merge_table(csv_path: Path,
+                conn,
+                scope_ids: Optional[Sequence[int]] = None,
+                chunk_size: int = COPY_CHUNK_SIZE) -> Dict[str, int]:
+    """Merge contents of CSV or Parquet file into an existing Postgres table
+
+    Rows are copied into a temporary table and upserted on the table's primary
+    key, leaving unchanged rows untouched. For relationship tables, rows of the
+    games in scope that are no longer present in the file are deleted. The whole
+    merge runs in one transaction, so readers never see a partially loaded table.
+
+    Args:
+        csv_path (Path): Path of CSV or Parquet file to merge into table, named after the table
+        conn: psycopg2 connection
+        scope_ids (list): Game ids whose relationship rows are replaced, defaults
+            to the game ids present in the file
+        chunk_size (int): Number of bytes to send per COPY chunk
+
+    Returns:
+        dict: Number of rows inserted, updated and deleted
+    """
+    table_name = csv_path.stem
+    statements = merge_statements(table_name)
+
+    with metrics.stage(f'merge.{table_name}'), conn.cursor() as cursor:
+        cursor.execute(statements['stage'])
+        staged = _copy_file(cursor, csv_path, f'stage_{table_name}', chunk_size)
+        cursor.execute(statements['upsert'])
+        inserted, updated = cursor.fetchone()
+        deleted = 0
+        if statements['delete'] is not None:
+            if scope_ids is None:
+                cursor.execute(f'SELECT ARRAY(SELECT DISTINCT game_id FROM stage_{table_name})')
+                scope_ids = cursor.fetchone()[0]
+            cursor.execute(statements['delete'], (list(scope_ids),))
+            deleted = cursor.rowcount
+        conn.commit()
+
+    for action, row_count in [('staged', staged), ('inserted', inserted), ('updated', updated), ('deleted', deleted)]:
+        metrics.count(f'merge.{table_name}.{action}', row_count)
+    return {'inserted': inserted, 'updated': updated, 'deleted': deleted}
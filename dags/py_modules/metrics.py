@@ -0,0 +1,159 @@
+"""Timing and resource instrumentation for pipeline stages
+
+Pipeline modules record into the current report through the module-level
+stage, count, observe and sample functions. A task collects a fresh report by running
+inside recording(), which saves the report as JSON and optionally pushes it to
+StatsD when the task finishes.
+"""
+
+import json
+import resource
+import socket
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from statistics import quantiles
+from threading import Lock
+from time import perf_counter, process_time
+from typing import Dict, Iterator, List, Optional
+
+# ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process and its child processes, in MiB"""
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak * _RSS_UNIT / 2 ** 20, 1)
+
+
+class RunReport:
+    """Stage timings, counters, latency samples and other samples recorded during a run"""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.latencies = {}
+        self.samples = {}
+        self._lock = Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Record wall time, CPU time and peak RSS of the enclosed block"""
+        wall_start, cpu_start = perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            self.stages[name] = {
+                'wall_time': round(perf_counter() - wall_start, 3),
+                'cpu_time': round(process_time() - cpu_start, 3),
+                'peak_rss_mb': peak_rss_mb()
+            }
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Add value to a named counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record a latency sample"""
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def sample(self, name: str, value: float) -> None:
+        """Record a sample of a value chosen during the run, such as a batch size"""
+        with self._lock:
+            self.samples.setdefault(name, []).append(value)
+
+    def to_dict(self) -> dict:
+        """Report as a JSON-serializable dict, with latencies and samples summarized"""
+        return {
+            'stages': dict(self.stages),
+            'counters': dict(self.counters),
+            'latencies': {name: summarize(samples) for name, samples in self.latencies.items()},
+            'samples': {name: summarize(samples) for name, samples in self.samples.items()}
+        }
+
+    def save(self, path: Path) -> None:
+        """Write report to a JSON file"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def push_statsd(self, address: str, prefix: str = 'bgg_pipeline') -> None:
+        """Send stage timings as timers and counters as counts to a StatsD server
+
+        Args:
+            address (str): StatsD server as host:port
+            prefix (str): Prefix of metric names
+        """
+        host, port = address.rsplit(':', 1)
+        lines = []
+        for name, stage in self.stages.items():
+            lines.append(f'{prefix}.{name}.wall_time:{stage["wall_time"] * 1000:.0f}|ms')
+            lines.append(f'{prefix}.{name}.cpu_time:{stage["cpu_time"] * 1000:.0f}|ms')
+            lines.append(f'{prefix}.{name}.peak_rss_mb:{stage["peak_rss_mb"]}|g')
+        lines.extend(f'{prefix}.{name}:{value}|c' for name, value in self.counters.items())
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for line in lines:
+                sock.sendto(line.encode(), (host, int(port)))
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Summarize samples, such as latencies in seconds"""
+    cuts = quantiles(samples, n=20, method='inclusive') if len(samples) > 1 else samples * 19
+    return {
+        'count': len(samples),
+        'mean': round(sum(samples) / len(samples), 4),
+        'p50': round(cuts[9], 4),
+        'p95': round(cuts[18], 4),
+        'max': round(max(samples), 4)
+    }
+
+
+_current = RunReport()
+
+
+@contextmanager
+def recording(path: Optional[Path] = None, statsd_address: Optional[str] = None) -> Iterator[RunReport]:
+    """Record into a fresh report for the duration of the block
+
+    Args:
+        path (Path): JSON file to save the report to on exit, if any
+        statsd_address (str): StatsD server as host:port to push the report to, if any
+
+    Returns:
+        Yields the report being recorded
+    """
+    global _current
+    previous, _current = _current, RunReport()
+    report = _current
+    try:
+        yield report
+    finally:
+        _current = previous
+        if path is not None:
+            report.save(path)
+        if statsd_address:
+            report.push_statsd(statsd_address)
+
+
+def stage(name: str):
+    """Record wall time, CPU time and peak RSS of the enclosed block in the current report"""
+    return _current.stage(name)
+
+
+def count(name: str, value: int = 1) -> None:
+    """Add value to a named counter of the current report"""
+    _current.count(name, value)
+
+
+def observe(name: str, seconds: float) -> None:
+    """Record a latency sample in the current report"""
+    _current.observe(name, seconds)
+
+
+def sample(name: str, value: float) -> None:
+    """Record a sample of a chosen value in the current report"""
+    _current.sample(name, value)
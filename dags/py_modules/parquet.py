@@ -0,0 +1,79 @@
+"""Parquet intermediate files for the transform and load stages
+
+An alternative to CSV files between transform and load: every table is written
+with an explicit Arrow schema matching create_tables.sql, so no dtypes are
+inferred when reading, and text never has to be quoted. Files are zstd
+compressed, with dictionary encoding on name columns, and are read through a
+memory map. pyarrow is imported when first used, so it is only required when
+this format is selected.
+"""
+
+from io import BytesIO
+from pathlib import Path
+from typing import List, Optional
+from pandas import DataFrame
+from .tables import SCHEMA
+
+COMPRESSION = 'zstd'
+
+# Text columns holding short, repeated names; long free text is left plain
+DICTIONARY_COLUMNS = {'title', 'name'}
+
+
+def arrow_schema(table_name: str):
+    """Arrow schema of a table, with the column order and types of tables.SCHEMA"""
+    import pyarrow as pa
+
+    types = {'int': pa.int32(), 'real': pa.float32(), 'bool': pa.bool_(), 'text': pa.string()}
+    return pa.schema([pa.field(column, types[sql_type])
+                      for column, sql_type in SCHEMA[table_name].items()])
+
+
+def save_df(dataframe: DataFrame, destination_path: Path) -> None:
+    """Save DataFrame to a Parquet file, named after its table
+
+    Args:
+        dataframe (DataFrame): Rows of the table, with the columns of tables.SCHEMA
+        destination_path (Path): Parquet file to write, its stem is the table name
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(destination_path.stem)
+    table = pa.Table.from_pandas(dataframe, schema=schema, preserve_index=False)
+    pq.write_table(table, destination_path, compression=COMPRESSION,
+                   use_dictionary=[column for column in schema.names if column in DICTIONARY_COLUMNS])
+
+
+def read_table(path: Path, columns: Optional[List[str]] = None):
+    """Read a Parquet file into an Arrow table, through a memory map"""
+    import pyarrow.parquet as pq
+
+    return pq.read_table(path, columns=columns, memory_map=True)
+
+
+def count_rows(path: Path) -> int:
+    """Number of rows in a Parquet file, read from its footer"""
+    import pyarrow.parquet as pq
+
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def iter_csv_chunks(path: Path, batch_rows: int = 100_000):
+    """Yield the rows of a Parquet file as CSV without a header, one record batch at a time
+
+    Args:
+        path (Path): Parquet file to read
+        batch_rows (int): Max number of rows per chunk
+
+    Returns:
+        Yields bytes of CSV data
+    """
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    options = pa_csv.WriteOptions(include_header=False)
+    for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_rows):
+        buffer = BytesIO()
+        pa_csv.write_csv(batch, buffer, write_options=options)
+        yield buffer.getvalue()
@@ -0,0 +1,32 @@
+"""Rate limiting for requests made to BGG.com"""
+
+from threading import Lock
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter
+
+    Tokens are refilled at `rate` per second, up to `capacity`, so callers may
+    burst up to `capacity` requests before being held to the sustained rate.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available, then consume it"""
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            sleep(wait)
@@ -0,0 +1,94 @@
+"""Game records built from a declarative field spec
+
+Every game column read from a `value` attribute is described once in
+GAME_FIELDS, with the tag holding it, the converter applied to it and whether
+it may be missing. Parsers collect raw attribute values by tag in a single pass
+over an item's elements, and GameRecord.from_values converts them all at once.
+"""
+
+from collections import namedtuple
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class Field(NamedTuple):
+    """Game column read from the value attribute of a tag"""
+    column: str
+    tag: str
+    converter: Callable[[str], Any]
+    nullable: bool = True
+
+
+# In the column order of the game table, between id and kickstarter
+GAME_FIELDS = (
+    Field('title', 'name', str, nullable=False),
+    Field('release_year', 'yearpublished', int),
+    Field('avg_rating', 'average', float),
+    Field('bayes_rating', 'bayesaverage', float),
+    Field('total_ratings', 'usersrated', int, nullable=False),
+    Field('std_ratings', 'stddev', float),
+    Field('min_players', 'minplayers', int),
+    Field('max_players', 'maxplayers', int),
+    Field('min_playtime', 'minplaytime', int),
+    Field('max_playtime', 'maxplaytime', int),
+    Field('min_age', 'minage', int),
+    Field('weight', 'averageweight', float),
+    Field('owned_copies', 'owned', int),
+    Field('wishlist', 'wishing', int)
+)
+
+# Tag -> position of its field in GAME_FIELDS
+FIELD_INDEX = {field.tag: index for index, field in enumerate(GAME_FIELDS)}
+
+
+class MalformedGame(ValueError):
+    """A game item lacks a required field or holds a value that does not convert"""
+
+
+class GameRecord(namedtuple('GameRecord', ['id', *(field.column for field in GAME_FIELDS), 'kickstarter'])):
+    """One row of the game table, a tuple in column order with an attribute per column
+
+    Being a tuple without a per-instance dict, a record is appended to a table
+    buffer as it is.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_values(cls, game_id: int, raw: List[Optional[str]], kickstarter: bool) -> 'GameRecord':
+        """Convert raw attribute values, collected in GAME_FIELDS order, into a record
+
+        Args:
+            game_id (int): Game id
+            raw (list): Value attribute of the first element with each field's tag,
+                None where the tag is missing
+            kickstarter (bool): Whether the game is in the Kickstarter family
+
+        Returns:
+            GameRecord: Record with missing nullable fields set to None
+
+        Raises:
+            MalformedGame: A required field is missing, or a value does not convert
+        """
+        values = [game_id]
+        for field, value in zip(GAME_FIELDS, raw):
+            if value is None:
+                if not field.nullable:
+                    raise MalformedGame(f'game {game_id} has no {field.tag}')
+                values.append(None)
+                continue
+            try:
+                values.append(field.converter(value))
+            except ValueError:
+                raise MalformedGame(f'game {game_id} has {field.tag} {value!r}') from None
+        values.append(kickstarter)
+        return cls._make(values)
+
+    @classmethod
+    def from_pairs(cls, game_id: int, pairs: Iterable[Tuple[str, Optional[str]]], kickstarter: bool) -> 'GameRecord':
+        """Build a record from (tag, value attribute) pairs of an item's elements, in document order"""
+        raw = [None] * len(GAME_FIELDS)
+        for tag, value in pairs:
+            index = FIELD_INDEX.get(tag)
+            if index is not None and raw[index] is None:
+                raw[index] = value
+        return cls.from_values(game_id, raw, kickstarter)
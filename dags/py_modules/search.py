@@ -0,0 +1,83 @@
+"""Full-text search over game titles and descriptions
+
+Search vectors are kept in their own table, game_search, with a GIN index:
+titles are weighted A and descriptions B, so title matches rank first. Each
+vector is stored with the MD5 of the text it was built from, and is only
+recomputed when that text changes, so a load that leaves descriptions alone
+costs one hash per game rather than one to_tsvector. The table is not dropped
+with the loaded tables, so replace loads keep the vectors of unchanged games.
+"""
+
+from typing import Dict, List, Tuple
+from . import metrics
+
+# Text search configuration used to build and query vectors
+TS_CONFIG = 'english'
+
+CREATE = [
+    'CREATE TABLE IF NOT EXISTS game_search ('
+    'game_id int PRIMARY KEY, source_md5 text NOT NULL, document tsvector NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS game_search_document_idx ON game_search USING GIN (document)'
+]
+
+# Text a game's vector is built from, and the hash telling whether it changed
+_SOURCE = "g.title || E'\\n' || d.description"
+
+DELETE_STALE = ('DELETE FROM game_search AS s WHERE NOT EXISTS '
+                '(SELECT 1 FROM game AS g JOIN game_description AS d ON d.game_id = g.id WHERE g.id = s.game_id)')
+
+UPSERT_CHANGED = (
+    'INSERT INTO game_search (game_id, source_md5, document) '
+    f'SELECT g.id, md5({_SOURCE}), '
+    f"setweight(to_tsvector('{TS_CONFIG}', g.title), 'A') || "
+    f"setweight(to_tsvector('{TS_CONFIG}', d.description), 'B') "
+    'FROM game AS g JOIN game_description AS d ON d.game_id = g.id '
+    'LEFT JOIN game_search AS s ON s.game_id = g.id '
+    f'WHERE s.source_md5 IS DISTINCT FROM md5({_SOURCE}) '
+    'ON CONFLICT (game_id) DO UPDATE SET source_md5 = EXCLUDED.source_md5, document = EXCLUDED.document'
+)
+
+SEARCH = (
+    "SELECT g.id, g.title, ts_rank_cd(s.document, query) AS rank "
+    f"FROM game_search AS s JOIN game AS g ON g.id = s.game_id, websearch_to_tsquery('{TS_CONFIG}', %s) AS query "
+    'WHERE s.document @@ query ORDER BY rank DESC, g.id LIMIT %s'
+)
+
+
+def update_search(conn) -> Dict[str, int]:
+    """Create the search table if missing, and rebuild the vectors of new or changed games
+
+    Args:
+        conn: psycopg2 connection
+
+    Returns:
+        dict: Number of vectors deleted, for games no longer loaded, and updated
+    """
+    with metrics.stage('search.update'), conn.cursor() as cursor:
+        for sql in CREATE:
+            cursor.execute(sql)
+        cursor.execute(DELETE_STALE)
+        deleted = cursor.rowcount
+        cursor.execute(UPSERT_CHANGED)
+        updated = cursor.rowcount
+        conn.commit()
+
+    metrics.count('search.deleted', deleted)
+    metrics.count('search.updated', updated)
+    print(f'game_search: {updated} vectors updated, {deleted} deleted')
+    return {'deleted': deleted, 'updated': updated}
+
+
+def search_games(cursor, query: str, limit: int = 20) -> List[Tuple[int, str, float]]:
+    """Find games matching a web-style search query, best matches first
+
+    Args:
+        cursor: psycopg2 cursor
+        query (str): Search terms, with optional "quoted phrases", OR and -exclusions
+        limit (int): Max number of games to return
+
+    Returns:
+        list: (game id, title, rank) of the matching games
+    """
+    cursor.execute(SEARCH, (query, limit))
+    return cursor.fetchall()
@@ -0,0 +1,140 @@
+"""Sharded extract and transform
+
+The ranked game ids are partitioned into shards, which are extracted and
+transformed independently, for instance by mapped Airflow tasks on separate
+workers. Each shard writes its own tables, which are merged and deduplicated
+by primary key before loading.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import pandas as pd
+from . import extract_xml, metrics, parquet, transform_xml
+from .batching import AdaptiveBatcher
+from .bggxmlapi2 import BASE_URL
+from .cache import DEFAULT_POLICY
+from .tables import SCHEMA, TableBuffer
+
+Manifest = List[Dict[str, Any]]
+
+# SQL type -> dtype of the column when reading a table back from CSV
+READ_DTYPES = {'int': 'Int32', 'real': 'float32', 'bool': 'bool'}
+
+
+def shard_ids(game_ids_file: Path, num_shards: int, shards_dir: Path) -> List[Dict[str, Any]]:
+    """Partition game ids into shards, writing the ids of each to its own directory
+
+    Games are assigned by id modulo num_shards, so a game stays in the same
+    shard from run to run, and so does its entry in a per-shard cache. Each
+    line of a shard's file holds a game id and its rank among all games, which
+    the cache's freshness policy is applied to.
+
+    Args:
+        game_ids_file (Path): File of ranked game ids, one per line
+        num_shards (int): Number of shards
+        shards_dir (Path): Directory to create a directory per shard in
+
+    Returns:
+        list: Shard number and the game ids file, XML directory and table
+            directory of each shard
+    """
+    shards = [[] for _ in range(num_shards)]
+    for game_id, rank in extract_xml.read_ranked_game_ids(game_ids_file):
+        shards[int(game_id) % num_shards].append((game_id, rank))
+
+    entries = []
+    for num, ids in enumerate(shards):
+        shard_dir = shards_dir / f'shard_{num}'
+        (shard_dir / 'xml').mkdir(parents=True, exist_ok=True)
+        (shard_dir / 'tables').mkdir(exist_ok=True)
+        ids_file = shard_dir / 'game_ids.csv'
+        ids_file.write_text(''.join(f'{game_id},{rank}\n' for game_id, rank in ids), encoding='utf-8')
+        entries.append({
+            'shard': num,
+            'game_ids_file': str(ids_file),
+            'xml_dir': str(shard_dir / 'xml'),
+            'table_dir': str(shard_dir / 'tables')
+        })
+    return entries
+
+
+def shard_cache_path(cache_path: Path, shard: int) -> Path:
+    """Cache file of one shard, next to the cache file of the unsharded pipeline"""
+    return cache_path.with_name(f'{cache_path.stem}.shard{shard}{cache_path.suffix}')
+
+
+def run_shard(shard: Dict[str, Any],
+              batch_size: int,
+              workers: int = 1,
+              rate: Optional[float] = None,
+              cache_path: Optional[Path] = None,
+              policy: Sequence[Tuple[Optional[int], float]] = DEFAULT_POLICY,
+              transform_workers: int = 1,
+              output_format: str = 'csv',
+              base_url: str = BASE_URL,
+              batcher: Optional[AdaptiveBatcher] = None) -> Dict[str, Any]:
+    """Extract and transform the games of one shard
+
+    Args:
+        shard (dict): Shard entry, as returned by shard_ids
+        batch_size (int): Number of games to include per API query
+        workers (int): Max number of concurrent API requests
+        rate (float): Max API requests per second for this shard, unlimited if None
+        cache_path (Path): Game XML cache of the unsharded pipeline, each shard
+            uses its own file next to it; caching is disabled if None
+        policy (list): Freshness tiers of (max rank, max age in days) for cached games
+        transform_workers (int): Number of worker processes to transform batch files with
+        output_format (str): 'csv' or 'parquet', see parquet.py
+        base_url (str): Root URL of the API
+        batcher (AdaptiveBatcher): Sizes API batches from observed responses, if given
+
+    Returns:
+        dict: Shard number and the manifest of its tables
+    """
+    with metrics.stage(f'shard_{shard["shard"]}'):
+        extract_xml.main(Path(shard['game_ids_file']), Path(shard['xml_dir']), batch_size, workers, rate,
+                         shard_cache_path(cache_path, shard['shard']) if cache_path else None, policy,
+                         base_url=base_url, batcher=batcher)
+        manifest = transform_xml.main(Path(shard['xml_dir']), Path(shard['table_dir']),
+                                      transform_workers, output_format)
+    return {'shard': shard['shard'], 'manifest': manifest}
+
+
+def read_table(name: str, path: Path) -> TableBuffer:
+    """Read a table written by transform_xml.write_tables back into a buffer"""
+    if path.suffix == '.parquet':
+        dataframe = parquet.read_table(path).to_pandas()
+    else:
+        dtypes = {column: READ_DTYPES.get(sql_type, str) for column, sql_type in SCHEMA[name].items()}
+        # Empty fields are NULL in numeric columns and empty strings in text columns
+        na_values = {column: [''] for column, sql_type in SCHEMA[name].items() if sql_type in READ_DTYPES}
+        dataframe = pd.read_csv(path, dtype=dtypes, keep_default_na=False, na_values=na_values)
+    return TableBuffer.from_dataframe(name, dataframe)
+
+
+def read_tables(manifest: Manifest) -> Dict[str, TableBuffer]:
+    """Read every table of a shard manifest"""
+    return {entry['table']: read_table(entry['table'], Path(entry['path'])) for entry in manifest}
+
+
+def merge_shards(shard_results: Sequence[Dict[str, Any]], csv_dir: Path, output_format: str = 'csv') -> Manifest:
+    """Merge the tables of all shards, deduplicated by primary key, for loading
+
+    Shards are read one at a time, in shard order, so at most one shard's
+    tables are held besides the merged result.
+
+    Args:
+        shard_results (list): Results of run_shard for every shard
+        csv_dir (Path): Directory to save the merged tables to
+        output_format (str): 'csv' or 'parquet', see parquet.py
+
+    Returns:
+        list: Manifest of the merged files, see transform_xml.write_tables
+    """
+    def partials() -> Iterator[Dict[str, TableBuffer]]:
+        for result in sorted(shard_results, key=lambda result: result['shard']):
+            yield read_tables(result['manifest'])
+
+    with metrics.stage('merge_shards'):
+        tables = transform_xml.merge_tables(partials())
+        return transform_xml.write_tables(tables, csv_dir, output_format)
@@ -0,0 +1,252 @@
+"""Precomputed game similarity and classification co-occurrence
+
+The loaded relationship tables are read into sparse game x classification
+matrices (scipy CSR), from which two kinds of tables are computed:
+
+- game_similarity: the top K games most similar to each game, by cosine
+  similarity of their combined mechanic, category, designer and publisher
+  features, so similar games are a primary key lookup rather than self-joins.
+- <class>_cooccurrence: for each pair of mechanics, or of categories, the
+  number of games classified as both.
+
+Similarities are computed for a chunk of games at a time, as one sparse matrix
+product against all games followed by a vectorised top K selection, so memory
+use is bounded by the chunk size rather than the square of the number of games.
+Every table is first loaded under a new name, then all of them are swapped in
+together just before the transaction commits, so readers see the old results
+until the new ones are complete and are only blocked by the swap.
+"""
+
+from contextlib import closing
+from io import StringIO
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from . import metrics
+
+# Classification types whose features are compared by game_similarity
+SIMILARITY_CLASSES = ['mechanic', 'category', 'designer', 'publisher']
+
+# Classification types with a co-occurrence table
+COOCCURRENCE_CLASSES = ['mechanic', 'category']
+
+# Similar games kept per game
+TOP_K = 20
+
+# Games compared with all other games per matrix product. Small chunks keep
+# the similarities of a chunk in CPU cache, which is faster than larger ones.
+CHUNK_ROWS = 16
+
+# Output table -> (column definitions, primary key columns)
+TABLES = {
+    'game_similarity': ('game_id int NOT NULL, rank smallint NOT NULL, similar_game_id int NOT NULL, '
+                        'similarity real NOT NULL', ('game_id', 'rank')),
+    **{f'{name}_cooccurrence': (f'{name}_id int NOT NULL, other_{name}_id int NOT NULL, games int NOT NULL',
+                                (f'{name}_id', f'other_{name}_id'))
+       for name in COOCCURRENCE_CLASSES}
+}
+
+Pairs = Tuple[np.ndarray, np.ndarray]
+
+
+def read_pairs(cursor, name: str) -> Pairs:
+    """Read the (game id, classification id) rows of a relationship table
+
+    Args:
+        cursor: psycopg2 cursor
+        name (str): Classification type, such as 'mechanic'
+
+    Returns:
+        tuple: Arrays of game ids and classification ids
+    """
+    data = StringIO()
+    cursor.copy_expert(f'COPY game_{name} (game_id, {name}_id) TO STDOUT', data)
+    if not data.tell():
+        return np.empty(0, np.int32), np.empty(0, np.int32)
+    data.seek(0)
+    pairs = pd.read_csv(data, sep='\t', header=None, dtype=np.int32).to_numpy()
+    return pairs[:, 0], pairs[:, 1]
+
+
+def incidence_matrix(game_ids: np.ndarray, pairs: Pairs, dtype=np.float32) -> Tuple[np.ndarray, sparse.csr_matrix]:
+    """Binary game x classification matrix of relationship rows
+
+    Args:
+        game_ids (np.ndarray): Sorted game ids, one per matrix row
+        pairs (tuple): Arrays of game ids and classification ids
+        dtype: Type of the matrix entries
+
+    Returns:
+        tuple: Sorted classification ids, one per column, and the matrix
+    """
+    games, classes = pairs
+    class_ids, columns = np.unique(classes, return_inverse=True)
+    rows = np.searchsorted(game_ids, games)
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype), (rows, columns.ravel())),
+                               shape=(len(game_ids), len(class_ids)))
+    return class_ids, matrix
+
+
+def feature_matrix(pairs: Dict[str, Pairs]) -> Tuple[np.ndarray, sparse.csr_matrix]:
+    """Row-normalised game x feature matrix, one column per classification of each type
+
+    The dot product of two rows is the cosine similarity of the games.
+
+    Args:
+        pairs (dict): Classification type -> arrays of game ids and classification ids
+
+    Returns:
+        tuple: Sorted game ids, one per row, and the CSR matrix
+    """
+    game_ids = np.unique(np.concatenate([games for games, _ in pairs.values()]))
+    matrix = sparse.hstack([incidence_matrix(game_ids, name_pairs)[1] for name_pairs in pairs.values()],
+                           format='csr')
+    counts = np.diff(matrix.indptr)
+    norms = np.sqrt(np.bincount(np.repeat(np.arange(len(game_ids)), counts), weights=matrix.data ** 2,
+                                minlength=len(game_ids)))
+    matrix.data /= np.repeat(norms, counts).astype(np.float32)
+    return game_ids, matrix
+
+
+def top_k_similar(matrix: sparse.csr_matrix, k: int = TOP_K,
+                  chunk_rows: int = CHUNK_ROWS) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield the k most similar other rows of each row, a chunk of rows at a time
+
+    Each chunk is one dense x sparse product, over the features of its rows
+    only, giving the similarities of its rows to every row, from which the k
+    largest are selected with a partition rather than a sort. Ties are broken
+    by the lower row index, so results are deterministic. Rows sharing no
+    feature are never similar, so rows with fewer than k such rows get fewer
+    results.
+
+    Args:
+        matrix (csr_matrix): Row-normalised feature matrix
+        k (int): Max number of similar rows per row
+        chunk_rows (int): Rows compared with all rows at once; a chunk takes
+            chunk_rows x number of rows x 4 bytes
+
+    Yields:
+        tuple: Arrays of row indexes, ranks from 1, similar row indexes and similarities
+    """
+    num_rows = matrix.shape[0]
+    k = min(k, num_rows - 1)
+    if k < 1:
+        return
+    by_feature = matrix.T.tocsr()
+    for start in range(0, num_rows, chunk_rows):
+        stop = min(start + chunk_rows, num_rows)
+        # Only the features of the chunk's rows contribute to their similarities
+        chunk = matrix[start:stop]
+        features = np.unique(chunk.indices)
+        scores = np.ascontiguousarray(chunk[:, features].toarray() @ by_feature[features])
+        scores[np.arange(stop - start), np.arange(start, stop)] = 0
+
+        # Keep the rows scoring at least the kth largest score, including ties,
+        # then order them by descending score and row index and keep the first k
+        threshold = -np.partition(-scores, k - 1, axis=1)[:, k - 1:k]
+        rows, columns = np.nonzero((scores >= threshold) & (scores > 0))
+        values = scores[rows, columns]
+        order = np.lexsort((columns, -values, rows))
+        rows, columns, values = rows[order], columns[order], values[order]
+        ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        top = ranks < k
+        yield rows[top] + start, ranks[top] + 1, columns[top], values[top]
+
+
+def cooccurrence(pairs: Pairs) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Number of games sharing each pair of distinct classifications, in both orders
+
+    Args:
+        pairs (tuple): Arrays of game ids and classification ids
+
+    Returns:
+        tuple: Arrays of classification ids, other classification ids and game counts
+    """
+    game_ids = np.unique(pairs[0])
+    class_ids, matrix = incidence_matrix(game_ids, pairs, np.int32)
+    counts = (matrix.T @ matrix).tocoo()
+    other = counts.row != counts.col
+    return class_ids[counts.row[other]], class_ids[counts.col[other]], counts.data[other]
+
+
+def _copy_frame(cursor, table_name: str, frame: pd.DataFrame) -> int:
+    """Bulk load the rows of a DataFrame into a table through an in-memory CSV"""
+    data = StringIO()
+    frame.to_csv(data, header=False, index=False)
+    data.seek(0)
+    cursor.copy_expert(f'COPY {table_name} ({", ".join(frame.columns)}) FROM STDIN WITH (FORMAT csv)', data)
+    return len(frame)
+
+
+def load_new_table(cursor, name: str, frames: Iterator[pd.DataFrame]) -> int:
+    """Load rows into <name>_new, to be swapped in place of the current table by swap_tables
+
+    Only the new table is locked, so the current one stays readable.
+
+    Args:
+        cursor: psycopg2 cursor
+        name (str): Output table name, a key of TABLES
+        frames (iterable): DataFrames holding the rows, with the table's column names
+
+    Returns:
+        int: Number of rows loaded
+    """
+    columns, primary_key = TABLES[name]
+    cursor.execute(f'DROP TABLE IF EXISTS {name}_new')
+    cursor.execute(f'CREATE TABLE {name}_new ({columns})')
+    row_count = sum(_copy_frame(cursor, f'{name}_new', frame) for frame in frames)
+    cursor.execute(f'ALTER TABLE {name}_new ADD CONSTRAINT {name}_new_pkey PRIMARY KEY ({", ".join(primary_key)})')
+    metrics.count(f'rows.{name}', row_count)
+    return row_count
+
+
+def swap_tables(cursor, names: Iterable[str]) -> None:
+    """Replace each table by its loaded <name>_new table
+
+    Dropping a table locks it against reads until the transaction commits, so
+    this should run last, right before the commit.
+    """
+    for name in names:
+        cursor.execute(f'DROP TABLE IF EXISTS {name}')
+        cursor.execute(f'ALTER TABLE {name}_new RENAME TO {name}')
+        cursor.execute(f'ALTER INDEX {name}_new_pkey RENAME TO {name}_pkey')
+
+
+def main(connect: Callable, k: int = TOP_K, chunk_rows: int = CHUNK_ROWS) -> Dict[str, int]:
+    """Recompute the game similarity and co-occurrence tables from the loaded relationship tables
+
+    Args:
+        connect (callable): Opens a new psycopg2 connection
+        k (int): Similar games kept per game
+        chunk_rows (int): Games compared with all other games at once
+
+    Returns:
+        dict: Number of rows loaded into each output table
+    """
+    names: List[str] = list(dict.fromkeys(SIMILARITY_CLASSES + COOCCURRENCE_CLASSES))
+    row_counts = {}
+    with metrics.stage('similarity'), closing(connect()) as conn:
+        with conn.cursor() as cursor:
+            with metrics.stage('similarity.read'):
+                pairs = {name: read_pairs(cursor, name) for name in names}
+            conn.commit()
+
+            for name in COOCCURRENCE_CLASSES:
+                with metrics.stage(f'similarity.{name}_cooccurrence'):
+                    class_ids, other_ids, counts = cooccurrence(pairs[name])
+                    frame = pd.DataFrame({f'{name}_id': class_ids, f'other_{name}_id': other_ids, 'games': counts})
+                    row_counts[f'{name}_cooccurrence'] = load_new_table(cursor, f'{name}_cooccurrence', [frame])
+
+            with metrics.stage('similarity.game_similarity'):
+                game_ids, matrix = feature_matrix({name: pairs[name] for name in SIMILARITY_CLASSES})
+                frames = (pd.DataFrame({'game_id': game_ids[rows], 'rank': ranks,
+                                        'similar_game_id': game_ids[similar], 'similarity': values})
+                          for rows, ranks, similar, values in top_k_similar(matrix, k, chunk_rows))
+                row_counts['game_similarity'] = load_new_table(cursor, 'game_similarity', frames)
+
+            swap_tables(cursor, row_counts)
+        conn.commit()
+
+    print(f'Similarity tables rebuilt: {row_counts}')
+    return row_counts
@@ -0,0 +1,268 @@
+"""Output table schemas and columnar row buffers for the transform stage"""
+
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from pandas import DataFrame
+from pandas.arrays import IntegerArray
+
+CLASS_TYPES = ['mechanic', 'category', 'designer', 'artist', 'publisher']
+
+# Column name -> SQL type for each table, in the column order of create_tables.sql.
+# The generated game.popularity column is computed by Postgres and not produced here.
+SCHEMA = {
+    'game': {
+        'id': 'int',
+        'title': 'text',
+        'release_year': 'int',
+        'avg_rating': 'real',
+        'bayes_rating': 'real',
+        'total_ratings': 'int',
+        'std_ratings': 'real',
+        'min_players': 'int',
+        'max_players': 'int',
+        'min_playtime': 'int',
+        'max_playtime': 'int',
+        'min_age': 'int',
+        'weight': 'real',
+        'owned_copies': 'int',
+        'wishlist': 'int',
+        'kickstarter': 'bool'
+    },
+    'game_description': {'game_id': 'int', 'description': 'text'},
+    **{name: {'id': 'int', 'name': 'text'} for name in CLASS_TYPES},
+    **{f'game_{name}': {'game_id': 'int', f'{name}_id': 'int'} for name in CLASS_TYPES}
+}
+
+PRIMARY_KEYS = {
+    'game': ('id',),
+    'game_description': ('game_id',),
+    **{name: ('id',) for name in CLASS_TYPES},
+    **{f'game_{name}': ('game_id', f'{name}_id') for name in CLASS_TYPES}
+}
+
+# Table -> (column, referenced table) of each foreign key
+FOREIGN_KEYS = {
+    'game_description': [('game_id', 'game')],
+    **{f'game_{name}': [('game_id', 'game'), (f'{name}_id', name)] for name in CLASS_TYPES}
+}
+
+# Tables mapping games to their classifications
+RELATIONSHIP_TABLES = [f'game_{name}' for name in CLASS_TYPES]
+
+# Tables with foreign keys to other tables, loaded after the tables they reference
+DEPENDENT_TABLES = ['game_description', *RELATIONSHIP_TABLES]
+
+# Tables referenced by foreign keys
+PARENT_TABLES = [name for name in SCHEMA if name not in DEPENDENT_TABLES]
+
+# SQL type -> (array.array typecode, numpy dtype); text columns are kept in lists
+TYPECODES = {
+    'int': ('i', np.intc),
+    'real': ('f', np.float32),
+    'bool': ('b', np.bool_)
+}
+
+# NULL stands in typed buffers; text columns hold None. bool columns are never NULL.
+INT_NULL = int(np.iinfo(np.intc).min)
+NULLS = {'int': INT_NULL, 'real': float('nan')}
+
+
+class TableBuffer:
+    """Append-only columnar buffer holding the rows of one output table
+
+    Numeric columns are stored in typed array.array buffers and text columns in
+    plain lists, so no per-row objects are kept. The buffer is converted to a
+    DataFrame once, after all rows have been appended. None values are stored as
+    INT_NULL in int columns and NaN in real columns, and are NULL in the output.
+    """
+
+    __slots__ = ('name', 'columns', 'buffers')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.columns = SCHEMA[name]
+        self.buffers = [array(TYPECODES[sql_type][0]) if sql_type in TYPECODES else []
+                        for sql_type in self.columns.values()]
+
+    def __len__(self) -> int:
+        return len(self.buffers[0])
+
+    @classmethod
+    def from_dataframe(cls, name: str, dataframe: DataFrame) -> 'TableBuffer':
+        """Build a buffer from a DataFrame holding the columns of the table"""
+        table = cls(name)
+        for index, (column, sql_type) in enumerate(table.columns.items()):
+            if sql_type in TYPECODES:
+                values = dataframe[column].to_numpy(TYPECODES[sql_type][1], na_value=NULLS.get(sql_type))
+                table.buffers[index].frombytes(values.tobytes())
+            else:
+                table.buffers[index] = dataframe[column].to_numpy().tolist()
+        return table
+
+    def append(self, row: tuple) -> None:
+        """Append one row, given as a tuple in column order"""
+        if None in row:
+            row = tuple(NULLS.get(sql_type) if value is None else value
+                        for value, sql_type in zip(row, self.columns.values()))
+        for buffer, value in zip(self.buffers, row):
+            buffer.append(value)
+
+    def extend(self, other: 'TableBuffer') -> None:
+        """Append all rows of another buffer for the same table"""
+        for buffer, values in zip(self.buffers, other.buffers):
+            buffer.extend(values)
+
+    def unique(self) -> 'TableBuffer':
+        """Return a copy of the buffer without duplicate rows, keeping first occurrences"""
+        result = TableBuffer(self.name)
+        seen = set()
+        for row in self.rows():
+            if row not in seen:
+                seen.add(row)
+                result.append(row)
+        return result
+
+    def rows(self) -> Iterable[tuple]:
+        """Iterate over buffered rows as tuples in column order"""
+        return zip(*self.buffers)
+
+    def sql_rows(self) -> Iterable[tuple]:
+        """Iterate over buffered rows as tuples in column order, with None for NULL values"""
+        columns = []
+        for buffer, sql_type in zip(self.buffers, self.columns.values()):
+            nulls = self._nulls(buffer, sql_type)
+            if nulls is not None and nulls.any():
+                buffer = [None if null else value for value, null in zip(buffer, nulls.tolist())]
+            columns.append(buffer)
+        return zip(*columns)
+
+    @staticmethod
+    def _nulls(buffer, sql_type: str) -> Optional[np.ndarray]:
+        """Mask of NULL values in a typed buffer, None for column types without NULL stands"""
+        if sql_type == 'int':
+            return np.asarray(buffer) == INT_NULL
+        if sql_type == 'real':
+            return np.isnan(np.asarray(buffer))
+        return None
+
+    def row(self, index: int) -> tuple:
+        """Row at index, as a tuple in column order"""
+        return tuple(buffer[index] for buffer in self.buffers)
+
+    def take(self, indices: np.ndarray) -> 'TableBuffer':
+        """Return a new buffer holding the rows at the given indices, in that order"""
+        result = TableBuffer(self.name)
+        for column, (buffer, sql_type) in enumerate(zip(self.buffers, self.columns.values())):
+            if sql_type in TYPECODES:
+                result.buffers[column].frombytes(np.asarray(buffer)[indices].tobytes())
+            else:
+                result.buffers[column] = [buffer[index] for index in indices.tolist()]
+        return result
+
+    def key_array(self) -> np.ndarray:
+        """Primary key of every row as one int64, packing two-column keys into 32 bits each"""
+        keys = [np.asarray(self.buffers[list(self.columns).index(column)], dtype=np.int64)
+                for column in PRIMARY_KEYS[self.name]]
+        if len(keys) == 1:
+            return keys[0]
+        return (keys[0] << 32) | (keys[1] & 0xFFFFFFFF)
+
+    def value_hashes(self) -> np.ndarray:
+        """Hash of the non-key columns of every row, zero for tables without any
+
+        Numeric columns are hashed by value, with every NaN (NULL) and -0.0
+        hashed alike, as Python hashes NaN by object identity. Hashes are only
+        comparable within one process, as str hashes are salted.
+        """
+        keys = PRIMARY_KEYS[self.name]
+        hashes = np.zeros(len(self), dtype=np.uint64)
+        for (column, sql_type), buffer in zip(self.columns.items(), self.buffers):
+            if column in keys:
+                continue
+            if sql_type == 'real':
+                values = np.asarray(buffer, dtype=np.float32) + np.float32(0)
+                values[np.isnan(values)] = np.nan
+                column_hashes = values.view(np.uint32).astype(np.uint64)
+            elif sql_type in TYPECODES:
+                column_hashes = np.asarray(buffer).astype(np.int64).view(np.uint64)
+            else:
+                column_hashes = np.fromiter(map(hash, buffer), dtype=np.int64, count=len(self)).view(np.uint64)
+            hashes = hashes * np.uint64(1000003) ^ column_hashes
+        return hashes.view(np.int64)
+
+    def to_dataframe(self) -> DataFrame:
+        """Build a DataFrame with column dtypes matching the table's SQL types
+
+        int columns holding NULL values get the nullable Int32 dtype, real columns hold NaN.
+        """
+        data = {}
+        for (column, sql_type), buffer in zip(self.columns.items(), self.buffers):
+            if sql_type == 'int' and INT_NULL in buffer:
+                values = np.array(buffer, dtype=np.intc)
+                data[column] = IntegerArray(values, values == INT_NULL)
+            elif sql_type in TYPECODES:
+                data[column] = np.array(buffer, dtype=TYPECODES[sql_type][1])
+            else:
+                data[column] = np.array(buffer, dtype=object)
+        return DataFrame(data, columns=list(self.columns))
+
+
+class Deduplicator:
+    """Drop rows whose primary key was already seen, across any number of buffers
+
+    Keys are compared as int64 arrays: the keys seen so far are kept sorted,
+    each new buffer is checked against them with a binary search, and repeated
+    keys within a buffer are found with one np.unique pass. Memory grows with
+    the number of distinct keys, not with the number of rows seen.
+
+    A dropped row whose other columns differ from the kept row, such as a
+    classification id seen with two names, is a conflict. The first occurrence
+    is kept and the dropped row is recorded, so conflicts can be reported
+    instead of producing duplicate primary keys.
+    """
+
+    __slots__ = ('name', 'keys', 'hashes', 'conflict_count', 'conflicts', 'max_conflicts')
+
+    def __init__(self, name: str, max_conflicts: int = 100):
+        self.name = name
+        self.keys = np.empty(0, dtype=np.int64)
+        self.hashes = np.empty(0, dtype=np.int64)
+        self.conflict_count = 0
+        self.conflicts: List[Tuple[tuple, tuple]] = []
+        self.max_conflicts = max_conflicts
+
+    def __call__(self, table: TableBuffer) -> TableBuffer:
+        """Return the rows of table with keys not seen before, keeping first occurrences"""
+        keys = table.key_array()
+        hashes = table.value_hashes()
+
+        positions = np.searchsorted(self.keys, keys)
+        seen = positions < len(self.keys)
+        seen[seen] = self.keys[positions[seen]] == keys[seen]
+        prior = np.flatnonzero(seen)
+        self._record(table, prior[self.hashes[positions[prior]] != hashes[prior]])
+
+        candidates = np.flatnonzero(~seen)
+        new_keys, first, inverse = np.unique(keys[candidates], return_index=True, return_inverse=True)
+        firsts = candidates[first]
+        first_of_candidates = firsts[inverse.ravel()]
+        repeated = first_of_candidates != candidates
+        self._record(table, candidates[repeated][hashes[candidates[repeated]] != hashes[first_of_candidates[repeated]]])
+
+        insert_at = np.searchsorted(self.keys, new_keys)
+        self.keys = np.insert(self.keys, insert_at, new_keys)
+        self.hashes = np.insert(self.hashes, insert_at, hashes[firsts])
+        return table.take(np.sort(firsts))
+
+    def _record(self, table: TableBuffer, indices: np.ndarray) -> None:
+        self.conflict_count += len(indices)
+        for index in indices[:max(0, self.max_conflicts - len(self.conflicts))].tolist():
+            row = table.row(index)
+            self.conflicts.append((tuple(row[list(table.columns).index(column)]
+                                         for column in PRIMARY_KEYS[self.name]), row))
+
+
+def new_tables() -> Dict[str, TableBuffer]:
+    """Create an empty buffer for every output table"""
+    return {name: TableBuffer(name) for name in SCHEMA}
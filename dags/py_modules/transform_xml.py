@@ -1,11 +1,20 @@
 """ETL Pipeline for game batch XML -> csv"""
 
-import re
+import gzip
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from pandas import DataFrame, concat
+from typing import Any, BinaryIO, Dict, Generator, Iterable, Iterator, List, Optional, Tuple, Union
+from pandas import DataFrame
 from bs4 import BeautifulSoup
+from lxml import etree
+from . import metrics, parquet
+from .description import clean_description
+from .records import FIELD_INDEX, GAME_FIELDS, GameRecord, MalformedGame
+from .tables import CLASS_TYPES, DEPENDENT_TABLES, PARENT_TABLES, SCHEMA, Deduplicator, TableBuffer, new_tables
 
-CLASS_TYPES = ['mechanic', 'category', 'designer', 'artist', 'publisher']
+LINK_TYPES = {f'boardgame{name}': name for name in CLASS_TYPES}
+
+KICKSTARTER_FAMILY_ID = '8374'
 
 
 def transform_game_data(game_soup: BeautifulSoup) -> DataFrame:
@@ -17,26 +26,11 @@ def transform_game_data(game_soup: BeautifulSoup) -> DataFrame:
     Returns:
         pd.DataFrame: Game data as Pandas DataFrame
     """
-    raw = {
-        'id': [int(game_soup.attrs['id'])],
-        'title': [game_soup.find('name').attrs['value']],
-        'release_year': [int(game_soup.yearpublished.attrs['value'])],
-        'avg_rating': [float(game_soup.find('average').attrs['value'])],
-        'bayes_rating': [float(game_soup.find('bayesaverage').attrs['value'])],
-        'total_ratings': [int(game_soup.find('usersrated').attrs['value'])],
-        'std_ratings': [float(game_soup.find('stddev').attrs['value'])],
-        'min_players': [int(game_soup.minplayers.attrs['value'])],
-        'max_players': [int(game_soup.maxplayers.attrs['value'])],
-        'min_playtime': [int(game_soup.minplaytime.attrs['value'])],
-        'max_playtime': [int(game_soup.maxplaytime.attrs['value'])],
-        'min_age': [int(game_soup.find('minage').attrs['value'])],
-        'weight': [float(game_soup.find('averageweight').attrs['value'])],
-        'owned_copies': [int(game_soup.find('owned').attrs['value'])],
-        'wishlist': [int(game_soup.find('wishing').attrs['value'])],
-        'kickstarter': [bool(game_soup.find('link', id='8374'))]
-    }
+    pairs = ((tag.name, tag.attrs.get('value')) for tag in game_soup.find_all(True))
+    record = GameRecord.from_pairs(int(game_soup.attrs['id']), pairs,
+                                   bool(game_soup.find('link', id=KICKSTARTER_FAMILY_ID)))
 
-    return DataFrame.from_dict(raw)
+    return DataFrame.from_records([record], columns=GameRecord._fields)
 
 
 def transform_game_description(game_soup: BeautifulSoup) -> DataFrame:
@@ -48,15 +42,9 @@ def transform_game_description(game_soup: BeautifulSoup) -> DataFrame:
     Returns:
         pd.DataFrame: Game description as Pandas DataFrame
     """
-    desc = str(game_soup.find('description').string)
-    desc = re.sub(r'&rsquo;', '\'', desc)
-    desc = re.sub(r'&#.{,5};', ' ', desc)
-    desc = re.sub(r' {2,}', ' ', desc)
-    desc = desc.strip()
-
     raw = {
         'game_id': [int(game_soup.attrs['id'])],
-        'description': [desc]
+        'description': [clean_description(str(game_soup.find('description').string))]
     }
 
     return DataFrame.from_dict(raw)
@@ -93,38 +81,289 @@ def transform_class_map(name: str, game_soup: BeautifulSoup) -> DataFrame:
     return DataFrame.from_records(raw, columns=['game_id', f'{name}_id'])
 
 
+def batch_files(xml_dir: Path) -> List[Path]:
+    """List the plain and gzip-compressed XML batch files in a directory, sorted by name"""
+    return sorted([*xml_dir.glob('*.xml'), *xml_dir.glob('*.xml.gz')])
+
+
+def iter_items(xml_file: Union[Path, BinaryIO]) -> Generator[etree._Element, None, None]:
+    """Incrementally parse a batch file, yielding one <item> element at a time
+
+    Each item is cleared, and detached from the tree, once the consumer moves on
+    to the next one, so memory use depends on a single item rather than the batch.
+
+    Args:
+        xml_file (Path): XML batch file returned by the BGGXMLAPI2, gzip-compressed if
+            its name ends with .gz, or a binary file object
+
+    Returns:
+        Yields game items as lxml elements
+    """
+    if isinstance(xml_file, Path) and xml_file.suffix == '.gz':
+        with gzip.open(xml_file, 'rb') as file:
+            yield from iter_items(file)
+        return
+
+    source = str(xml_file) if isinstance(xml_file, Path) else xml_file
+    for _, item in etree.iterparse(source, events=('end',), tag='item'):
+        yield item
+        item.clear()
+        while item.getprevious() is not None:
+            del item.getparent()[0]
+
+
+class _ItemFields:
+    """Fields of a game item, gathered as its elements are read"""
+
+    __slots__ = ('raw', 'kickstarter', 'description', 'links')
+
+    def __init__(self):
+        self.raw = [None] * len(GAME_FIELDS)
+        self.kickstarter = False
+        self.description = None
+        self.links = []
+
+    def read(self, elem: etree._Element) -> None:
+        """Record a link, the description or the first value of a game field"""
+        tag = elem.tag
+        if tag == 'link':
+            name = LINK_TYPES.get(elem.get('type'))
+            if name is not None:
+                self.links.append((name, int(elem.get('id')), str(elem.get('value'))))
+            elif elem.get('id') == KICKSTARTER_FAMILY_ID:
+                self.kickstarter = True
+        elif tag == 'description':
+            self.description = clean_description(elem.text or '')
+        else:
+            index = FIELD_INDEX.get(tag)
+            if index is not None and self.raw[index] is None:
+                self.raw[index] = elem.get('value')
+
+
+def parse_item(item: etree._Element,
+               tables: Optional[Dict[str, TableBuffer]] = None) -> Dict[str, TableBuffer]:
+    """Extract rows for every output table from a game item in a single pass
+
+    Rows are only appended once the whole item has been read, so a malformed
+    game, one missing a required field or holding an unconvertible value, is
+    counted and skipped without leaving partial rows behind.
+
+    Args:
+        item (etree._Element): Game data as lxml element
+        tables (dict): Table buffers to append rows to, new buffers are created if None
+
+    Returns:
+        dict: Table buffers keyed by table name
+    """
+    if tables is None:
+        tables = new_tables()
+    game_id = int(item.get('id'))
+    fields = _ItemFields()
+
+    try:
+        for elem in item.iter():
+            fields.read(elem)
+        record = GameRecord.from_values(game_id, fields.raw, fields.kickstarter)
+    except (MalformedGame, TypeError, ValueError):
+        metrics.count('games.malformed')
+        return tables
+
+    tables['game'].append(record)
+    if fields.description is not None:
+        tables['game_description'].append((game_id, fields.description))
+    for name, class_id, value in fields.links:
+        tables[name].append((class_id, value))
+        tables[f'game_{name}'].append((game_id, class_id))
+    return tables
+
+
+def report_malformed(xml_file: Path, count: int) -> None:
+    """Print the number of malformed games skipped in a batch file"""
+    if count:
+        print(f'{xml_file.name}: skipped {count} malformed games')
+
+
 def save_df(dataframe: DataFrame, destination_path: Path) -> None:
     """Save DataFrame to csv file"""
     with open(destination_path, 'w', encoding='utf-8') as file:
         dataframe.to_csv(file, index=False)
 
 
-def main(xml_dir: Path, csv_dir: Path) -> None:
-    """Transform XML game data to CSV files"""
-    games = []
-    game_desc = []
-    classifications = {item: [] for item in CLASS_TYPES}
-    class_maps = {item: [] for item in CLASS_TYPES}
+# Intermediate file format -> function saving a table's DataFrame to a file
+OUTPUT_FORMATS = {
+    'csv': save_df,
+    'parquet': parquet.save_df
+}
+
+
+def transform_file(xml_file: Path) -> Dict[str, TableBuffer]:
+    """Transform a single XML batch file into table buffers
+
+    Classification tables are deduplicated within the file, to keep the partial
+    result small when it is sent back from a worker process.
+
+    Args:
+        xml_file (Path): XML batch file returned by the BGGXMLAPI2
+
+    Returns:
+        dict: Table buffers keyed by table name
+    """
+    tables = new_tables()
+    items = 0
+    for item in iter_items(xml_file):
+        parse_item(item, tables)
+        items += 1
+    report_malformed(xml_file, items - len(tables['game']))
+    for name in CLASS_TYPES:
+        tables[name] = tables[name].unique()
+    return tables
+
+
+def _transform_file_counted(xml_file: Path) -> Tuple[Dict[str, TableBuffer], Dict[str, int]]:
+    """Transform a batch file in a worker process, returning the counters it recorded with the tables"""
+    with metrics.recording() as report:
+        tables = transform_file(xml_file)
+    return tables, report.counters
+
 
-    for xml_file in xml_dir.glob('*.xml'):
+def transform_files(xml_files: List[Path], workers: int = 1) -> Iterator[Dict[str, TableBuffer]]:
+    """Transform batch files, in a process pool if more than one worker is given
+
+    Returns:
+        Yields table buffers for each file, in the order of xml_files
+    """
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for tables, counters in executor.map(_transform_file_counted, xml_files):
+                for name, value in counters.items():
+                    metrics.count(name, value)
+                yield tables
+    else:
+        yield from map(transform_file, xml_files)
+
+
+def report_conflicts(dedups: Dict[str, Deduplicator]) -> None:
+    """Print rows dropped for repeating the primary key of a row with other values"""
+    for name, dedup in dedups.items():
+        if not dedup.conflict_count:
+            continue
+        metrics.count(f'conflicts.{name}', dedup.conflict_count)
+        print(f'{name}: dropped {dedup.conflict_count} rows conflicting with an earlier row of the same key')
+        for key, row in dedup.conflicts:
+            print(f'  {key}: {row}')
+
+
+def merge_tables(partials: Iterable[Dict[str, TableBuffer]]) -> Dict[str, TableBuffer]:
+    """Merge partial results in order, dropping rows whose primary key was already seen
 
-        with xml_file.open() as file:
-            batch = BeautifulSoup(file, features='xml')
+    Args:
+        partials (iterable): Table buffers keyed by table name, as yielded by transform_files
 
-        for game_soup in batch.items.children:
-            if game_soup != '\n':
-                games.append(transform_game_data(game_soup))
-                game_desc.append(transform_game_description(game_soup))
-                for name, data in classifications.items():
-                    data.append(transform_game_classification(name, game_soup))
-                for name, data in class_maps.items():
-                    data.append(transform_class_map(name, game_soup))
+    Returns:
+        dict: Table buffers with unique primary keys, keyed by table name
+    """
+    tables = new_tables()
+    dedups = {name: Deduplicator(name) for name in SCHEMA}
+    for partial in partials:
+        for name, table in partial.items():
+            tables[name].extend(dedups[name](table))
+    report_conflicts(dedups)
+    return tables
 
-    save_df(concat(games).drop_duplicates(), csv_dir / 'game.csv')
-    save_df(concat(game_desc).drop_duplicates(), csv_dir / 'game_description.csv')
 
-    for name, dfs in classifications.items():
-        save_df(concat(dfs).drop_duplicates(), csv_dir / f'{name}.csv')
+def stream_tables(xml_files: List[Path], chunk_games: int = 1000) -> Iterator[Dict[str, TableBuffer]]:
+    """Stream table rows from batch files in bounded chunks
+
+    Duplicates are dropped across the whole stream, keeping first occurrences:
+    games are skipped by game id before being parsed, and classifications are
+    dropped by classification id.
+
+    Args:
+        xml_files (list): XML batch files returned by the BGGXMLAPI2
+        chunk_games (int): Max number of games per chunk
+
+    Returns:
+        Yields table buffers holding the rows of up to chunk_games games
+    """
+    seen_games = set()
+    dedups = {name: Deduplicator(name) for name in CLASS_TYPES}
+
+    def finish(tables: Dict[str, TableBuffer]) -> Dict[str, TableBuffer]:
+        for name in CLASS_TYPES:
+            tables[name] = dedups[name](tables[name])
+            tables[f'game_{name}'] = tables[f'game_{name}'].unique()
+        return tables
+
+    tables = new_tables()
+    for xml_file in xml_files:
+        malformed = 0
+        for item in iter_items(xml_file):
+            game_id = int(item.get('id'))
+            if game_id in seen_games:
+                continue
+            seen_games.add(game_id)
+            games = len(tables['game'])
+            parse_item(item, tables)
+            malformed += len(tables['game']) == games
+            if len(tables['game']) >= chunk_games:
+                yield finish(tables)
+                tables = new_tables()
+        report_malformed(xml_file, malformed)
+    if len(tables['game']):
+        yield finish(tables)
+    report_conflicts(dedups)
+
+
+def write_tables(tables: Dict[str, TableBuffer], csv_dir: Path, output_format: str = 'csv') -> List[Dict[str, Any]]:
+    """Save every table to a file, releasing each buffer once written
+
+    Args:
+        tables (dict): Table buffers keyed by table name, emptied as they are written
+        csv_dir (Path): Directory to save CSV or Parquet files to
+        output_format (str): 'csv' or 'parquet', see parquet.py
+
+    Returns:
+        list: Manifest of the files written, with the table name, path and row
+            count of each, tables referenced by foreign keys first
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format {output_format}')
+    save = OUTPUT_FORMATS[output_format]
+
+    manifest = []
+    for name in [*PARENT_TABLES, *DEPENDENT_TABLES]:
+        dataframe = tables.pop(name).to_dataframe()
+        path = csv_dir / f'{name}.{output_format}'
+        save(dataframe, path)
+        metrics.count(f'rows.{name}', len(dataframe))
+        manifest.append({'table': name, 'path': str(path), 'rows': len(dataframe)})
+    return manifest
+
+
+def main(xml_dir: Path, csv_dir: Path, workers: int = 1, output_format: str = 'csv') -> List[Dict[str, Any]]:
+    """Transform XML game data to CSV or Parquet files
+
+    Batch files are streamed with iter_items, and every item is visited once by
+    parse_item, which appends to columnar buffers for all output tables. With
+    more than one worker, batch files are transformed in a process pool. Partial
+    results are merged in file order and deduplicated globally by primary key,
+    so the output is the same for any number of workers.
+
+    Args:
+        xml_dir (Path): Directory containing XML batch files
+        csv_dir (Path): Directory to save CSV or Parquet files to
+        workers (int): Number of worker processes to transform batch files with
+        output_format (str): 'csv' or 'parquet', see parquet.py
+
+    Returns:
+        list: Manifest of the files written, see write_tables
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format {output_format}')
+
+    with metrics.stage('transform_xml'):
+        with metrics.stage('transform_xml.parse'):
+            tables = merge_tables(transform_files(batch_files(xml_dir), workers))
 
-    for name, dfs in class_maps.items():
-        save_df(concat(dfs).drop_duplicates(), csv_dir / f'game_{name}.csv')
+        with metrics.stage('transform_xml.write'):
+            return write_tables(tables, csv_dir, output_format)
@@ -0,0 +1,105 @@
+"""Materialized aggregate views for dashboard queries
+
+One view per classification type holds, for every classification, the number
+of games, their average Bayes rating and the quartiles and maximum of their
+popularity. Views are created once and then refreshed CONCURRENTLY, which
+keeps them readable during the refresh, and only when a table they are built
+from changed in the load.
+"""
+
+from contextlib import closing
+from typing import Callable, Dict, Iterable, List, Optional
+from . import metrics
+from .finalize import run_parallel
+from .tables import CLASS_TYPES
+
+# View name -> (SELECT statement, unique key column, tables the view is built from)
+VIEWS = {
+    f'{name}_stats': (
+        f'SELECT c.id AS {name}_id, c.name, COUNT(*) AS games, '
+        f'AVG(g.bayes_rating) AS avg_bayes_rating, '
+        f'percentile_cont(ARRAY[0.25, 0.5, 0.75]) WITHIN GROUP (ORDER BY g.popularity) AS popularity_quartiles, '
+        f'MAX(g.popularity) AS max_popularity '
+        f'FROM {name} AS c JOIN game_{name} AS gc ON gc.{name}_id = c.id JOIN game AS g ON g.id = gc.game_id '
+        f'GROUP BY c.id, c.name',
+        f'{name}_id',
+        (name, f'game_{name}', 'game')
+    )
+    for name in CLASS_TYPES
+}
+
+
+def changed_views(changes: Dict[str, int]) -> List[str]:
+    """Views built from at least one table with changed rows
+
+    Args:
+        changes (dict): Table name -> number of rows inserted, updated or deleted
+
+    Returns:
+        list: View names
+    """
+    return [view for view, (_, _, sources) in VIEWS.items() if any(changes.get(table) for table in sources)]
+
+
+def load_changes(results: Iterable[dict]) -> Dict[str, int]:
+    """Changed rows per table from the results of load tasks
+
+    Args:
+        results (iterable): Dicts with the table name under 'table' and row counts,
+            such as 'loaded', or 'inserted', 'updated' and 'deleted'
+
+    Returns:
+        dict: Table name -> total of the row counts
+    """
+    changes = {}
+    for result in results:
+        counts = [value for key, value in result.items() if key != 'table']
+        changes[result['table']] = changes.get(result['table'], 0) + sum(counts)
+    return changes
+
+
+def create_views(cursor) -> List[str]:
+    """Create missing views, with the unique index REFRESH CONCURRENTLY requires
+
+    Returns:
+        list: Names of the views created, which already hold current data
+    """
+    cursor.execute('SELECT matviewname FROM pg_matviews WHERE matviewname = ANY(%s)', (list(VIEWS),))
+    existing = {row[0] for row in cursor.fetchall()}
+    created = []
+    for view, (select, key, _) in VIEWS.items():
+        if view in existing:
+            continue
+        with metrics.stage(f'views.create.{view}'):
+            cursor.execute(f'CREATE MATERIALIZED VIEW {view} AS {select}')
+            cursor.execute(f'CREATE UNIQUE INDEX {view}_key ON {view} ({key})')
+        created.append(view)
+    return created
+
+
+def main(connect: Callable, changes: Optional[Dict[str, int]] = None, workers: int = 4) -> Dict[str, float]:
+    """Create missing views and refresh those built from changed tables
+
+    Args:
+        connect (callable): Opens a new psycopg2 connection
+        changes (dict): Table name -> number of changed rows, see load_changes;
+            every view is refreshed if None
+        workers (int): Max number of views refreshed at once, each on its own connection
+
+    Returns:
+        dict: View name -> wall time of its refresh in seconds
+    """
+    with metrics.stage('views'):
+        with closing(connect()) as conn:
+            with conn.cursor() as cursor:
+                created = create_views(cursor)
+            conn.commit()
+
+        stale = list(VIEWS) if changes is None else changed_views(changes)
+        groups = {view: [(f'refresh.{view}', f'REFRESH MATERIALIZED VIEW CONCURRENTLY {view}')]
+                  for view in stale if view not in created}
+        timings = run_parallel(connect, groups, workers, prefix='views')
+
+    metrics.count('views.refreshed', len(groups))
+    print(f'Created {created or "no views"}, refreshed {list(groups) or "no views"}')
+    return timings
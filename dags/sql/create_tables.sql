@@ -1,28 +1,15 @@
 /* Create boardgames table structure
 
-This script is intended for use on a staging database, and will drop all
-existing tables and recreate from scratch.
+Tables that already exist are left untouched, so this script can be run before
+merge loads. For a full reload on a staging database, run drop_tables.sql first.
 
-FK constraints are also disabled for loading purposes, and should be added after
-loading with the enable_fk_constraints.sql script.
+Tables are created without primary keys, indexes or FK constraints, so bulk
+loads do not maintain them row by row. They are added after loading by the
+finalize module (dags/py_modules/finalize.py).
 */
 
-DROP TABLE IF EXISTS
-    game_artist,
-    game_category,
-    game_designer,
-    game_mechanic,
-    game_publisher,
-    game_description,
-    game,
-    artist,
-    designer,
-    publisher,
-    category,
-    mechanic;
-
-CREATE TABLE game (
-    id              int PRIMARY KEY,
+CREATE TABLE IF NOT EXISTS game (
+    id              int NOT NULL,
     title           text NOT NULL,
     release_year    int,
     avg_rating      real,
@@ -41,95 +28,57 @@ CREATE TABLE game (
     popularity      real GENERATED ALWAYS AS (LN(ABS((bayes_rating - 5.5) * total_ratings) + 1) * SIGN((bayes_rating - 5.5))) STORED
 );
 
-CREATE TABLE mechanic (
-    id     int PRIMARY KEY,
+CREATE TABLE IF NOT EXISTS mechanic (
+    id     int NOT NULL,
     name   text NOT NULL
 );
 
-CREATE TABLE category (
-    id      int PRIMARY KEY,
+CREATE TABLE IF NOT EXISTS category (
+    id      int NOT NULL,
     name    text NOT NULL
 );
 
-CREATE TABLE artist (
-    id     int PRIMARY KEY,
+CREATE TABLE IF NOT EXISTS artist (
+    id     int NOT NULL,
     name   text NOT NULL
 );
 
-CREATE TABLE publisher (
-    id      int PRIMARY KEY,
+CREATE TABLE IF NOT EXISTS publisher (
+    id      int NOT NULL,
     name    text NOT NULL
 );
 
-CREATE TABLE designer (
-    id     int PRIMARY KEY,
+CREATE TABLE IF NOT EXISTS designer (
+    id     int NOT NULL,
     name   text NOT NULL
 );
 
-CREATE TABLE game_description (
-    game_id         int PRIMARY KEY,
+CREATE TABLE IF NOT EXISTS game_description (
+    game_id         int NOT NULL,
     description     text NOT NULL
-    -- CONSTRAINT fk_game_id
-    --     FOREIGN KEY(game_id) 
-    --     REFERENCES game(id)
 );
 
-CREATE TABLE game_mechanic (
-    game_id      int,
-    mechanic_id  int,
-    PRIMARY KEY (game_id, mechanic_id)
-    -- CONSTRAINT fk_game_id
-    --     FOREIGN KEY(game_id) 
-    --     REFERENCES game(id),
-    -- CONSTRAINT fk_mech_id
-    --     FOREIGN KEY(mechanic_id) 
-    --     REFERENCES mechanic(id)
+CREATE TABLE IF NOT EXISTS game_mechanic (
+    game_id      int NOT NULL,
+    mechanic_id  int NOT NULL
 );
 
-CREATE TABLE game_category (
-    game_id     int,
-    category_id int,
-    PRIMARY KEY (game_id, category_id)
-    -- CONSTRAINT fk_game_id
-    --     FOREIGN KEY(game_id) 
-    --     REFERENCES game(id),
-    -- CONSTRAINT fk_cat_id
-    --     FOREIGN KEY(category_id) 
-    --     REFERENCES category(id)
+CREATE TABLE IF NOT EXISTS game_category (
+    game_id     int NOT NULL,
+    category_id int NOT NULL
 );
 
-CREATE TABLE game_designer (
-    game_id     int,
-    designer_id int,
-    PRIMARY KEY (game_id, designer_id)
-    -- CONSTRAINT fk_game_id
-    --     FOREIGN KEY(game_id) 
-    --     REFERENCES game(id),
-    -- CONSTRAINT fk_cat_id
-    --     FOREIGN KEY(designer_id) 
-    --     REFERENCES designer(id)
+CREATE TABLE IF NOT EXISTS game_designer (
+    game_id     int NOT NULL,
+    designer_id int NOT NULL
 );
 
-CREATE TABLE game_artist (
-    game_id     int,
-    artist_id   int,
-    PRIMARY KEY (game_id, artist_id)
-    -- CONSTRAINT fk_game_id
-    --     FOREIGN KEY(game_id) 
-    --     REFERENCES game(id),
-    -- CONSTRAINT fk_cat_id
-    --     FOREIGN KEY(artist_id) 
-    --     REFERENCES artist(id)
+CREATE TABLE IF NOT EXISTS game_artist (
+    game_id     int NOT NULL,
+    artist_id   int NOT NULL
 );
 
-CREATE TABLE game_publisher (
-    game_id     int,
-    publisher_id   int,
-    PRIMARY KEY (game_id, publisher_id)
-    -- CONSTRAINT fk_game_id
-    --     FOREIGN KEY(game_id) 
-    --     REFERENCES game(id),
-    -- CONSTRAINT fk_cat_id
-    --     FOREIGN KEY(publisher_id) 
-    --     REFERENCES publisher(id)
+CREATE TABLE IF NOT EXISTS game_publisher (
+    game_id     int NOT NULL,
+    publisher_id   int NOT NULL
 );
\ No newline at end of file
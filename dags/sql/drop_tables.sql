@@ -0,0 +1,22 @@
+/* Drop boardgames tables
+
+This script is intended for use on a staging database, and will drop all
+existing tables so they can be recreated from scratch with create_tables.sql.
+Views built on the tables are dropped with them, and recreated by the views
+module (dags/py_modules/views.py).
+*/
+
+DROP TABLE IF EXISTS
+    game_artist,
+    game_category,
+    game_designer,
+    game_mechanic,
+    game_publisher,
+    game_description,
+    game,
+    artist,
+    designer,
+    publisher,
+    category,
+    mechanic
+CASCADE;
@@ -0,0 +1,208 @@
+"""In-memory Postgres stand-in for tests, handing out psycopg2-like connections
+
+Every connection shares one SQLite database. Statements run on SQLite after
+rewriting the few Postgres constructs it lacks, so tests can check the rows
+the pipeline's own SQL leaves behind. Statements SQLite cannot run, such as
+catalog queries, are answered by a responder function instead. Transactions
+are not isolated: SQLite runs in autocommit mode and commits are only counted.
+"""
+
+import csv
+import json
+import re
+import sqlite3
+from hashlib import md5
+from io import StringIO
+from threading import Lock
+from typing import Callable, List, Optional
+
+# (sql, params) -> rows to return, or None to run the statement on SQLite
+Responder = Callable[[str, Optional[tuple]], Optional[List[tuple]]]
+
+# Postgres syntax -> SQLite equivalent. Array parameters are passed as JSON.
+REWRITES = [
+    (r'= ANY\(%s\)', 'IN (SELECT value FROM json_each(%s))'),
+    (r'%s', '?'),
+    (r"E'\\n'", 'char(10)'),
+    (r'IS DISTINCT FROM', 'IS NOT'),
+    (r'USING GIN ', ''),
+    (r'CREATE TEMP TABLE (\w+) \(LIKE (\w+) INCLUDING DEFAULTS\) ON COMMIT DROP',
+     r'CREATE TEMP TABLE \1 AS SELECT * FROM \2 WHERE 0')
+]
+
+# Statements with no SQLite equivalent and nothing to check, which do nothing
+IGNORED = re.compile(r'ALTER TABLE \w+ ADD CONSTRAINT .* PRIMARY KEY|ALTER INDEX ')
+
+# SELECT ARRAY(subquery), run as the subquery with its rows gathered into a list
+SELECT_ARRAY = re.compile(r'SELECT ARRAY\((.*)\)$')
+
+# Upsert counting inserted and updated rows by xmax, which SQLite lacks
+UPSERT_COUNTS = re.compile(r'WITH merged AS \((INSERT INTO (\w+) .* FROM (\w+)) (ON CONFLICT \(([^)]*)\) .*) '
+                           r'RETURNING xmax = 0 AS inserted\) SELECT COUNT.*')
+
+COPY_FROM = re.compile(r'COPY (\w+) \(([^)]*)\) FROM STDIN')
+COPY_TO = re.compile(r'COPY (?:(\w+) \(([^)]*)\)|\((.*)\)) TO STDOUT')
+
+
+def _to_tsvector(config: str, text: str) -> str:
+    """Stand-in for to_tsvector: the sorted distinct lower-cased words of text"""
+    return ' '.join(sorted(set(re.findall(r'\w+', text.lower()))))
+
+
+def _setweight(vector: str, weight: str) -> str:
+    """Stand-in for setweight: each word of vector labelled with weight, space-terminated"""
+    return ''.join(f'{word}:{weight} ' for word in vector.split())
+
+
+class FakePostgres:
+    """Shared state of the connections returned by `connect`
+
+    `statements` records every statement run, `copied` the rows each COPY
+    FROM STDIN received by table, and `chunks` the chunks it read them in.
+    """
+
+    def __init__(self, responder: Optional[Responder] = None):
+        self.responder = responder
+        self.statements: List[str] = []
+        self.copied = {}
+        self.chunks: List[str] = []
+        self.commits = 0
+        self.lock = Lock()
+        self.db = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+        self.db.create_function('md5', 1, lambda text: md5(text.encode('utf-8')).hexdigest())
+        self.db.create_function('to_tsvector', 2, _to_tsvector)
+        self.db.create_function('setweight', 2, _setweight)
+
+    def connect(self) -> 'FakeConnection':
+        """Open a new connection to the shared database"""
+        return FakeConnection(self)
+
+    def query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """Run a statement on the SQLite database directly, to set up or check rows"""
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def execute(self, sql: str, params: Optional[tuple] = None):
+        """Record a statement and run it, returning its rows and row count"""
+        with self.lock:
+            self.statements.append(sql)
+        if self.responder is not None:
+            rows = self.responder(sql, params)
+            if rows is not None:
+                return rows, len(rows)
+        return self._run(sql, params)
+
+    def _run(self, sql: str, params: Optional[tuple] = None):
+        """Run a statement on SQLite, returning its rows and row count"""
+        if IGNORED.match(sql):
+            return [], -1
+        array = SELECT_ARRAY.match(sql)
+        if array:
+            rows, _ = self._run(array.group(1), params)
+            return [([row[0] for row in rows],)], 1
+        upsert = UPSERT_COUNTS.match(sql)
+        if upsert:
+            return self._upsert_counts(*upsert.groups())
+        for pattern, replacement in REWRITES:
+            sql = re.sub(pattern, replacement, sql)
+        params = tuple(json.dumps(param) if isinstance(param, list) else param for param in params or ())
+        with self.lock:
+            cursor = self.db.execute(sql, params)
+            return cursor.fetchall(), cursor.rowcount
+
+    def _upsert_counts(self, insert: str, table_name: str, stage: str, conflict: str, keys: str):
+        """Run an upsert, returning its inserted and updated row counts as Postgres would from xmax
+
+        Rows are inserted if no row shares their key beforehand, and the other
+        rows the upsert returns were updated.
+        """
+        match = ' AND '.join(f'{table_name}.{key} = {stage}.{key}' for key in keys.split(', '))
+        new_rows, _ = self._run(f'SELECT COUNT(*) FROM {stage} WHERE NOT EXISTS '
+                                f'(SELECT 1 FROM {table_name} WHERE {match})')
+        # WHERE true tells SQLite the ON CONFLICT clause belongs to the INSERT, not to the SELECT
+        changed, _ = self._run(f'{insert} WHERE true {conflict} RETURNING 1')
+        inserted = new_rows[0][0]
+        return [(inserted, len(changed) - inserted)], 1
+
+    def copy_from(self, sql: str, file, size: int) -> int:
+        """Receive the CSV rows of COPY FROM STDIN, inserting them if the table exists"""
+        with self.lock:
+            self.statements.append(sql)
+        table_name, columns = COPY_FROM.match(sql).groups()
+        chunks = []
+        while chunk := file.read(size):
+            chunks.append(chunk.decode() if isinstance(chunk, bytes) else chunk)
+        rows = list(csv.reader(StringIO(''.join(chunks))))
+        with self.lock:
+            self.chunks.extend(chunks)
+            self.copied.setdefault(table_name, []).extend(rows)
+            exists = self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ? UNION ALL "
+                                     "SELECT 1 FROM sqlite_temp_master WHERE type = 'table' AND name = ?",
+                                     (table_name, table_name)).fetchone()
+            if exists:
+                placeholders = ', '.join('?' for _ in columns.split(','))
+                self.db.executemany(f'INSERT INTO {table_name} ({columns}) VALUES ({placeholders})', rows)
+        return len(rows)
+
+    def copy_to(self, sql: str, file) -> int:
+        """Write the rows of COPY TO STDOUT as tab-separated lines"""
+        table_name, columns, query = COPY_TO.match(sql).groups()
+        rows, _ = self.execute(query or f'SELECT {columns} FROM {table_name}')
+        file.write(''.join('\t'.join(str(value) for value in row) + '\n' for row in rows))
+        return len(rows)
+
+
+class FakeCursor:
+    """psycopg2-like cursor of a FakeConnection"""
+
+    def __init__(self, postgres: FakePostgres):
+        self.postgres = postgres
+        self.rows: List[tuple] = []
+        self.rowcount = -1
+
+    def __enter__(self) -> 'FakeCursor':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def execute(self, sql: str, params: Optional[tuple] = None) -> None:
+        self.rows, self.rowcount = self.postgres.execute(sql, params)
+
+    def copy_expert(self, sql: str, file, size: int = 8192) -> None:
+        if 'TO STDOUT' in sql:
+            self.rowcount = self.postgres.copy_to(sql, file)
+        else:
+            self.rowcount = self.postgres.copy_from(sql, file, size)
+
+    def fetchall(self) -> List[tuple]:
+        return self.rows
+
+    def fetchone(self) -> Optional[tuple]:
+        return self.rows[0] if self.rows else None
+
+
+class FakeConnection:
+    """psycopg2-like connection to a FakePostgres"""
+
+    def __init__(self, postgres: FakePostgres):
+        self.postgres = postgres
+        self.autocommit = False
+        self.closed = False
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self.postgres)
+
+    def commit(self) -> None:
+        """Count the commit, and drop temporary tables as ON COMMIT DROP does"""
+        with self.postgres.lock:
+            self.postgres.commits += 1
+            temp_tables = self.postgres.db.execute("SELECT name FROM sqlite_temp_master WHERE type = 'table'")
+            for (name,) in temp_tables.fetchall():
+                self.postgres.db.execute(f'DROP TABLE temp.{name}')
+
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
@@ -0,0 +1,68 @@
+import time
+from bs4 import BeautifulSoup
+from dags.py_modules import metrics
+from dags.py_modules.batching import AdaptiveBatcher
+from dags.py_modules.extract_xml import scrape_game_pages
+from benchmarks.stub_server import StubServer
+
+
+def test_record_grows_and_shrinks():
+    batcher = AdaptiveBatcher(100, min_size=20, max_size=130, target_latency=1.0, step=20)
+    assert batcher.record(100, 0.5) == 120
+    assert batcher.record(120, 0.5) == 130
+    # A request cut before the last resize says nothing about the current size
+    assert batcher.record(100, 0.5) == 130
+    assert batcher.record(130, 2.0) == 65
+    assert batcher.record(65, 0.1, failed=True) == 32
+    assert batcher.record(32, 0.1, failed=True) == 20
+
+
+def test_record_shrinks_on_large_response():
+    batcher = AdaptiveBatcher(100, max_bytes=1000)
+    assert batcher.record(100, 0.1, num_bytes=999) == 110
+    assert batcher.record(110, 0.1, num_bytes=2000) == 55
+
+
+def test_batches_follow_current_size():
+    batcher = AdaptiveBatcher(2, min_size=1, step=1)
+    game_ids = [str(num) for num in range(10)]
+    batches = batcher.batches(game_ids)
+    assert next(batches) == '0,1'
+    batcher.record(2, 0.0)
+    assert next(batches) == '2,3,4'
+    assert list(batches) == ['5,6,7', '8,9']
+
+
+def test_fetch_records_failures():
+    batcher = AdaptiveBatcher(40, min_size=10)
+
+    def fail(id_batch):
+        raise ValueError(id_batch)
+
+    try:
+        batcher.fetch(fail, ','.join(['1'] * 40))
+    except ValueError:
+        pass
+    assert batcher.size == 20
+
+
+def test_scrape_game_pages_adapts_to_latency():
+    def respond(path, query):
+        ids = query['id'].split(',')
+        time.sleep(0.002 * len(ids))
+        items = ''.join(f'<item type="boardgame" id="{game_id}"/>' for game_id in ids)
+        return 200, f'<items>{items}</items>'.encode(), {}
+
+    game_ids = [str(num) for num in range(1, 501)]
+    batcher = AdaptiveBatcher(5, min_size=5, max_size=200, target_latency=0.05, step=5)
+    with metrics.recording() as report, StubServer(respond) as server:
+        batches = list(scrape_game_pages(game_ids, 5, workers=2, base_url=server.url, batcher=batcher))
+
+    fetched = [item['id'] for batch in batches for item in BeautifulSoup(batch, features='xml').find_all('item')]
+    assert fetched == game_ids
+    sizes = [len(query['id'].split(',')) for _, query in server.requests]
+    assert max(sizes) > 5
+    # Batches of 25 ids take the target latency, so batch sizes stay well below max_size
+    assert max(sizes) < 100
+    assert report.counters['api.batch_shrinks'] > 0
+    assert report.to_dict()['samples']['api.batch_size']['count'] == len(batches)
@@ -0,0 +1,28 @@
+from lxml import etree
+from benchmarks import bench_pipeline, synthetic
+from dags.py_modules.extract_game_ids import extract_ranked_game_ids
+from dags.py_modules.transform_xml import parse_item
+
+
+def test_synthetic_item_parses():
+    pools = synthetic.class_pools(100)
+    item = etree.fromstring(synthetic.game_item(1234, pools))
+    tables = parse_item(item)
+    assert len(tables['game']) == 1
+    assert len(tables['game_description']) == 1
+    assert len(tables['game_mechanic']) >= 1
+    assert synthetic.game_item(1234, pools) == synthetic.game_item(1234, pools)
+
+
+def test_synthetic_browse_page():
+    ids = synthetic.game_ids(150)
+    assert extract_ranked_game_ids(synthetic.browse_page(2, ids)) == ids[100:]
+    assert extract_ranked_game_ids(synthetic.browse_page(3, ids)) == []
+
+
+def test_bench_pipeline_run():
+    result = bench_pipeline.run(50, batch_size=20, workers=2)
+    assert result['rows']['game'] == 50
+    assert result['api']['api.requests'] == 3
+    assert set(result['stages']) == {'generate', 'fetch_ids', 'fetch_xml', 'parse', 'transform', 'write_csv',
+                                     'similarity', 'load'}
@@ -1,5 +1,9 @@
 import re
+from time import sleep
+import pytest
+from requests import HTTPError, exceptions
 from dags.py_modules import bggxmlapi2
+from benchmarks.stub_server import StubServer
 
 
 def test_build_query():
@@ -45,3 +49,49 @@ def test_fetch_game_batch():
     pattern = re.compile(r'<item type="boardgame" id="\d+">')
     items_search = re.findall(pattern, str(text))
     assert len(items_search) == 3
+
+
+def test_build_query_base_url():
+    test_query_url = bggxmlapi2.build_query('thing', {'id': 1}, base_url='http://127.0.0.1:8000')
+    assert test_query_url == 'http://127.0.0.1:8000/thing?id=1'
+
+
+def test_fetch_game_retry():
+    statuses = [202, 429, 200]
+
+    def respond(path, query):
+        status = statuses.pop(0)
+        body = f'<items><item type="boardgame" id="{query["id"]}"/></items>' if status == 200 else ''
+        return status, body.encode(), {}
+
+    with StubServer(respond) as server:
+        text = bggxmlapi2.fetch_game('150', backoff=0, base_url=server.url)
+    assert '<item type="boardgame" id="150"/>' in text
+    assert len(server.requests) == 3
+
+
+def test_fetch_game_retries_exhausted():
+    with StubServer(lambda path, query: (429, b'', {})) as server:
+        with pytest.raises(HTTPError):
+            bggxmlapi2.fetch_game('150', retries=2, backoff=0, base_url=server.url)
+    assert len(server.requests) == 3
+
+
+def test_fetch_game_retries_timeout():
+    delays = [0.5, 0]
+
+    def respond(path, query):
+        sleep(delays.pop(0))
+        return 200, f'<items><item type="boardgame" id="{query["id"]}"/></items>'.encode(), {}
+
+    with StubServer(respond) as server:
+        text = bggxmlapi2.fetch_game('150', backoff=0, base_url=server.url, timeout=(1, 0.1))
+    assert '<item type="boardgame" id="150"/>' in text
+    assert len(server.requests) == 2
+
+
+def test_fetch_game_connection_errors_exhausted():
+    with StubServer(lambda path, query: (200, b'', {})) as server:
+        url = server.url
+    with pytest.raises(exceptions.ConnectionError):
+        bggxmlapi2.fetch_game('150', retries=2, backoff=0, base_url=url)
@@ -0,0 +1,99 @@
+from pathlib import Path
+from dags.py_modules.cache import DAY, GameCache, commit_pending, join_items, max_age, split_items
+from dags.py_modules.extract_xml import main
+from dags.py_modules.transform_xml import iter_items
+from benchmarks.stub_server import StubServer
+
+
+def _items_xml(ratings: dict) -> str:
+    items = ''.join(f'<item type="boardgame" id="{game_id}"><usersrated value="{value}"/></item>'
+                    for game_id, value in ratings.items())
+    return f'<?xml version="1.0" encoding="utf-8"?><items>{items}</items>'
+
+
+def test_max_age():
+    policy = ((10, 1), (None, 7))
+    assert max_age(1, policy) == DAY
+    assert max_age(10, policy) == DAY
+    assert max_age(11, policy) == 7 * DAY
+    assert max_age(11, ((10, 1),)) == 0
+
+
+def test_split_join_items():
+    pairs = split_items(_items_xml({1: 5, 2: 6}))
+    assert [game_id for game_id, _ in pairs] == [1, 2]
+    joined = join_items([fragment for _, fragment in pairs]).encode()
+    test_file = Path('tests/assets/tmp_items.xml')
+    test_file.write_bytes(joined)
+    assert [item.get('id') for item in iter_items(test_file)] == ['1', '2']
+    test_file.unlink()
+
+
+def test_cache_update_and_stale_ids():
+    db_path = Path('tests/assets/tmp_cache.db')
+    db_path.unlink(missing_ok=True)
+    policy = ((1, 1), (None, 7))
+
+    with GameCache(db_path) as cache:
+        assert len(cache.update(_items_xml({1: 5, 2: 6}), now=0)) == 2
+        assert cache.commit_pending() == 2
+        assert len(cache.update(_items_xml({1: 5, 2: 7}), now=0)) == 1, 'Unchanged game reported'
+        assert cache.commit_pending() == 2
+        assert b'value="7"' in cache.get(2)
+        assert cache.get(3) is None
+
+        assert cache.stale_ids(['1', '2', '3'], policy, now=DAY / 2) == ['3']
+        assert cache.stale_ids(['1', '2', '3'], policy, now=DAY) == ['1', '3']
+        assert cache.stale_ids(['1', '2', '3'], policy, now=7 * DAY) == ['1', '2', '3']
+        # Within a shard, games keep their rank among all games
+        assert cache.stale_ids(['1', '2'], policy, now=DAY, ranks=[2, 5]) == []
+
+    db_path.unlink()
+
+
+def test_pending_games_until_commit(tmp_path):
+    db_path = tmp_path / 'cache.db'
+    policy = ((None, 7),)
+
+    with GameCache(db_path) as cache:
+        cache.update(_items_xml({1: 5}), now=0)
+        # A run failing before its load leaves the game stale, and changed when refetched
+        assert cache.stale_ids(['1'], policy, now=0) == ['1']
+        assert cache.get(1) is None
+        assert cache.discard_pending() == 1
+        assert len(cache.update(_items_xml({1: 5}), now=0)) == 1
+
+    assert commit_pending([db_path, tmp_path / 'missing.db']) == 1
+    with GameCache(db_path) as cache:
+        assert cache.stale_ids(['1'], policy, now=0) == []
+        assert cache.update(_items_xml({1: 5}), now=0) == []
+
+
+def test_main_with_cache():
+    ratings = {game_id: 100 for game_id in range(1, 7)}
+
+    def respond(path, query):
+        ids = [int(game_id) for game_id in query['id'].split(',')]
+        return 200, _items_xml({game_id: ratings[game_id] for game_id in ids}).encode(), {}
+
+    tmp_dir = Path('tests/assets/tmp_dir_c')
+    ids_file = tmp_dir / 'ids.csv'
+    db_path = tmp_dir / 'cache.db'
+    tmp_dir.mkdir(exist_ok=True)
+    ids_file.write_text('\n'.join(str(game_id) for game_id in ratings) + '\n')
+
+    with StubServer(respond) as server:
+        main(ids_file, tmp_dir, batch_size=2, cache_path=db_path, policy=((None, 0),), base_url=server.url)
+        assert len(list(tmp_dir.glob('*.xml.gz'))) == 3
+        commit_pending([db_path])
+
+        ratings[5] = 101
+        main(ids_file, tmp_dir, batch_size=2, cache_path=db_path, policy=((None, 0),), base_url=server.url)
+
+    batches = list(tmp_dir.glob('*.xml.gz'))
+    assert [batch.name for batch in batches] == ['bgg_games_batch_02.xml.gz']
+    assert [item.get('id') for item in iter_items(batches[0])] == ['5']
+
+    for path in tmp_dir.iterdir():
+        path.unlink()
+    tmp_dir.rmdir()
@@ -0,0 +1,35 @@
+import ast
+import json
+from pathlib import Path
+
+DAG_FILE = Path('dags/bgg_pipeline_dag.py')
+
+
+def _module_level_imports(tree):
+    """Names of the modules imported outside of any function"""
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            names.append(node.module)
+    return names
+
+
+def test_dag_defers_pipeline_imports():
+    tree = ast.parse(DAG_FILE.read_text())
+    imports = _module_level_imports(tree)
+    assert not [name for name in imports if name.startswith('py_modules')]
+    assert not {'pandas', 'numpy', 'lxml', 'psycopg2'} & {name.split('.')[0] for name in imports}
+
+
+def test_dag_reads_one_variable():
+    source = DAG_FILE.read_text()
+    assert source.count('Variable.get(') == 1
+    variables = json.loads(Path('configs/airflow_variables.json').read_text())
+    assert list(variables) == ['bgg_pipeline']
+    keys = set(variables['bgg_pipeline'])
+    required = {node.slice.value
+                for node in ast.walk(ast.parse(source))
+                if isinstance(node, ast.Subscript) and getattr(node.value, 'id', None) == 'CONFIG'}
+    assert required <= keys
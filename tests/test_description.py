@@ -0,0 +1,26 @@
+from lxml import etree
+from dags.py_modules.description import clean_description
+
+
+def test_clean_description_decodes_entities():
+    assert clean_description('Take a &pound;30 loan&#10;&#10;New &quot;Sell&quot; system') == \
+        'Take a £30 loan New "Sell" system'
+    assert clean_description('Wallace&rsquo;s caf&eacute; &#x1F3B2; &#039;dice&#039;') == "Wallace’s café 🎲 'dice'"
+    assert clean_description('Fish &amp; Chips &amp;amp; more') == 'Fish & Chips &amp; more'
+
+
+def test_clean_description_collapses_whitespace():
+    assert clean_description('  one&#10; &#9;two \n\n three&nbsp;&nbsp;four  ') == 'one two three four'
+    assert clean_description('') == ''
+
+
+def test_clean_description_keeps_unknown_entities():
+    assert clean_description('R&D &bogus; AT&T;') == 'R&D &bogus; AT&T;'
+
+
+def test_clean_description_fixture():
+    desc = etree.parse('tests/assets/test_xml.xml').findtext('.//description')
+    cleaned = clean_description(desc)
+    assert 'Take a £30 loan' in cleaned
+    assert 'New "Sell" system' in cleaned
+    assert '&' not in cleaned and '\n' not in cleaned
@@ -1,9 +1,13 @@
+import re
 from pathlib import Path
+from bs4 import BeautifulSoup
 from requests import Session
 from dags.py_modules.extract_game_ids import authenticate
 from dags.py_modules.extract_game_ids import scrape_browse_pages
 from dags.py_modules.extract_game_ids import extract_ranked_game_ids
 from dags.py_modules.extract_game_ids import main
+from dags.py_modules.extract_game_ids import checkpoint_path
+from benchmarks.stub_server import StubServer
 
 
 def test_authenticate():
@@ -17,6 +21,28 @@ def test_extract_ranked_game_ids():
     assert all(map(str.isnumeric, id_list))
 
 
+def _soup_ranked_game_ids(text):
+    """Reference implementation of extract_ranked_game_ids using BeautifulSoup"""
+    id_list = []
+    for row in BeautifulSoup(text, features='html.parser').find_all(id="row_"):
+        rank = row.find(class_='collection_rank')
+        if rank is not None and rank.a:
+            href = row.find(class_='primary').attrs['href']
+            id_list.append(re.search(r'/boardgame/(\d+)/', href).group(1))
+    return id_list
+
+
+def test_extract_ranked_game_ids_matches_soup():
+    with open('tests/assets/test_browse_page.html', 'r') as file:
+        test_html = file.read()
+    assert extract_ranked_game_ids(test_html) == _soup_ranked_game_ids(test_html)
+
+    unranked_html = re.sub(r'<a name="\d+"></a>\s*\d+', 'N/A', test_html, count=5)
+    id_list = extract_ranked_game_ids(unranked_html)
+    assert len(id_list) == 95
+    assert id_list == _soup_ranked_game_ids(unranked_html)
+
+
 def test_scrape_browse_pages():
     id_list = list(scrape_browse_pages(max_pages=2, wait_time=0))[0]
     print(id_list)
@@ -32,3 +58,97 @@ def test_main():
         id_list = file.read().split('\n')
     assert all(map(str.isnumeric, id_list[:-1])), 'Unexpected content found in game-id file'
     test_csv.unlink()
+
+
+def _browse_responder(requested_pages):
+    with open('tests/assets/test_browse_page.html', 'r') as file:
+        ranked_page = file.read().encode()
+
+    def respond(path, query):
+        if path == '/login/api/v1':
+            return 204, b'', {}
+        page_num = int(path.rsplit('/', 1)[1])
+        requested_pages.append(page_num)
+        return 200, ranked_page if page_num < 4 else b'<html><table></table></html>', {}
+
+    return respond
+
+
+def test_scrape_browse_pages_stops_and_resumes():
+    checkpoint = Path('tests/assets/tmp_browse.checkpoint')
+    checkpoint.unlink(missing_ok=True)
+    requested_pages = []
+    first_page = extract_ranked_game_ids(open('tests/assets/test_browse_page.html').read())
+
+    with StubServer(_browse_responder(requested_pages)) as server:
+        pages = list(scrape_browse_pages(max_pages=20, wait_time=0, workers=3, checkpoint_path=checkpoint,
+                                         session=Session(), base_url=server.url))
+        assert pages == [first_page] * 3
+        assert sorted(requested_pages) == [1, 2, 3, 4, 5, 6], 'Did not stop after first unranked page'
+
+        requested_pages.clear()
+        pages = list(scrape_browse_pages(max_pages=20, wait_time=0, workers=3, checkpoint_path=checkpoint,
+                                         session=Session(), base_url=server.url))
+        assert pages == [first_page] * 3
+        assert requested_pages == [], 'Checkpointed pages were fetched again'
+
+    checkpoint.unlink()
+
+
+def test_scrape_browse_pages_stops_at_failed_page():
+    checkpoint = Path('tests/assets/tmp_browse_failed.checkpoint')
+    ranked_page = open('tests/assets/test_browse_page.html').read().encode()
+    first_page = extract_ranked_game_ids(ranked_page.decode())
+    failing = {3}
+
+    def respond(path, query):
+        page_num = int(path.rsplit('/', 1)[1])
+        if page_num in failing:
+            return 503, b'Service unavailable', {}
+        return 200, ranked_page if page_num < 5 else b'<html><table></table></html>', {}
+
+    with StubServer(respond) as server:
+        pages = list(scrape_browse_pages(max_pages=20, wait_time=0, workers=1, checkpoint_path=checkpoint,
+                                         session=Session(), base_url=server.url))
+        assert pages == [first_page] * 2, 'Did not stop at the failed page'
+
+        failing.clear()
+        pages = list(scrape_browse_pages(max_pages=20, wait_time=0, workers=1, checkpoint_path=checkpoint,
+                                         session=Session(), base_url=server.url))
+        assert pages == [first_page] * 4, 'Failed page was not fetched again on resume'
+
+    checkpoint.unlink()
+
+
+def test_main_local():
+    test_csv = Path('tests/assets/tmp_game_ids_local.csv')
+    requested_pages = []
+    with StubServer(_browse_responder(requested_pages)) as server:
+        main(destination_path=test_csv, max_pages=10, workers=2, wait_time=0, base_url=server.url)
+
+    id_list = test_csv.read_text().split('\n')[:-1]
+    assert len(id_list) == 300
+    assert all(map(str.isnumeric, id_list))
+    assert not Path('tests/assets/tmp_game_ids_local.csv.checkpoint').exists(), 'Checkpoint was not removed'
+    test_csv.unlink()
+
+
+def test_main_ignores_other_runs_checkpoints():
+    test_csv = Path('tests/assets/tmp_game_ids_runs.csv')
+    stale = checkpoint_path(test_csv, 'scheduled__2022-08-01T00:00:00+00:00')
+    stale.write_text('{"page": 1, "ids": ["1"]}\n')
+    current = checkpoint_path(test_csv, 'manual__2022-08-02T00:00:00+00:00')
+    current.write_text('{"page": 2, "ids": ["2"]}\n')
+    assert stale != current
+
+    requested_pages = []
+    with StubServer(_browse_responder(requested_pages)) as server:
+        main(destination_path=test_csv, max_pages=10, workers=2, wait_time=0, base_url=server.url,
+             run_id='manual__2022-08-02T00:00:00+00:00')
+
+    assert 1 in requested_pages, 'Page checkpointed by another run was not fetched'
+    assert 2 not in requested_pages, 'Page checkpointed by this run was fetched again'
+    id_list = test_csv.read_text().split('\n')[:-1]
+    assert '1' not in id_list and '2' in id_list
+    assert not stale.exists() and not current.exists(), 'Checkpoints were not removed'
+    test_csv.unlink()
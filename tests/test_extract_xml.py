@@ -1,9 +1,17 @@
+import gzip
+import random
+import time
 from pathlib import Path
 from bs4 import BeautifulSoup
-from requests import Response
+from requests import Session
+from dags.py_modules.extract_xml import batch_ids
+from dags.py_modules.extract_xml import download_batch
+from dags.py_modules.extract_xml import download_game_pages
+from dags.py_modules.extract_xml import save_stream
 from dags.py_modules.extract_xml import save_file
 from dags.py_modules.extract_xml import scrape_game_pages
 from dags.py_modules.extract_xml import main
+from benchmarks.stub_server import StubServer
 
 
 def test_save_file() -> None:
@@ -32,6 +40,33 @@ def test_save_file_missing_dir() -> None:
     tmp_file.parent.rmdir()
 
 
+def test_save_stream_gzip() -> None:
+    tmp_file = Path('tests/assets/tmp_file.xml.gz')
+    tmp_file.unlink(missing_ok=True)
+
+    assert save_stream(tmp_file, [b'<items>', b'</items>'])
+    assert gzip.decompress(tmp_file.read_bytes()) == b'<items></items>'
+    assert not Path('tests/assets/tmp_file.xml.gz.tmp').exists(), 'Temp file left behind'
+
+    tmp_file.unlink()
+
+
+def test_save_stream_interrupted() -> None:
+    tmp_file = Path('tests/assets/tmp_file.xml.gz')
+    tmp_file.unlink(missing_ok=True)
+
+    def chunks():
+        yield b'<items>'
+        raise ConnectionError('Connection dropped')
+
+    try:
+        save_stream(tmp_file, chunks())
+    except ConnectionError:
+        pass
+    assert not tmp_file.exists(), 'Partial file was written'
+    assert not Path('tests/assets/tmp_file.xml.gz.tmp').exists(), 'Temp file left behind'
+
+
 def test_scrape_game_pages() -> None:
     game_ids = ['187645', '220308']
     test_res = list(scrape_game_pages(game_ids, 2))[0]
@@ -41,6 +76,65 @@ def test_scrape_game_pages() -> None:
     assert len([x for x in soup.items if x != '\n']) == 2
 
 
+def test_batch_ids() -> None:
+    game_ids = [str(num) for num in range(5)]
+    assert batch_ids(game_ids, 2) == ['0,1', '2,3', '4']
+    assert batch_ids(game_ids, 5) == ['0,1,2,3,4']
+
+
+def test_scrape_game_pages_concurrent() -> None:
+    def respond(path, query):
+        time.sleep(random.random() / 20)
+        items = ''.join(f'<item type="boardgame" id="{game_id}"/>' for game_id in query['id'].split(','))
+        return 200, f'<items>{items}</items>'.encode(), {}
+
+    game_ids = [str(num) for num in range(1, 21)]
+    with StubServer(respond) as server:
+        batches = list(scrape_game_pages(game_ids, 3, workers=4, rate=100, base_url=server.url))
+
+    assert len(batches) == 7
+    for num, batch in enumerate(batches):
+        soup = BeautifulSoup(batch, features='xml')
+        assert [item['id'] for item in soup.find_all('item')] == game_ids[num * 3:num * 3 + 3]
+
+
+def test_download_game_pages() -> None:
+    def respond(path, query):
+        items = ''.join(f'<item type="boardgame" id="{game_id}"/>' for game_id in query['id'].split(','))
+        return 200, f'<items>{items}</items>'.encode(), {}
+
+    tmp_dir = Path('tests/assets/tmp_dir_d')
+    game_ids = [str(num) for num in range(1, 6)]
+    with StubServer(respond) as server:
+        paths = download_game_pages(game_ids, 2, tmp_dir, workers=2, base_url=server.url)
+
+    assert [path.name for path in paths] == [f'bgg_games_batch_0{num}.xml.gz' for num in range(3)]
+    assert b'<item type="boardgame" id="5"/>' in gzip.decompress(paths[2].read_bytes())
+    for path in paths:
+        path.unlink()
+    tmp_dir.rmdir()
+
+
+def test_download_batch_body_cut_short() -> None:
+    body = b'<items>' + b'<item type="boardgame" id="1"/>' * 1000 + b'</items>'
+    attempts = []
+
+    def respond(path, query):
+        attempts.append(query['id'])
+        if len(attempts) < 3:
+            # Promise the whole body, send half of it, then close the connection
+            return 200, body[:len(body) // 2], {'Content-Length': str(len(body))}
+        return 200, body, {}
+
+    tmp_path = Path('tests/assets/tmp_batch_cut_short.xml')
+    with StubServer(respond) as server, Session() as session:
+        path = download_batch('1', tmp_path, session, base_url=server.url, backoff=0)
+
+    assert len(attempts) == 3
+    assert path.read_bytes() == body
+    path.unlink()
+
+
 def test_main():
     tmp_dir = Path('tests/assets/tmp_dir')
     game_ids_path = Path('tests/assets/test_game_ids.csv')
@@ -49,9 +143,9 @@ def test_main():
          destination_dir=tmp_dir,
          batch_size=50)
 
-    saved_files = list(tmp_dir.glob(r'*.xml'))
+    saved_files = list(tmp_dir.glob(r'*.xml.gz'))
     print(saved_files)
-    assert len(saved_files) == 3
+    assert len(saved_files) == 2
     for file in saved_files:
         file.unlink()
     tmp_dir.rmdir()
@@ -0,0 +1,103 @@
+import re
+import threading
+import time
+from dags.py_modules import finalize
+from dags.py_modules.tables import FOREIGN_KEYS, SCHEMA
+from tests.fake_postgres import FakePostgres
+
+
+class _Database:
+    """Responder of a FakePostgres, tracking constraints from the ALTER TABLE statements run"""
+
+    def __init__(self, constraints=None, delay=0.0):
+        self.constraints = dict(constraints or {})
+        self.indexes = set()
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+        self.postgres = FakePostgres(responder=self)
+
+    @property
+    def statements(self):
+        return [sql for sql in self.postgres.statements if 'pg_' not in sql]
+
+    def connect(self):
+        return self.postgres.connect()
+
+    def __call__(self, sql, params=None):
+        if 'pg_constraint' in sql:
+            return [(name, *value) for name, value in self.constraints.items()]
+        if 'pg_indexes' in sql:
+            return [(name,) for name in self.indexes]
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        # Adding a foreign key NOT VALID does not scan the table
+        if 'NOT VALID' not in sql:
+            time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+            table_name = sql.split()[2]
+            if match := re.search(r'ADD CONSTRAINT (\w+) PRIMARY KEY', sql):
+                self.constraints[match.group(1)] = (table_name, 'p', True)
+            elif match := re.search(r'ADD CONSTRAINT (\w+) FOREIGN KEY', sql):
+                self.constraints[match.group(1)] = (table_name, 'f', False)
+            elif match := re.search(r'VALIDATE CONSTRAINT (\w+)', sql):
+                self.constraints[match.group(1)] = (table_name, 'f', True)
+            elif match := re.search(r'DROP CONSTRAINT (\w+)', sql):
+                del self.constraints[match.group(1)]
+            elif match := re.search(r'CREATE INDEX (\w+)', sql):
+                self.indexes.add(match.group(1))
+        return []
+
+
+def test_main_on_fresh_tables():
+    db = _Database()
+    timings = finalize.main(db.connect, workers=4)
+
+    num_fks = sum(len(references) for references in FOREIGN_KEYS.values())
+    assert sum(kind == 'p' for _, kind, _ in db.constraints.values()) == len(SCHEMA)
+    assert sum(kind == 'f' and valid for _, kind, valid in db.constraints.values()) == num_fks
+    assert all('NOT VALID' in sql for sql in db.statements if 'FOREIGN KEY' in sql)
+    # Keys are built first, then all foreign keys are added, then validated
+    kinds = [('key' if 'PRIMARY KEY' in sql or 'INDEX' in sql else 'fk' if 'FOREIGN KEY' in sql else 'validate')
+             for sql in db.statements]
+    assert kinds == sorted(kinds, key=['key', 'fk', 'validate'].index)
+    assert 'validate.game_mechanic_mechanic_id_fkey' in timings
+    assert {'keys', 'foreign_keys', 'validate'} <= set(timings)
+    assert 'CREATE INDEX game_mechanic_mechanic_id_idx ON game_mechanic (mechanic_id, game_id)' in db.statements
+
+
+def test_main_runs_tables_concurrently():
+    db = _Database(delay=0.05)
+    start = time.perf_counter()
+    finalize.main(db.connect, workers=len(SCHEMA))
+    elapsed = time.perf_counter() - start
+
+    assert db.max_running > 1
+    # Run one after another, the key, index and validate statements would take 1.45s
+    assert elapsed < 0.6
+
+
+def test_main_keeps_existing_constraints():
+    db = _Database()
+    finalize.main(db.connect)
+    db.constraints['fk_game_id'] = ('game_mechanic', 'f', True)
+    db.postgres.statements.clear()
+
+    finalize.main(db.connect)
+
+    assert db.statements == ['ALTER TABLE game_mechanic DROP CONSTRAINT fk_game_id']
+
+
+def test_validate_steps_group_by_table():
+    existing = {
+        'game_artist_game_id_fkey': ('game_artist', 'f', False),
+        'game_artist_artist_id_fkey': ('game_artist', 'f', False),
+        'game_category_game_id_fkey': ('game_category', 'f', True)
+    }
+    steps = finalize.validate_steps(existing)
+    assert list(steps) == ['game_artist']
+    assert [step for step, _ in steps['game_artist']] == ['validate.game_artist_artist_id_fkey',
+                                                          'validate.game_artist_game_id_fkey']
@@ -1,7 +1,16 @@
 from pathlib import Path
 import sqlite3
 import pandas as pd
+import pytest
+from dags.py_modules.load import copy_table
 from dags.py_modules.load import load_table
+from dags.py_modules.load import merge_statements
+from dags.py_modules.load import merge_table
+from dags.py_modules.load import read_scope_ids
+from dags.py_modules.load import stream_tables
+from dags.py_modules.tables import new_tables
+from dags.py_modules.transform_xml import main
+from tests.fake_postgres import FakePostgres
 
 
 def test_load_table():
@@ -18,3 +27,102 @@ def test_load_table():
         assert len(csv_df.compare(db_df)) == 0
 
     db_path.unlink()
+
+
+def test_copy_table():
+    csv_path = Path('tests/assets/test_table.csv')
+    postgres = FakePostgres()
+    postgres.query('CREATE TABLE test_table (id int, name text, description text)')
+
+    row_count = copy_table(csv_path=csv_path, conn=postgres.connect(), chunk_size=8)
+
+    assert postgres.statements == ['COPY test_table (id, name, description) FROM STDIN WITH (FORMAT csv)']
+    assert all(len(chunk) <= 8 for chunk in postgres.chunks)
+    loaded = pd.DataFrame(postgres.query('SELECT * FROM test_table'), columns=['id', 'name', 'description'])
+    assert len(pd.read_csv(csv_path).compare(loaded)) == 0
+    assert row_count == 2
+    assert postgres.commits == 1
+
+
+def test_copy_table_parquet(tmp_path):
+    main(xml_dir=Path('tests/assets'), csv_dir=tmp_path, output_format='parquet')
+    postgres = FakePostgres()
+
+    row_count = copy_table(csv_path=tmp_path / 'mechanic.parquet', conn=postgres.connect())
+
+    assert postgres.statements[0] == 'COPY mechanic (id, name) FROM STDIN WITH (FORMAT csv)'
+    assert postgres.copied['mechanic'][0] == ['2040', 'Hand Management']
+    assert row_count == 8
+    assert read_scope_ids(tmp_path / 'game.parquet') == [224517]
+
+
+def test_merge_statements():
+    game = merge_statements('game')
+    assert 'LIKE game' in game['stage']
+    assert 'ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title' in game['upsert']
+    assert 'IS DISTINCT FROM' in game['upsert']
+    assert game['delete'] is None
+
+    mechanics = merge_statements('game_mechanic')
+    assert 'ON CONFLICT (game_id, mechanic_id) DO NOTHING' in mechanics['upsert']
+    assert 'staged.mechanic_id = target.mechanic_id' in mechanics['delete']
+
+    with pytest.raises(ValueError):
+        merge_statements('test_table')
+
+
+def test_merge_table(tmp_path):
+    postgres = FakePostgres()
+    postgres.query('CREATE TABLE mechanic (id int PRIMARY KEY, name text)')
+    postgres.query("INSERT INTO mechanic VALUES (1, 'Dice Rolling'), (2, 'Old Name'), (3, 'Hand Management')")
+    csv_path = tmp_path / 'mechanic.csv'
+    csv_path.write_text('id,name\n2,New Name\n3,Hand Management\n4,Card Drafting\n')
+
+    counts = merge_table(csv_path, postgres.connect())
+
+    assert counts == {'inserted': 1, 'updated': 1, 'deleted': 0}
+    assert postgres.query('SELECT * FROM mechanic ORDER BY id') == [
+        (1, 'Dice Rolling'), (2, 'New Name'), (3, 'Hand Management'), (4, 'Card Drafting')]
+    assert postgres.commits == 1
+
+
+def test_merge_table_relationships(tmp_path):
+    postgres = FakePostgres()
+    postgres.query('CREATE TABLE game_mechanic (game_id int, mechanic_id int, PRIMARY KEY (game_id, mechanic_id))')
+    postgres.query('INSERT INTO game_mechanic VALUES (10, 1), (10, 2), (11, 1), (12, 1)')
+    csv_path = tmp_path / 'game_mechanic.csv'
+    csv_path.write_text('game_id,mechanic_id\n10,1\n10,3\n11,2\n')
+
+    # Without scope ids, only the games in the file are in scope
+    counts = merge_table(csv_path, postgres.connect())
+
+    assert counts == {'inserted': 2, 'updated': 0, 'deleted': 2}
+    assert postgres.query('SELECT * FROM game_mechanic ORDER BY game_id, mechanic_id') == [
+        (10, 1), (10, 3), (11, 2), (12, 1)]
+
+    # A game in scope but absent from the file loses its relationship rows
+    counts = merge_table(csv_path, postgres.connect(), scope_ids=[10, 11, 12])
+
+    assert counts == {'inserted': 0, 'updated': 0, 'deleted': 1}
+    assert postgres.query('SELECT * FROM game_mechanic ORDER BY game_id, mechanic_id') == [(10, 1), (10, 3), (11, 2)]
+
+
+def test_read_scope_ids():
+    assert read_scope_ids(Path('tests/assets/test_table.csv')) == [0, 1]
+
+
+def test_stream_tables():
+    chunks = [new_tables(), new_tables()]
+    chunks[0]['mechanic'].append((1, 'Dice Rolling'))
+    chunks[0]['game_mechanic'].append((10, 1))
+    chunks[1]['game_mechanic'].append((11, 1))
+    postgres = FakePostgres()
+
+    row_counts = stream_tables(chunks, postgres.connect())
+
+    assert row_counts['mechanic'] == 1
+    assert row_counts['game_mechanic'] == 2
+    assert row_counts['game'] == 0
+    assert postgres.statements.count('COPY game_mechanic (game_id, mechanic_id) FROM STDIN WITH (FORMAT csv)') == 2
+    assert postgres.copied == {'mechanic': [['1', 'Dice Rolling']], 'game_mechanic': [['10', '1'], ['11', '1']]}
+    assert postgres.commits == 1
@@ -0,0 +1,50 @@
+import json
+import socket
+from dags.py_modules import metrics
+
+
+def test_stage_records_times_and_rss():
+    report = metrics.RunReport()
+    with report.stage('work'):
+        sum(range(100000))
+    stage = report.stages['work']
+    assert stage['wall_time'] >= 0
+    assert stage['cpu_time'] >= 0
+    assert stage['peak_rss_mb'] > 0
+
+
+def test_recording_collects_module_level_calls(tmp_path):
+    report_path = tmp_path / 'reports' / 'task.json'
+    with metrics.recording(report_path) as report:
+        metrics.count('api.requests')
+        metrics.count('api.requests')
+        metrics.count('api.bytes', 512)
+        metrics.observe('api.latency', 0.25)
+        with metrics.stage('extract'):
+            pass
+    metrics.count('api.requests')
+
+    assert report.counters == {'api.requests': 2, 'api.bytes': 512}
+    saved = json.loads(report_path.read_text())
+    assert saved['counters'] == report.counters
+    assert saved['latencies']['api.latency']['p95'] == 0.25
+    assert 'extract' in saved['stages']
+
+
+def test_summarize():
+    summary = metrics.summarize([float(i) for i in range(1, 101)])
+    assert summary['count'] == 100
+    assert summary['mean'] == 50.5
+    assert summary['max'] == 100
+    assert 50 <= summary['p50'] <= 51
+    assert 95 <= summary['p95'] <= 96
+
+
+def test_push_statsd():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(5)
+        report = metrics.RunReport()
+        report.count('rows.game', 3)
+        report.push_statsd(f'127.0.0.1:{sock.getsockname()[1]}', prefix='test')
+        assert sock.recv(1024) == b'test.rows.game:3|c'
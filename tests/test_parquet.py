@@ -0,0 +1,40 @@
+from pathlib import Path
+import pyarrow as pa
+from dags.py_modules import parquet
+from dags.py_modules.transform_xml import main
+
+
+def test_arrow_schema():
+    schema = parquet.arrow_schema('game')
+    assert schema.names[:3] == ['id', 'title', 'release_year']
+    assert schema.field('id').type == pa.int32()
+    assert schema.field('avg_rating').type == pa.float32()
+    assert schema.field('kickstarter').type == pa.bool_()
+
+
+def test_main_parquet(tmp_path):
+    csv_dir = tmp_path / 'csv'
+    parquet_dir = tmp_path / 'parquet'
+    csv_dir.mkdir()
+    parquet_dir.mkdir()
+    main(xml_dir=Path('tests/assets'), csv_dir=csv_dir)
+    main(xml_dir=Path('tests/assets'), csv_dir=parquet_dir, output_format='parquet')
+
+    for parquet_path in parquet_dir.glob('*.parquet'):
+        table = parquet.read_table(parquet_path)
+        assert table.schema == parquet.arrow_schema(parquet_path.stem)
+        csv_rows = (csv_dir / f'{parquet_path.stem}.csv').read_text(encoding='utf-8').splitlines()[1:]
+        assert parquet.count_rows(parquet_path) == len(csv_rows)
+    assert parquet.read_table(parquet_dir / 'game.parquet', ['id']).column(0).to_pylist() == [224517]
+
+
+def test_iter_csv_chunks(tmp_path):
+    parquet_dir = tmp_path / 'parquet'
+    parquet_dir.mkdir()
+    main(xml_dir=Path('tests/assets'), csv_dir=parquet_dir, output_format='parquet')
+
+    chunks = list(parquet.iter_csv_chunks(parquet_dir / 'publisher.parquet', batch_rows=5))
+    rows = b''.join(chunks).decode().splitlines()
+    assert len(chunks) == 3
+    assert rows[0] == '21765,"Roxley"'
+    assert len(rows) == 14
@@ -0,0 +1,18 @@
+from time import monotonic
+from dags.py_modules.ratelimit import TokenBucket
+
+
+def test_token_bucket_burst():
+    bucket = TokenBucket(rate=1, capacity=3)
+    start = monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert monotonic() - start < 0.5, 'Burst within capacity should not block'
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=20)
+    start = monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert monotonic() - start >= 0.15, 'Requests were not held to the rate'
@@ -0,0 +1,29 @@
+import pytest
+from dags.py_modules.records import GAME_FIELDS, GameRecord, MalformedGame
+from dags.py_modules.tables import SCHEMA
+
+
+def test_record_columns_match_schema():
+    assert GameRecord._fields == tuple(SCHEMA['game'])
+    assert len(GAME_FIELDS) == len(SCHEMA['game']) - 2
+
+
+def test_from_pairs_keeps_first_value():
+    pairs = [('name', 'Primary'), ('name', 'Alternate'), ('usersrated', '12'), ('average', '7.5')]
+    record = GameRecord.from_pairs(1, pairs, kickstarter=True)
+    assert record.title == 'Primary'
+    assert record.total_ratings == 12
+    assert record.avg_rating == 7.5
+    assert record.release_year is None
+    assert record.kickstarter is True
+    assert not hasattr(record, '__dict__')
+
+
+def test_from_pairs_missing_required_field():
+    with pytest.raises(MalformedGame, match='no usersrated'):
+        GameRecord.from_pairs(1, [('name', 'Game')], kickstarter=False)
+
+
+def test_from_pairs_unconvertible_value():
+    with pytest.raises(MalformedGame, match="yearpublished 'soon'"):
+        GameRecord.from_pairs(1, [('name', 'Game'), ('usersrated', '1'), ('yearpublished', 'soon')], False)
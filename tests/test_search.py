@@ -0,0 +1,42 @@
+from dags.py_modules import metrics, search
+from tests.fake_postgres import FakePostgres
+
+
+def _postgres(games):
+    postgres = FakePostgres()
+    postgres.query('CREATE TABLE game (id int PRIMARY KEY, title text)')
+    postgres.query('CREATE TABLE game_description (game_id int PRIMARY KEY, description text)')
+    for game_id, title, description in games:
+        postgres.query('INSERT INTO game VALUES (?, ?)', (game_id, title))
+        postgres.query('INSERT INTO game_description VALUES (?, ?)', (game_id, description))
+    return postgres
+
+
+def test_update_search_only_rebuilds_changed_vectors():
+    postgres = _postgres([(1, 'Brass: Birmingham', 'Build canals and rails'),
+                          (2, 'Ark Nova', 'Plan and build a zoo'),
+                          (3, 'Gloomhaven', 'Tactical combat in a campaign')])
+
+    with metrics.recording() as report:
+        assert search.update_search(postgres.connect()) == {'deleted': 0, 'updated': 3}
+    assert report.counters == {'search.deleted': 0, 'search.updated': 3}
+    assert postgres.commits == 1
+    # Vectors of unchanged games are neither rebuilt nor deleted
+    assert search.update_search(postgres.connect()) == {'deleted': 0, 'updated': 0}
+
+    postgres.query("UPDATE game_description SET description = 'Build a zoo' WHERE game_id = 2")
+    postgres.query('DELETE FROM game_description WHERE game_id = 3')
+    assert search.update_search(postgres.connect()) == {'deleted': 1, 'updated': 1}
+
+    documents = {game_id: set(document.split()) for game_id, document in
+                 postgres.query('SELECT game_id, document FROM game_search')}
+    # Title words are weighted A and description words B
+    assert documents == {1: {'birmingham:A', 'brass:A', 'build:B', 'canals:B', 'and:B', 'rails:B'},
+                         2: {'ark:A', 'nova:A', 'build:B', 'a:B', 'zoo:B'}}
+
+
+def test_search_games():
+    postgres = FakePostgres(responder=lambda sql, params: [(224517, 'Brass: Birmingham', 0.6)])
+    with postgres.connect().cursor() as cursor:
+        assert search.search_games(cursor, 'brass -canal', limit=5) == [(224517, 'Brass: Birmingham', 0.6)]
+    assert "websearch_to_tsquery('english', %s)" in postgres.statements[0]
@@ -0,0 +1,67 @@
+from pathlib import Path
+import pandas as pd
+from benchmarks import synthetic
+from dags.py_modules.extract_xml import read_ranked_game_ids
+from dags.py_modules.shards import merge_shards
+from dags.py_modules.shards import read_table
+from dags.py_modules.shards import run_shard
+from dags.py_modules.shards import shard_cache_path
+from dags.py_modules.shards import shard_ids
+from dags.py_modules.transform_xml import main
+from benchmarks.stub_server import StubServer
+
+
+def test_shard_ids(tmp_path):
+    ids_file = tmp_path / 'game_ids.csv'
+    ids_file.write_text('10\n11\n12\n\n13\n14\n')
+
+    shards = shard_ids(ids_file, 3, tmp_path / 'shards')
+
+    assert [shard['shard'] for shard in shards] == [0, 1, 2]
+    assert Path(shards[0]['game_ids_file']).read_text() == '12,3\n'
+    assert Path(shards[1]['game_ids_file']).read_text() == '10,1\n13,4\n'
+    assert read_ranked_game_ids(Path(shards[1]['game_ids_file'])) == [('10', 1), ('13', 4)]
+    assert Path(shards[2]['xml_dir']).is_dir()
+
+
+def test_shard_cache_path():
+    assert shard_cache_path(Path('data/game_cache.sqlite'), 2) == Path('data/game_cache.shard2.sqlite')
+
+
+def test_read_table(tmp_path):
+    main(xml_dir=Path('tests/assets'), csv_dir=tmp_path)
+    for name in ['game', 'game_description', 'publisher']:
+        table = read_table(name, tmp_path / f'{name}.csv')
+        assert table.to_dataframe().to_csv(index=False) == (tmp_path / f'{name}.csv').read_text(encoding='utf-8')
+
+
+def test_sharded_pipeline(tmp_path):
+    ids = synthetic.game_ids(30)
+    pools = synthetic.class_pools(30)
+    ids_file = tmp_path / 'game_ids.csv'
+    ids_file.write_text(''.join(f'{game_id}\n' for game_id in ids))
+
+    def responder(path, query):
+        return 200, synthetic.thing_xml(query['id'].split(','), pools).encode(), {}
+
+    with StubServer(responder) as server:
+        results = [run_shard(shard, batch_size=4, base_url=server.url)
+                   for shard in shard_ids(ids_file, 3, tmp_path / 'shards')]
+
+    sharded_dir = tmp_path / 'sharded'
+    sharded_dir.mkdir()
+    manifest = merge_shards(results[::-1], sharded_dir)
+
+    unsharded_dir = tmp_path / 'unsharded'
+    unsharded_dir.mkdir()
+    (tmp_path / 'xml').mkdir()
+    synthetic.write_batches(tmp_path / 'xml', 30, seed=0)
+    main(xml_dir=tmp_path / 'xml', csv_dir=unsharded_dir)
+
+    for entry in manifest:
+        sharded = pd.read_csv(entry['path'])
+        unsharded = pd.read_csv(unsharded_dir / f'{entry["table"]}.csv')
+        key = list(sharded.columns[:2])
+        assert len(sharded) == entry['rows'] == len(unsharded), entry['table']
+        assert sharded.sort_values(key).reset_index(drop=True).equals(
+            unsharded.sort_values(key).reset_index(drop=True)), entry['table']
@@ -0,0 +1,106 @@
+import re
+import numpy as np
+import pytest
+from dags.py_modules import metrics, similarity
+from tests.fake_postgres import FakePostgres
+
+
+def _pairs(rows):
+    games, classes = zip(*rows)
+    return np.array(games, np.int32), np.array(classes, np.int32)
+
+
+PAIRS = {
+    'mechanic': _pairs([(10, 1), (10, 2), (20, 1), (20, 2), (30, 1), (40, 3)]),
+    'category': _pairs([(10, 7), (20, 8), (30, 7), (50, 9)]),
+    'designer': _pairs([(10, 100), (30, 100)]),
+    'publisher': _pairs([(40, 200), (50, 200)])
+}
+
+
+def _top_k(matrix, k, chunk_rows):
+    results = [np.concatenate(arrays) for arrays in zip(*similarity.top_k_similar(matrix, k, chunk_rows))]
+    return [tuple(values) for values in zip(*results)]
+
+
+def test_feature_matrix():
+    game_ids, matrix = similarity.feature_matrix(PAIRS)
+
+    assert game_ids.tolist() == [10, 20, 30, 40, 50]
+    assert matrix.shape == (5, 3 + 3 + 1 + 1)
+    np.testing.assert_allclose(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel(), 1, rtol=1e-6)
+
+
+def test_top_k_similar():
+    _, matrix = similarity.feature_matrix(PAIRS)
+    results = _top_k(matrix, k=2, chunk_rows=2)
+
+    by_row = {}
+    for row, rank, other, value in results:
+        by_row.setdefault(row, []).append((rank, other, round(float(value), 4)))
+    # Game 10 shares mechanic 1, category 7 and designer 100 with game 30, and two mechanics with game 20
+    assert by_row[0] == [(1, 2, 0.866), (2, 1, 0.5774)]
+    assert by_row[1] == [(1, 0, 0.5774), (2, 2, 0.3333)]
+    # Games 40 and 50 only share their publisher, and no feature with other games
+    assert by_row[3] == [(1, 4, 0.5)]
+    assert by_row[4] == [(1, 3, 0.5)]
+
+
+def test_top_k_similar_matches_dense_similarity():
+    rng = np.random.default_rng(0)
+    pairs = {name: (rng.integers(0, 300, 2000, dtype=np.int32), rng.integers(0, size, 2000, dtype=np.int32))
+             for name, size in [('mechanic', 20), ('category', 10), ('publisher', 100)]}
+    pairs = {name: tuple(np.unique(np.column_stack(arrays), axis=0).T) for name, arrays in pairs.items()}
+    _, matrix = similarity.feature_matrix(pairs)
+    dense = (matrix @ matrix.T).toarray()
+    np.fill_diagonal(dense, 0)
+
+    results = _top_k(matrix, k=5, chunk_rows=7)
+
+    assert len(results) == 5 * matrix.shape[0]
+    for row, rank, other, value in results:
+        expected = np.lexsort((np.arange(len(dense)), -dense[row]))[rank - 1]
+        assert other == expected
+        assert value == pytest.approx(dense[row, expected], rel=1e-5)
+
+
+def test_cooccurrence():
+    class_ids, other_ids, counts = similarity.cooccurrence(PAIRS['mechanic'])
+    assert sorted(zip(class_ids.tolist(), other_ids.tolist(), counts.tolist())) == [(1, 2, 2), (2, 1, 2)]
+
+
+def _postgres():
+    postgres = FakePostgres()
+    for name, (games, classes) in PAIRS.items():
+        postgres.query(f'CREATE TABLE game_{name} (game_id int, {name}_id int)')
+        for game_id, class_id in zip(games.tolist(), classes.tolist()):
+            postgres.query(f'INSERT INTO game_{name} VALUES (?, ?)', (game_id, class_id))
+    return postgres
+
+
+def test_main_swaps_in_new_tables():
+    postgres = _postgres()
+    postgres.query('CREATE TABLE mechanic_cooccurrence (mechanic_id int)')
+    with metrics.recording() as report:
+        row_counts = similarity.main(postgres.connect, k=2)
+
+    assert row_counts == {'mechanic_cooccurrence': 2, 'category_cooccurrence': 0, 'game_similarity': 8}
+    assert report.counters['rows.game_similarity'] == 8
+    assert postgres.query('SELECT * FROM game_similarity WHERE game_id = 10 ORDER BY rank') == [
+        (10, 1, 30, pytest.approx(0.8660254)), (10, 2, 20, pytest.approx(0.57735026))]
+    assert postgres.query('SELECT * FROM mechanic_cooccurrence ORDER BY mechanic_id') == [(1, 2, 2), (2, 1, 2)]
+    assert not postgres.query("SELECT name FROM sqlite_master WHERE name LIKE '%_new'")
+    # Live tables are only dropped once every new table is loaded, right before the commit
+    swaps = [index for index, sql in enumerate(postgres.statements)
+             if re.fullmatch(r'DROP TABLE IF EXISTS \w+(?<!_new)', sql)]
+    loads = [index for index, sql in enumerate(postgres.statements) if 'ADD CONSTRAINT' in sql]
+    assert len(swaps) == 3 and min(swaps) > max(loads)
+    assert postgres.commits == 2
+
+
+def test_read_pairs_of_empty_table():
+    postgres = FakePostgres()
+    postgres.query('CREATE TABLE game_mechanic (game_id int, mechanic_id int)')
+    with postgres.connect().cursor() as cursor:
+        games, classes = similarity.read_pairs(cursor, 'mechanic')
+    assert len(games) == len(classes) == 0
@@ -1,12 +1,24 @@
+import gzip
+from io import BytesIO
 from pathlib import Path
 import pandas as pd
 from bs4 import BeautifulSoup
+from dags.py_modules import metrics
 from dags.py_modules.transform_xml import transform_game_data
 from dags.py_modules.transform_xml import transform_game_description
 from dags.py_modules.transform_xml import transform_game_classification
 from dags.py_modules.transform_xml import transform_class_map
+from dags.py_modules.transform_xml import iter_items
+from dags.py_modules.transform_xml import parse_item
+from dags.py_modules.transform_xml import transform_file
+from dags.py_modules.tables import SCHEMA
+from dags.py_modules.tables import Deduplicator
+from dags.py_modules.tables import TableBuffer
+from dags.py_modules.tables import new_tables
 from dags.py_modules.transform_xml import save_df
+from dags.py_modules.transform_xml import stream_tables
 from dags.py_modules.transform_xml import main
+from dags.py_modules.transform_xml import merge_tables
 
 
 def _setup_soup():
@@ -39,6 +51,148 @@ def test_transform_class_map():
     assert df.shape == (3, 2)
 
 
+def test_iter_items():
+    items = [item.get('id') for item in iter_items(Path('tests/assets/test_xml.xml'))]
+    assert items == ['224517']
+
+
+def test_iter_items_gzip():
+    gz_file = Path('tests/assets/tmp_test_xml.xml.gz')
+    gz_file.write_bytes(gzip.compress(Path('tests/assets/test_xml.xml').read_bytes()))
+    items = [item.get('id') for item in iter_items(gz_file)]
+    gz_file.unlink()
+    assert items == ['224517']
+
+
+def test_parse_item():
+    soup = _setup_soup().items.item
+    item = next(iter_items(Path('tests/assets/test_xml.xml')))
+    tables = parse_item(item)
+    assert set(tables) == set(SCHEMA)
+
+    game = tables['game'].to_dataframe()
+    assert game.to_csv(index=False) == transform_game_data(soup).to_csv(index=False)
+    description = tables['game_description'].to_dataframe()
+    assert description.to_csv(index=False) == transform_game_description(soup).to_csv(index=False)
+    mechanics = transform_game_classification('mechanic', soup)
+    assert list(tables['mechanic'].rows()) == list(mechanics.itertuples(index=False, name=None))
+    designers = transform_class_map('designer', soup)
+    assert list(tables['game_designer'].rows()) == list(designers.itertuples(index=False, name=None))
+
+
+def test_table_buffer_dtypes():
+    item = next(iter_items(Path('tests/assets/test_xml.xml')))
+    game = parse_item(item)['game'].to_dataframe()
+    assert game.dtypes['id'] == 'int32'
+    assert game.dtypes['avg_rating'] == 'float32'
+    assert game.dtypes['kickstarter'] == 'bool'
+
+
+def test_parse_item_missing_nullable_field():
+    test_xml = Path('tests/assets/test_xml.xml').read_bytes()
+    start = test_xml.index(b'<yearpublished')
+    test_xml = test_xml[:start] + test_xml[test_xml.index(b'/>', start) + 2:]
+    item = next(iter_items(BytesIO(test_xml)))
+
+    tables = parse_item(item)
+
+    game = tables['game'].to_dataframe()
+    assert game['release_year'].isna().all()
+    assert next(tables['game'].sql_rows())[2] is None
+    assert game.to_csv(index=False).splitlines()[1].startswith('224517,Brass: Birmingham,,')
+
+
+def test_parse_item_skips_malformed_game(capsys):
+    test_xml = Path('tests/assets/test_xml.xml').read_bytes().replace(b'<usersrated value="', b'<usersrated value="x')
+    item = next(iter_items(BytesIO(test_xml)))
+
+    with metrics.recording() as report:
+        tables = parse_item(item)
+
+    assert all(len(table) == 0 for table in tables.values())
+    assert report.counters == {'games.malformed': 1}
+    assert capsys.readouterr().out == ''
+
+
+def test_transform_file_summarises_malformed_games(tmp_path, capsys):
+    test_xml = Path('tests/assets/test_xml.xml').read_bytes().replace(b'<usersrated value="', b'<usersrated value="x')
+    xml_file = tmp_path / 'bgg_games_batch_00.xml'
+    xml_file.write_bytes(test_xml)
+
+    tables = transform_file(xml_file)
+    list(stream_tables([xml_file]))
+
+    assert len(tables['game']) == 0
+    assert capsys.readouterr().out.splitlines() == ['bgg_games_batch_00.xml: skipped 1 malformed games'] * 2
+
+
+def test_deduplicator():
+    dedup = Deduplicator('publisher')
+    first, second = new_tables(), new_tables()
+    for row in [(3, 'Roxley'), (1, 'Funforge'), (3, 'Roxley'), (1, 'Funforge Games')]:
+        first['publisher'].append(row)
+    for row in [(2, 'Giant Roc'), (3, 'Roxley Games'), (2, 'Giant Roc')]:
+        second['publisher'].append(row)
+
+    assert list(dedup(first['publisher']).rows()) == [(3, 'Roxley'), (1, 'Funforge')]
+    assert list(dedup(second['publisher']).rows()) == [(2, 'Giant Roc')]
+    assert dedup.conflict_count == 2
+    assert dedup.conflicts == [((1,), (1, 'Funforge Games')), ((3,), (3, 'Roxley Games'))]
+
+
+def test_deduplicator_null_reals():
+    def games():
+        table = TableBuffer('game')
+        for game_id in range(1000):
+            table.append((game_id, 'Game', 2020, None, 5.5, 10, None, 1, 4, 30, 60, 10, None, 100, 5, False))
+        return table
+
+    dedup = Deduplicator('game')
+    dedup(games())
+    assert len(dedup(games())) == 0
+    assert dedup.conflict_count == 0
+
+
+def test_deduplicator_composite_key():
+    tables = new_tables()
+    for row in [(1, 2), (1, 3), (1, 2), (2, 1)]:
+        tables['game_mechanic'].append(row)
+    dedup = Deduplicator('game_mechanic')
+    assert list(dedup(tables['game_mechanic']).rows()) == [(1, 2), (1, 3), (2, 1)]
+    assert dedup.conflict_count == 0
+
+
+def test_merge_tables_reports_conflicts(capsys):
+    partials = [new_tables(), new_tables()]
+    partials[0]['mechanic'].append((2040, 'Hand Management'))
+    partials[1]['mechanic'].append((2040, 'Hand-Management'))
+    partials[1]['mechanic'].append((2041, 'Income'))
+
+    tables = merge_tables(partials)
+
+    assert list(tables['mechanic'].rows()) == [(2040, 'Hand Management'), (2041, 'Income')]
+    assert 'mechanic: dropped 1 rows' in capsys.readouterr().out
+
+
+def test_stream_tables():
+    xml_dir = Path('tests/assets/tmp_dir_s')
+    xml_dir.mkdir(exist_ok=True)
+    test_xml = Path('tests/assets/test_xml.xml').read_text(encoding='utf-8')
+    for num, game_id in enumerate(['1', '2', '1']):
+        batch = xml_dir / f'bgg_games_batch_{num:02}.xml'
+        batch.write_text(test_xml.replace('id="224517"', f'id="{game_id}"'), encoding='utf-8')
+
+    chunks = list(stream_tables(sorted(xml_dir.glob('*.xml')), chunk_games=1))
+
+    assert [list(chunk['game'].rows())[0][0] for chunk in chunks] == [1, 2]
+    assert [len(chunk['mechanic']) for chunk in chunks] == [8, 0]
+    assert [len(chunk['game_mechanic']) for chunk in chunks] == [8, 8]
+
+    for path in xml_dir.iterdir():
+        path.unlink()
+    xml_dir.rmdir()
+
+
 def test_save_df():
     tmp_df = pd.DataFrame({'id': [0, 1], 'col': ['test', 'test2']})
     tmp_file = Path('tests/assets/tmp_file.csv')
@@ -61,9 +215,38 @@ def test_main():
     for file in csv_dir.iterdir():
         file.unlink()
 
-    main(xml_dir=xml_dir, csv_dir=csv_dir)
+    manifest = main(xml_dir=xml_dir, csv_dir=csv_dir)
+    assert [entry['table'] for entry in manifest][:2] == ['game', 'mechanic']
+    assert {entry['table'] for entry in manifest} == set(SCHEMA)
+    assert next(entry for entry in manifest if entry['table'] == 'game_mechanic')['rows'] == 8
+    assert all(Path(entry['path']).exists() for entry in manifest)
     for csv in csv_dir.glob(r'*.csv'):
         df = pd.read_csv(csv)
         assert df.shape[1] > 0
         csv.unlink()
     csv_dir.rmdir()
+
+
+def test_main_workers():
+    xml_dir = Path('tests/assets/tmp_dir_x')
+    xml_dir.mkdir(exist_ok=True)
+    test_xml = Path('tests/assets/test_xml.xml').read_text(encoding='utf-8')
+    for num in range(3):
+        batch = xml_dir / f'bgg_games_batch_{num:02}.xml'
+        batch.write_text(test_xml.replace('id="224517"', f'id="{num}"'), encoding='utf-8')
+
+    serial_dir = xml_dir / 'serial'
+    parallel_dir = xml_dir / 'parallel'
+    serial_dir.mkdir(exist_ok=True)
+    parallel_dir.mkdir(exist_ok=True)
+    main(xml_dir=xml_dir, csv_dir=serial_dir)
+    main(xml_dir=xml_dir, csv_dir=parallel_dir, workers=2)
+
+    for csv in serial_dir.glob('*.csv'):
+        assert csv.read_text() == (parallel_dir / csv.name).read_text(), f'{csv.name} differs'
+    assert len(pd.read_csv(serial_dir / 'game.csv')) == 3
+    assert len(pd.read_csv(serial_dir / 'mechanic.csv')) == 8
+
+    for path in sorted(xml_dir.rglob('*'), reverse=True):
+        path.rmdir() if path.is_dir() else path.unlink()
+    xml_dir.rmdir()
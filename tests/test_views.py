@@ -0,0 +1,37 @@
+from dags.py_modules import views
+from tests.fake_postgres import FakePostgres
+
+
+def _postgres(existing):
+    """FakePostgres with the given views, running every other statement as a no-op"""
+    return FakePostgres(responder=lambda sql, params: [(view,) for view in existing] if 'pg_matviews' in sql else [])
+
+
+def test_changed_views():
+    assert views.changed_views({'mechanic': 0, 'game_mechanic': 3}) == ['mechanic_stats']
+    assert views.changed_views({'game_description': 5}) == []
+    assert views.changed_views({'game': 1}) == list(views.VIEWS)
+
+
+def test_load_changes():
+    results = [{'table': 'game', 'inserted': 1, 'updated': 2, 'deleted': 0},
+               {'table': 'mechanic', 'loaded': 4}]
+    assert views.load_changes(results) == {'game': 3, 'mechanic': 4}
+
+
+def test_main_refreshes_changed_views():
+    postgres = _postgres(existing=['mechanic_stats', 'category_stats'])
+    timings = views.main(postgres.connect, {'game_mechanic': 2, 'game_category': 0})
+
+    assert list(timings) == ['refresh.mechanic_stats']
+    refreshes = [sql for sql in postgres.statements if sql.startswith('REFRESH')]
+    assert refreshes == ['REFRESH MATERIALIZED VIEW CONCURRENTLY mechanic_stats']
+    created = [sql.split()[3] for sql in postgres.statements if sql.startswith('CREATE MATERIALIZED VIEW')]
+    assert created == ['designer_stats', 'artist_stats', 'publisher_stats']
+    assert 'CREATE UNIQUE INDEX designer_stats_key ON designer_stats (designer_id)' in postgres.statements
+
+
+def test_main_skips_refresh_of_created_views():
+    postgres = _postgres(existing=[])
+    assert views.main(postgres.connect) == {}
+    assert not any(sql.startswith('REFRESH') for sql in postgres.statements)